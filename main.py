@@ -1,76 +1,4151 @@
+import time
+STARTUP_BEGIN = time.perf_counter()
 import os
 import json
+import copy
 import uuid
+import hashlib
+import gzip
+import bisect
+import queue
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+import importlib.util
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import pandas as pd
 import shutil
+import subprocess
+import sys
+import zipfile
+import io
+import re
+import argparse
+import html
+import multiprocessing
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+import xml.etree.ElementTree as ET
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, ExitStack
 from datetime import datetime, timedelta
 
+# pandas/numpy（含 openpyxl）載入需要數百毫秒，啟動時先顯示首頁再於背景載入，見 load_heavy_modules
+np = pd = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 選用套件：縮圖（pillow）與 PDF 預覽（PyMuPDF；或系統的 pdftoppm）
+try:
+    from PIL import Image, ImageTk
+except ImportError:
+    Image = ImageTk = None
+
+# PyMuPDF 匯入較慢，啟動時只檢查是否安裝，第一次產生 PDF 縮圖時才匯入
+HAS_FITZ = importlib.util.find_spec("fitz") is not None
+# pyarrow：有安裝時每次儲存後輸出欄式快照給其他程序讀取，同樣延後匯入
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
 
 ITEMS_PER_PAGE = 10
+SUMMARY_FIELDS = {"車輛": ["車牌"], "廠商": ["名稱"]}  # 資料頁卡片上顯示的欄位
+DEDUP_FIELDS = {"車輛": ["車牌"], "廠商": ["名稱", "地址"]}  # 重複資料比對的欄位，未列出時用摘要欄位
+DEDUP_THRESHOLD = 0.6
+DEDUP_MAX_BLOCK = 50  # 出現在太多資料中的 2-gram（例如常見地名）不當作分組鍵，避免退化成兩兩比較
+DEDUP_NOISE = r"股份有限公司|有限公司|分公司|公司|企業社|工作室|商行|[\W_]+"
+STREAM_THRESHOLD = 5 * 1024 * 1024  # 超過此大小的活頁簿先串流讀取摘要欄位，其餘欄位用到時才載入
+STARTUP_POLL_MS = 30
 CONFIG_PATH = "data/database_config.json"
+PARTITIONS_PATH = "data/partitions.json"  # {資料庫: {"by": 分區欄位, "load": [預設載入的分區]}}
 LINKS_FOLDER = "links"
+JOURNAL_PATH = "data/.journal.json"
+LOCK_FOLDER = "data/.locks"
+LOCK_TIMEOUT = 10  # 秒
+VERSION_COLUMN = "_rev"  # 每列的版本戳記，儲存時用來偵測衝突
+POLL_INTERVAL_MS = 3000
+WATCH_DEBOUNCE = 0.5  # 秒；同一批檔案事件合併後再通知
+PERIOD_FOLDER = "period"
+PERIOD_COLUMNS = ["標題", "下次間隔__月", "執行前__月提醒", "此次執行日期", "下次執行日期"]
+DUE_INDEX_PATH = os.path.join(PERIOD_FOLDER, ".due_index.json")
+WORK_ORDERS_PATH = "data/work_orders.xlsx"
+WORK_ORDER_COLUMNS = ["工單號", "資料庫", "uuid", "項目", "到期日", "提醒日", "建立日期", "狀態", "完成日期"]
+HISTORY_FOLDER = "data/history"
+COLUMNAR_FOLDER = "data/columnar"
+COLUMNAR_KEEP = 2  # 保留最近幾版快照，讓仍映射著舊版的讀取端不受影響
+SHEET_BATCH = 25  # 批次輸出詳細資料表時，每個子程序一次排版的筆數
+SHEET_CSS = """
+body { font-family: sans-serif; font-size: 10pt; }
+h1 { font-size: 15pt; margin: 0 0 4pt 0; }
+h2 { font-size: 11pt; margin: 10pt 0 3pt 0; border-bottom: 1px solid #888; }
+p.uuid { color: #777; font-size: 8pt; margin: 0; }
+table { border-collapse: collapse; width: 100%; }
+th, td { border: 1px solid #aaa; padding: 2pt 4pt; text-align: left; vertical-align: top; }
+th { background-color: #eee; }
+td.field { width: 30%; background-color: #f6f6f6; }
+section { page-break-after: always; }
+"""
+CHECKPOINT_INTERVAL = 20  # 每幾次儲存寫一次完整快照；還原時最多套用這麼多個差異檔
+DASHBOARD_FILTERS = ["所屬分院", "類型"]
+PROJECTION_COUNT = 12  # 匯出週期排程時往後推算的次數
+REPORT_AGGREGATIONS = {"count": "筆數", "sum": "加總", "mean": "平均", "min": "最小", "max": "最大"}
+PERIOD_SOURCE_PREFIX = "週期表:"
+JOIN_SEPARATOR = "→"
+CONSTRAINT_RULES = {"required": "必填", "unique": "重複", "regex": "格式不符", "range": "超出範圍"}
+VALIDATION_COLUMNS = ["UUID", "欄位", "規則", "值"]
+MIGRATION_OPS = {"add": "新增欄位", "rename": "重新命名", "drop": "刪除欄位", "retype": "變更型別", "move": "移動分組"}
+FIELD_KINDS = {"text": "文字", "number": "數字", "date": "日期"}
+REPORTS_PATH = "data/reports.json"
+DEFAULT_REPORTS = {
+    "各分院車輛類型數": {"source": "車輛", "rows": ["所屬分院"], "pivot": "類型", "agg": "count"},
+    "各廠商平均維修價格": {"source": "廠商", "rows": ["名稱"], "value": "維修價格", "agg": "mean"},
+    "每月保養次數": {"source": PERIOD_SOURCE_PREFIX + "車輛", "rows": ["此次執行日期"], "months": ["此次執行日期"], "agg": "count"},
+}
+QUERY_OPERATORS = {
+    "eq": "等於",
+    "ne": "不等於",
+    "contains": "包含",
+    "not_contains": "不包含",
+    "gt": "大於",
+    "ge": "大於等於",
+    "lt": "小於",
+    "le": "小於等於",
+    "empty": "為空",
+    "not_empty": "不為空",
+    "older_than_months": "早於 N 個月前",
+    "within_months": "N 個月內",
+}
+HASH_CHUNK_SIZE = 1024 * 1024
+ATTACHMENT_GC_GRACE = 24 * 3600  # 秒；剛加入、可能尚未儲存引用的附件不清除
+THUMB_FOLDER = os.path.join(LINKS_FOLDER, ".thumbs")
+THUMB_SIZE = (160, 120)
+THUMB_WORKERS = 2
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tif", ".tiff"}
+TABLES_FOLDER = "tables"
+DETAIL_CACHE_BYTES = 64 * 1024 * 1024  # 詳細頁資料快取的記憶體上限
+DETAIL_PREFETCH = 3  # 檢視某筆資料時，在背景預先載入之後幾筆（與前一筆）
+ARCHIVE_FOLDER = "archive"
+API_HOST = "127.0.0.1"  # 只開放本機
+API_PORT = 8765
+API_WORKERS = 4
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
 os.makedirs(LINKS_FOLDER, exist_ok=True)
 
 
+def load_heavy_modules():
+    global np, pd
+    if pd is None:
+        import numpy
+        import pandas
+        import openpyxl  # noqa: F401  讀寫 Excel 時才會用到，一併在背景預先載入
+        np, pd = numpy, pandas
+
+
+# 💾 原子寫入：先寫暫存檔並 fsync，再以 os.replace 一次換上正式檔案
+def _fsync_dir(folder):
+    # Windows 無法開啟資料夾做 fsync，直接略過
+    try:
+        fd = os.open(folder or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _temp_path(path, tag):
+    # 保留副檔名，讓 pandas / openpyxl 能判斷寫入格式
+    folder, name = os.path.split(path)
+    base, ext = os.path.splitext(name)
+    return os.path.join(folder, f".~{base}.{tag}{ext}")
+
+
+def _write_temp(path, write_func, tag):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = _temp_path(path, tag)
+    try:
+        write_func(tmp_path)
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def atomic_write(path, write_func):
+    tmp_path = _write_temp(path, write_func, uuid.uuid4().hex[:8])
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def _dump_json(obj):
+    def write(p):
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+    return write
+
+
+class WriteJournal:
+    # 多檔案交易：所有檔案先寫成暫存檔，journal 落地後才逐一 rename
+    # journal 存在即代表已提交，啟動時 recover() 會把未完成的 rename 補完
+    def __init__(self, journal_path=JOURNAL_PATH):
+        self.journal_path = journal_path
+        self.tag = uuid.uuid4().hex[:8]
+        self.entries = []  # [(暫存檔, 正式檔)]
+        self.seq = 0
+        self.locks = {}  # 正式檔 -> FileLock，交易結束才釋放
+        self.after_commit = []
+        self.after_rollback = []  # 交易失敗時還原記憶體內容，依登記的相反順序執行
+
+    def stage(self, path, write_func):
+        self.seq += 1
+        tmp_path = _write_temp(path, write_func, f"{self.tag}{self.seq}")
+        # 同一交易內重複寫入同一檔案時，以最後一次為準
+        for old_tmp, old_path in [e for e in self.entries if e[1] == path]:
+            if os.path.exists(old_tmp):
+                os.remove(old_tmp)
+            self.entries.remove((old_tmp, old_path))
+        self.entries.append((tmp_path, path))
+
+    def commit(self):
+        if not self.entries:
+            return
+        atomic_write(self.journal_path, _dump_json({"tag": self.tag, "entries": self.entries}))
+        self._apply(self.entries)
+        os.remove(self.journal_path)
+        _fsync_dir(os.path.dirname(self.journal_path))
+        self.entries = []
+        for callback in self.after_commit:
+            callback()
+
+    def release_locks(self):
+        for lock in self.locks.values():
+            lock.release()
+        self.locks = {}
+
+    def rollback(self):
+        for tmp_path, _ in self.entries:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.entries = []
+        for callback in reversed(self.after_rollback):
+            callback()
+
+    @staticmethod
+    def _apply(entries):
+        folders = set()
+        for tmp_path, path in entries:
+            # 暫存檔不存在代表上次已 rename 完成
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, path)
+            folders.add(os.path.dirname(path))
+        for folder in folders:
+            _fsync_dir(folder)
+
+    @classmethod
+    def recover(cls, journal_path=JOURNAL_PATH):
+        if not os.path.exists(journal_path):
+            return False
+        try:
+            with open(journal_path, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+            cls._apply([tuple(e) for e in journal.get("entries", [])])
+        except Exception as e:
+            print("交易復原失敗：", e)
+            return False
+        os.remove(journal_path)
+        return True
+
+
+# 👀 檔案監看：Linux 使用 inotify，其餘平台（或網路磁碟不支援時）退回輪詢 mtime
+class _Inotify:
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, folders):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name or not hasattr(os, "O_NONBLOCK"):
+            raise OSError("inotify 不可用")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify 不可用")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失敗")
+        self.folders = {}
+        for folder in folders:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"無法監看 {folder}")
+            self.folders[wd] = folder
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(buf):
+            wd, _, _, length = self.EVENT_HEADER.unpack_from(buf, offset)
+            offset += self.EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if wd in self.folders and name:
+                paths.append(os.path.join(self.folders[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher:
+    def __init__(self, folders, interval=POLL_INTERVAL_MS / 1000):
+        self.folders = [f for f in dict.fromkeys(os.path.normpath(f) for f in folders) if os.path.isdir(f)]
+        self.interval = interval
+        self.events = queue.Queue()  # 每個元素是一批變動的檔案路徑
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.mode = None
+
+    def start(self):
+        try:
+            backend = _Inotify(self.folders)
+            self.mode = "inotify"
+            target = lambda: self._run_inotify(backend)
+        except OSError:
+            self.mode = "polling"
+            target = self._run_polling
+        self.thread = threading.Thread(target=target, name="FileWatcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run_inotify(self, backend):
+        try:
+            pending = set()
+            deadline = None
+            while not self.stop_event.is_set():
+                pending.update(backend.read(WATCH_DEBOUNCE))
+                if pending and deadline is None:
+                    deadline = time.monotonic() + WATCH_DEBOUNCE
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.events.put(sorted(pending))
+                    pending = set()
+                    deadline = None
+        finally:
+            backend.close()
+
+    def _scan(self):
+        snapshot = {}
+        for folder in self.folders:
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            st = entry.stat()
+                            snapshot[os.path.join(folder, entry.name)] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                continue
+        return snapshot
+
+    def _run_polling(self):
+        previous = self._scan()
+        while not self.stop_event.wait(self.interval):
+            current = self._scan()
+            changed = [p for p in current.keys() | previous.keys() if current.get(p) != previous.get(p)]
+            if changed:
+                self.events.put(sorted(changed))
+            previous = current
+
+    def drain(self):
+        paths = []
+        while True:
+            try:
+                paths.extend(self.events.get_nowait())
+            except queue.Empty:
+                return list(dict.fromkeys(paths))
+
+
+# 🔒 跨工作站的建議式檔案鎖，鎖檔集中放在 data/.locks，避免 period/ 與 tables/ 出現雜檔
+class FileLock:
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        key = hashlib.sha1(os.path.normpath(path).encode("utf-8")).hexdigest()
+        self.lock_path = os.path.join(LOCK_FOLDER, f"{key}.lock")
+        self.path = path
+        self.timeout = timeout
+        self.fd = None
+
+    def acquire(self):
+        os.makedirs(LOCK_FOLDER, exist_ok=True)
+        self.fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(self.fd, msvcrt.LK_NBLCK, 1)
+                return self
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(self.fd)
+                    self.fd = None
+                    raise TimeoutError(f"其他使用者正在寫入「{self.path}」，請稍後再試")
+                time.sleep(0.1)
+
+    def release(self):
+        if self.fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ConflictError(Exception):
+    # 儲存時發現其他工作站已修改（或刪除）本機也修改過的資料列
+    def __init__(self, db_name, uuids):
+        self.db_name = db_name
+        self.uuids = list(uuids)
+        super().__init__(f"「{db_name}」有 {len(self.uuids)} 筆資料已被其他使用者修改")
+
+
+class ValidationError(Exception):
+    # 儲存前發現資料違反模板中的欄位規則；violations 為 VALIDATION_COLUMNS 的 DataFrame
+    def __init__(self, db_name, violations):
+        self.db_name = db_name
+        self.violations = violations
+        super().__init__(f"「{db_name}」有 {violations['UUID'].nunique()} 筆資料不符合欄位規則")
+
+    def lines(self, limit=10):
+        return [f"{row['欄位']}：{row['規則']}（{row['值'] or '空白'}）" for _, row in self.violations.head(limit).iterrows()]
+
+
+# 📎 內容定址的附件庫：links/ 下以 sha256 命名，同一檔案只存一份
+class AttachmentStore:
+    FICLONE = 0x40049409  # Linux reflink ioctl
+
+    def __init__(self, folder=LINKS_FOLDER):
+        self.folder = folder
+
+    @staticmethod
+    def hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def blob_path(self, digest, ext):
+        return os.path.join(self.folder, f"{digest}{ext.lower()}")
+
+    def _reflink(self, src, dst):
+        if fcntl is None or not sys.platform.startswith("linux"):
+            raise OSError("不支援 reflink")
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), self.FICLONE, fs.fileno())
+
+    def _materialize(self, src, dst):
+        # 先試 reflink（寫入時複製），再退回真的複製；hardlink 只用於附件庫內的檔案，
+        # 否則使用者之後直接修改原檔時，以內容雜湊命名的 blob 也會跟著變
+        folder = os.path.abspath(self.folder)
+        try:
+            inside = os.path.commonpath([os.path.abspath(src), folder]) == folder
+        except ValueError:  # Windows 上不同磁碟機
+            inside = False
+        for method in (self._reflink, os.link) if inside else (self._reflink,):
+            try:
+                method(src, dst)
+                return
+            except OSError:
+                if os.path.exists(dst):
+                    os.remove(dst)
+        shutil.copy2(src, dst)
+
+    def add(self, src_path):
+        # 回傳附件庫內路徑；內容相同的檔案直接共用既有 blob
+        digest = self.hash_file(src_path)
+        dest_path = self.blob_path(digest, os.path.splitext(src_path)[1])
+        os.makedirs(self.folder, exist_ok=True)
+        # 與 collect_garbage 使用同一把鎖；既有 blob 更新 mtime，重新計算寬限期，避免在引用存檔前被清掉
+        with FileLock(self.folder):
+            if os.path.exists(dest_path):
+                os.utime(dest_path)
+            else:
+                tmp_path = _temp_path(dest_path, uuid.uuid4().hex[:8])
+                try:
+                    self._materialize(src_path, tmp_path)
+                    os.replace(tmp_path, dest_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        return dest_path
+
+    def collect_garbage(self, refcounts, grace=ATTACHMENT_GC_GRACE):
+        # 刪除沒有任何儲存格引用的檔案，回傳 (刪除的路徑, 釋放位元組)
+        removed = []
+        freed = 0
+        if not os.path.isdir(self.folder):
+            return removed, freed
+        now = time.time()
+        with FileLock(self.folder):
+            with os.scandir(self.folder) as it:
+                entries = [e for e in it if e.is_file() and not e.name.startswith(".")]
+            for entry in entries:
+                path = os.path.normpath(os.path.join(self.folder, entry.name))
+                if refcounts.get(path):
+                    continue
+                st = entry.stat()
+                if now - max(st.st_mtime, st.st_ctime) < grace:
+                    continue
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    print("無法刪除附件：", entry.path, e)
+                    continue
+                removed.append(path)
+                freed += st.st_size
+        return removed, freed
+
+
+def _link_path(path):
+    # 資料可能在 Windows 建立，統一分隔符號
+    return os.path.normpath(str(path).replace("\\", "/"))
+
+
+# 🖼 附件縮圖：背景執行緒產生，依內容雜湊與尺寸快取在 links/.thumbs
+class ThumbnailCache:
+    def __init__(self, folder=THUMB_FOLDER, workers=THUMB_WORKERS):
+        self.folder = folder
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self.pending = {}  # (路徑, 尺寸) -> Future
+        self.hashes = {}  # (路徑, stamp) -> sha256
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def can_preview(path):
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".pdf":
+            return HAS_FITZ or shutil.which("pdftoppm") is not None
+        if ext in (".png", ".gif"):
+            return True  # Tk 可直接解碼
+        return ext in IMAGE_EXTS and Image is not None
+
+    def content_hash(self, path):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if len(stem) == 64 and all(c in "0123456789abcdef" for c in stem):
+            return stem  # 附件庫的檔名本身就是雜湊
+        key = (os.path.normpath(path), _file_stamp(path))
+        if key not in self.hashes:
+            self.hashes[key] = AttachmentStore.hash_file(path)
+        return self.hashes[key]
+
+    def cache_path(self, digest, size):
+        return os.path.join(self.folder, f"{digest}_{size[0]}x{size[1]}.png")
+
+    def request(self, path, size=THUMB_SIZE):
+        # 回傳 Future，結果為可直接解碼的縮圖路徑（無法產生時為 None）
+        key = (os.path.normpath(path), tuple(size))
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self.pool.submit(self._build, path, tuple(size))
+                self.pending[key] = future
+        return future
+
+    def _build(self, path, size):
+        if not os.path.exists(path):
+            return None
+        target = self.cache_path(self.content_hash(path), size)
+        if os.path.exists(target):
+            return target
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".pdf":
+            atomic_write(target, lambda p: self._render_pdf(path, p, size))
+        elif Image is not None:
+            def write(p):
+                with Image.open(path) as im:
+                    im.thumbnail(size)
+                    if im.mode not in ("RGB", "RGBA"):
+                        im = im.convert("RGBA")
+                    im.save(p, "PNG")
+            atomic_write(target, write)
+        else:
+            return path  # 沒有 pillow 時由 Tk 直接縮小 png/gif
+        return target
+
+    @staticmethod
+    def _render_pdf(src, dst, size):
+        if HAS_FITZ:
+            import fitz
+            with fitz.open(src) as doc:
+                page = doc[0]
+                zoom = min(size[0] / page.rect.width, size[1] / page.rect.height)
+                page.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).save(dst)
+            return
+        base = os.path.splitext(dst)[0]
+        subprocess.run(["pdftoppm", "-png", "-f", "1", "-l", "1", "-singlefile",
+                        "-scale-to", str(max(size)), src, base],
+                       check=True, capture_output=True, timeout=60)
+        if Image is not None:
+            with Image.open(dst) as im:
+                im.thumbnail(size)
+                im.save(dst, "PNG")
+
+    @staticmethod
+    def decode(path, size=THUMB_SIZE):
+        # 只能在主執行緒呼叫（Tk 影像物件）
+        if ImageTk is not None:
+            with Image.open(path) as im:
+                im.thumbnail(size)
+                return ImageTk.PhotoImage(im)
+        photo = tk.PhotoImage(file=path)
+        factor = max(1, -(-photo.width() // size[0]), -(-photo.height() // size[1]))
+        return photo.subsample(factor) if factor > 1 else photo
+
+
+# 🔁 週期排程計算：以日曆月位移（1/31 + 1 個月 = 2/28），整欄一次計算
+def _to_dates_mixed(values):
+    try:
+        return pd.to_datetime(values, errors="coerce", format="mixed")
+    except (TypeError, ValueError):  # pandas < 2.0 沒有 format="mixed"
+        return pd.to_datetime(values, errors="coerce")
+
+
+def to_dates(values):
+    # 先以單一格式快速轉換；Excel 讀回的日期可能混雜字串與 Timestamp，剩下的再逐格推斷
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    filled = values.notna() & (values.astype(str).str.strip() != "")
+    # 抽樣都無法解析時（例如車牌、名稱欄）直接視為非日期欄，不逐格嘗試
+    if not filled.any() or _to_dates_mixed(values[filled].head(20)).isna().all():
+        return pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    dates = pd.to_datetime(values.where(filled), errors="coerce").astype("datetime64[ns]")
+    retry = dates.isna() & filled
+    if retry.any():
+        dates[retry] = _to_dates_mixed(values[retry]).astype("datetime64[ns]")
+    return dates
+
+
+def add_months(dates, months):
+    dates = to_dates(pd.Series(dates))
+    months = pd.to_numeric(pd.Series(np.broadcast_to(np.asarray(months, dtype=object), len(dates)), index=dates.index),
+                           errors="coerce")
+    valid = (dates.notna() & months.notna()).to_numpy()
+    result = np.full(len(dates), np.datetime64("NaT"), dtype="datetime64[ns]")
+    values = dates.to_numpy(dtype="datetime64[ns]")[valid]
+    offsets = months.to_numpy(dtype="float64")[valid].astype("int64")
+    month_start = values.astype("datetime64[M]") + offsets
+    days_in_month = ((month_start + 1).astype("datetime64[D]") - month_start.astype("datetime64[D]")).astype("int64")
+    day_index = (values.astype("datetime64[D]") - values.astype("datetime64[M]").astype("datetime64[D]")).astype("int64")
+    # 目標月份沒有該日時取月底，並保留原本的時間部分
+    time_of_day = values - values.astype("datetime64[D]")
+    result[valid] = (month_start.astype("datetime64[D]") + np.minimum(day_index, days_in_month - 1)) + time_of_day
+    return pd.Series(result, index=dates.index)
+
+
+def compute_schedule(df):
+    # 依「此次執行日期」+「下次間隔__月」計算下次執行日期，再往前推「執行前__月提醒」得到提醒日期
+    schedule = pd.DataFrame(index=df.index)
+    exec_dates = to_dates(df["此次執行日期"]) if "此次執行日期" in df.columns else pd.Series(pd.NaT, index=df.index)
+    intervals = pd.to_numeric(df["下次間隔__月"], errors="coerce") if "下次間隔__月" in df.columns else np.nan
+    # 沒填「執行前__月提醒」的項目不提醒（提醒日期留空），與原本的到期判斷一致
+    reminds = pd.to_numeric(df["執行前__月提醒"], errors="coerce") if "執行前__月提醒" in df.columns else np.nan
+    next_dates = add_months(exec_dates, intervals)
+    if "下次執行日期" in df.columns:
+        # 只有舊資料沒有間隔時才沿用表上記錄的日期
+        next_dates = next_dates.fillna(to_dates(df["下次執行日期"]))
+    schedule["下次執行日期"] = next_dates
+    schedule["提醒日期"] = add_months(next_dates, -pd.Series(reminds, index=df.index))
+    return schedule
+
+
+def next_execution_date(exec_date, months):
+    # 單筆計算（編輯畫面即時更新用），無法計算時回傳空字串
+    result = add_months([exec_date], [months]).iloc[0]
+    return "" if pd.isna(result) else result.strftime("%Y-%m-%d")
+
+
+def project_occurrences(df, count=PROJECTION_COUNT):
+    # 產能規劃用：推算每個週期項目往後 count 次的執行日期（長表格式）
+    exec_dates = to_dates(df["此次執行日期"])
+    intervals = pd.to_numeric(df["下次間隔__月"], errors="coerce")
+    valid = exec_dates.notna() & intervals.notna() & (intervals > 0)
+    base = df[valid]
+    steps = np.repeat(np.arange(1, count + 1), len(base))
+    repeated = pd.concat([base] * count, ignore_index=True) if len(base) else base.iloc[0:0]
+    dates = add_months(pd.concat([exec_dates[valid]] * count, ignore_index=True),
+                       np.tile(intervals[valid].to_numpy(), count) * steps)
+    projected = repeated.drop(columns=[c for c in ("下次執行日期",) if c in repeated.columns])
+    projected["第幾次"] = steps
+    projected["預計執行日期"] = dates.dt.strftime("%Y-%m-%d").to_numpy()
+    return projected.sort_values(["預計執行日期", "第幾次"], kind="stable").reset_index(drop=True)
+
+
+# 🔍 結構化查詢：條件編譯成向量化遮罩，結果只保留列索引，不複製資料
+class Query:
+    def __init__(self, filters=None, sort=None):
+        self.filters = list(filters or [])  # [{"column", "op", "value"}]
+        self.sort = list(sort or [])  # [{"column", "ascending"}]
+
+    def to_dict(self):
+        return {"filters": self.filters, "sort": self.sort}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("filters"), data.get("sort"))
+
+    def is_empty(self):
+        return not self.filters and not self.sort
+
+    def compile(self, dm, db_name):
+        # 回傳 run()，每次呼叫都以目前資料計算（欄位型別轉換與索引由 DataManager 依版本快取）
+        predicates = [self._compile_filter(dm, db_name, f) for f in self.filters]
+        sort = [s for s in self.sort if s.get("column")]
+
+        def run():
+            df = dm.data[db_name]
+            mask = np.ones(len(df), dtype=bool)
+            for predicate in predicates:
+                mask &= predicate()
+            positions = np.flatnonzero(mask)
+            if sort and len(positions):
+                keys = pd.DataFrame({f"k{i}": dm.sort_key(db_name, s["column"])[positions]
+                                     for i, s in enumerate(sort)})
+                order = keys.sort_values(list(keys.columns), ascending=[bool(s.get("ascending", True)) for s in sort],
+                                         kind="stable", na_position="last").index.to_numpy()
+                positions = positions[order]
+            return df.index[positions]
+        return run
+
+    @staticmethod
+    def _compile_filter(dm, db_name, spec):
+        column, op, value = spec.get("column"), spec.get("op"), str(spec.get("value", "")).strip()
+
+        def missing():
+            return np.zeros(len(dm.data[db_name]), dtype=bool)
+
+        if column not in dm.data[db_name].columns or op not in QUERY_OPERATORS:
+            return missing
+
+        if op in ("empty", "not_empty"):
+            def blank():
+                mask = dm.typed_column(db_name, column, "text").str.strip().eq("").to_numpy()
+                return mask if op == "empty" else ~mask
+            return blank
+
+        if op in ("eq", "ne"):
+            def equals():
+                mask = np.zeros(len(dm.data[db_name]), dtype=bool)
+                mask[dm.value_positions(db_name, column).get(value, [])] = True
+                return mask if op == "eq" else ~mask
+            return equals
+
+        if op in ("contains", "not_contains"):
+            def contains():
+                mask = dm.typed_column(db_name, column, "text").str.contains(value, regex=False).to_numpy()
+                return mask if op == "contains" else ~mask
+            return contains
+
+        if op in ("older_than_months", "within_months"):
+            try:
+                months = float(value)
+            except ValueError:
+                return missing
+            def relative():
+                today = pd.Timestamp(datetime.today().date())
+                threshold = add_months([today], [-months]).iloc[0]
+                dates = dm.typed_column(db_name, column, "date")
+                if op == "older_than_months":
+                    return (dates < threshold).to_numpy()
+                return ((dates >= threshold) & (dates <= today + pd.Timedelta(days=1))).to_numpy()
+            return relative
+
+        # 大小比較：數字優先，其次日期，最後以字串比較
+        compare = {"gt": np.greater, "ge": np.greater_equal, "lt": np.less, "le": np.less_equal}[op]
+        number = pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0]
+        date = to_dates(pd.Series([value])).iloc[0]
+
+        def ordered():
+            if not pd.isna(number):
+                values = dm.typed_column(db_name, column, "number")
+                return compare(values.to_numpy(), number) & values.notna().to_numpy()
+            if not pd.isna(date):
+                values = dm.typed_column(db_name, column, "date")
+                return compare(values.to_numpy(), date.to_datetime64()) & values.notna().to_numpy()
+            return compare(dm.typed_column(db_name, column, "text").to_numpy().astype(str), value)
+        return ordered
+
+
+# 📅 全部週期表的「下次執行日期」排序索引；依檔案 stamp 增量維護並保存在磁碟
+class DueIndex:
+    FORMAT_VERSION = 3  # 計算方式改變時遞增，舊索引會整個重建
+
+    def __init__(self, path=DUE_INDEX_PATH):
+        self.path = path
+        self.files = {}  # 週期表路徑 -> {"stamp": [...], "uuid": ..., "items": [[下次執行, 提醒, 標題], ...]}
+        self.entries = []  # (下次執行日期, 提醒日期, uuid, 標題, 路徑)，依日期排序
+        self.by_uuid = {}  # uuid -> 週期表路徑集合
+        self.stale = set()
+        self.max_lead = 0  # 提醒日期最多比下次執行日期提早幾天
+        self.loaded = False
+        self.dirty = False
+
+    @staticmethod
+    def parse_items(df):
+        if df is None or df.empty:
+            return []
+        schedule = compute_schedule(df)
+        next_dates = schedule["下次執行日期"]
+        remind_dates = schedule["提醒日期"]
+        titles = df["標題"].astype(str) if "標題" in df.columns else pd.Series("", index=df.index)
+        valid = next_dates.notna() & remind_dates.notna()
+        return [[n, r, t] for n, r, t in zip(next_dates[valid].dt.strftime("%Y-%m-%d"),
+                                              remind_dates[valid].dt.strftime("%Y-%m-%d"),
+                                              titles[valid])]
+
+    def _remove(self, path):
+        info = self.files.pop(path, None)
+        if not info:
+            return
+        for next_date, remind_date, title in info["items"]:
+            entry = (next_date, remind_date, info["uuid"], title, path)
+            i = bisect.bisect_left(self.entries, entry)
+            if i < len(self.entries) and self.entries[i] == entry:
+                del self.entries[i]
+        paths = self.by_uuid.get(info["uuid"])
+        if paths:
+            paths.discard(path)
+
+    def _insert(self, path, stamp, items):
+        uuid_str = os.path.basename(path).split("_period_")[0]
+        self.files[path] = {"stamp": list(stamp) if stamp else None, "uuid": uuid_str, "items": items}
+        for next_date, remind_date, title in items:
+            bisect.insort(self.entries, (next_date, remind_date, uuid_str, title, path))
+            lead = (datetime.strptime(next_date, "%Y-%m-%d") - datetime.strptime(remind_date, "%Y-%m-%d")).days
+            self.max_lead = max(self.max_lead, lead)
+        self.by_uuid.setdefault(uuid_str, set()).add(path)
+
+    def load(self):
+        self.loaded = True
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print("讀取到期索引失敗，將重新建立：", e)
+            return
+        if not isinstance(saved, dict) or saved.get("version") != self.FORMAT_VERSION:
+            return
+        files = saved.get("files", {})
+        for path, info in files.items():
+            self._insert(path, info.get("stamp"), [tuple(item) for item in info.get("items", [])])
+
+    def save(self):
+        if not self.dirty:
+            return
+        files = {p: {"stamp": info["stamp"], "items": [list(i) for i in info["items"]]} for p, info in self.files.items()}
+        try:
+            atomic_write(self.path, _dump_json({"version": self.FORMAT_VERSION, "files": files}))
+            self.dirty = False
+        except OSError as e:
+            print("儲存到期索引失敗：", e)
+
+    def mark_stale(self, path):
+        self.stale.add(os.path.normpath(path))
+
+    def update_file(self, path, load_period):
+        path = os.path.normpath(path)
+        stamp = _file_stamp(path)
+        info = self.files.get(path)
+        if info is not None and stamp is not None and info["stamp"] == list(stamp):
+            return
+        self._remove(path)
+        if stamp is not None:
+            try:
+                items = self.parse_items(load_period(path))
+            except Exception as e:
+                print("讀取週期表格失敗：", path, e)
+                items = []
+            self._insert(path, stamp, [tuple(i) for i in items])
+        self.dirty = True
+
+    def refresh(self, load_period, full=False):
+        # full：掃描 period/ 的所有檔案（啟動時一次）；其餘只處理被標記變動的檔案
+        if not self.loaded:
+            self.load()
+            full = True
+        if full:
+            known = set(self.files)
+            current = set()
+            if os.path.isdir(PERIOD_FOLDER):
+                with os.scandir(PERIOD_FOLDER) as it:
+                    current = {os.path.normpath(e.path) for e in it
+                               if e.is_file() and "_period_" in e.name and e.name.endswith(".xlsx")
+                               and not e.name.startswith(".")}
+            self.stale |= current | known
+        for path in sorted(self.stale):
+            self.update_file(path, load_period)
+        self.stale = set()
+        self.save()
+
+    def due(self, today=None):
+        # 回傳已過期或進入提醒期的項目，依下次執行日期排序
+        today = today or datetime.today()
+        today_str = today.strftime("%Y-%m-%d")
+        horizon = (today + timedelta(days=self.max_lead)).strftime("%Y-%m-%d")
+        # 下次執行日期早於今天者必定到期；之後只需檢查提醒期可能涵蓋今天的區段
+        overdue_end = bisect.bisect_left(self.entries, (today_str,))
+        window_end = bisect.bisect_right(self.entries, (horizon, "\uffff"))
+        return self.entries[:overdue_end] + [e for e in self.entries[overdue_end:window_end] if e[1] <= today_str]
+
+    def is_due(self, uuid_str, today=None):
+        today = (today or datetime.today()).strftime("%Y-%m-%d")
+        for path in self.by_uuid.get(uuid_str, ()):
+            for _, remind_date, _ in self.files[path]["items"]:
+                if remind_date <= today:
+                    return True
+        return False
+
+
+class ExternalLink:
+    # 外部連結儲存格；檔案中存成 {"label", "path"} JSON，記憶體中保留解析後的物件
+    __slots__ = ("label", "path")
+
+    def __init__(self, label, path):
+        self.label = str(label)
+        self.path = str(path)
+
+    def to_json(self):
+        return json.dumps({"label": self.label, "path": self.path})
+
+    __str__ = to_json
+
+    def __repr__(self):
+        return f"ExternalLink({self.label!r}, {self.path!r})"
+
+    def __eq__(self, other):
+        return type(other) is ExternalLink and (self.label, self.path) == (other.label, other.path)
+
+    def __hash__(self):
+        return hash((ExternalLink, self.label, self.path))
+
+
+class InternalLink:
+    # 內部連結儲存格；檔案中存成 {"label", "uuid"} JSON
+    __slots__ = ("label", "uuid")
+
+    def __init__(self, label, uuid_str):
+        self.label = str(label)
+        self.uuid = str(uuid_str)
+
+    def to_json(self):
+        return json.dumps({"label": self.label, "uuid": self.uuid})
+
+    __str__ = to_json
+
+    def __repr__(self):
+        return f"InternalLink({self.label!r}, {self.uuid!r})"
+
+    def __eq__(self, other):
+        return type(other) is InternalLink and (self.label, self.uuid) == (other.label, other.uuid)
+
+    def __hash__(self):
+        return hash((InternalLink, self.label, self.uuid))
+
+
+LINK_TYPES = (ExternalLink, InternalLink)
+
+
+def parse_link(val):
+    # 儲存格內的連結為 {"label", "path"} 或 {"label", "uuid"} 的 JSON 字串，其餘視為一般值
+    if isinstance(val, LINK_TYPES):
+        return val
+    if not isinstance(val, str) or not val.startswith("{"):
+        return None
+    try:
+        obj = json.loads(val)
+    except ValueError:
+        return None
+    if isinstance(obj, dict) and "label" in obj:
+        if "path" in obj:
+            return ExternalLink(obj["label"], obj["path"])
+        if "uuid" in obj:
+            return InternalLink(obj["label"], obj["uuid"])
+    return None
+
+
+def _text_columns(df):
+    return [col for col in df.columns
+            if pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col])]
+
+
+def parse_link_cells(df):
+    # 載入時一次把連結 JSON 轉成物件；先以向量化字串比對篩選，只解析可能是連結的儲存格
+    for col in _text_columns(df):
+        values = df[col]
+        text = values.astype(object).where(values.notna(), "").astype(str)
+        mask = (text.str.startswith("{") & text.str.contains('"label"', regex=False)).to_numpy()
+        if not mask.any():
+            continue
+        parsed = [parse_link(v) for v in text[mask]]
+        column = values.astype(object)
+        column[mask] = [p if p is not None else v for p, v in zip(parsed, values[mask])]
+        df[col] = column
+    return df
+
+
+def link_mask(values, link_type=LINK_TYPES):
+    return np.fromiter((isinstance(v, link_type) for v in values), dtype=bool, count=len(values))
+
+
+def serialize_link_cells(df):
+    # 寫入檔案前把連結物件轉回 JSON 字串；沒有連結的欄位不複製
+    out = None
+    for col in df.columns:
+        if not pd.api.types.is_object_dtype(df[col]):
+            continue
+        mask = link_mask(df[col].to_numpy())
+        if not mask.any():
+            continue
+        if out is None:
+            out = df.copy()
+        column = df[col].copy()
+        column[mask] = [v.to_json() for v in column[mask]]
+        out[col] = column
+    return df if out is None else out
+
+
+def retype_column(col, kind):
+    # 轉換失敗的值與連結保留原樣，變更型別不會遺失資料
+    original = col.astype(object)
+    keep = (col.isna() | link_mask(original.to_numpy())).to_numpy()
+    if kind == "text":
+        converted = constraint_text(col)
+    elif kind == "number":
+        converted = pd.to_numeric(original.where(~keep), errors="coerce")
+    elif kind == "date":
+        converted = to_dates(original.where(~keep))
+    else:
+        raise ValueError(f"不支援的型別：{kind}")
+    unchanged = keep | converted.isna().to_numpy()
+    if not (unchanged & col.notna().to_numpy()).any():
+        return converted.where(col.notna(), None) if kind == "text" else converted
+    return converted.astype(object).where(~unchanged, original)
+
+
+def normalize_text(col):
+    # 模糊比對用：全形轉半形（NFKC）、轉小寫，去掉空白、標點與公司類型等常見字
+    text = constraint_text(col).str.normalize("NFKC").str.lower()
+    return text.str.replace(DEDUP_NOISE, "", regex=True)
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)} or ({text} if text else set())
+
+
+def _dice(a, b):
+    return 2 * len(a & b) / (len(a) + len(b)) if a and b else 0.0
+
+
+def constraint_text(col):
+    # 欄位規則比對用的字串：連結取標籤、整數值的浮點數去掉 .0、去除前後空白，空值為 ""
+    if pd.api.types.is_float_dtype(col):
+        whole = (col.notna() & (col % 1 == 0)).to_numpy()
+    else:
+        whole = np.fromiter((type(v) is float and v.is_integer() for v in col), dtype=bool, count=len(col))
+    col = col.astype(object)
+    links = link_mask(col.to_numpy())
+    if links.any():
+        col = col.where(~links, col[links].map(lambda link: link.label))
+    text = col.where(col.notna(), "").astype(str)
+    if whole.any():
+        text[whole] = col.to_numpy()[whole].astype("int64").astype(str)
+    return text.str.strip()
+
+
+def partition_names(col):
+    # 分區鍵：與欄位規則相同的正規化，再把檔名不允許的字元換成底線；空白為 ""（留在原資料檔）
+    return constraint_text(col).str.replace(r'[\\/:*?"<>|]', "_", regex=True)
+
+
+# 📖 串流讀取 xlsx：直接 iterparse 工作表 XML，只轉換指定欄位的儲存格
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+XLSX_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+EXCEL_EPOCH = datetime(1899, 12, 30)
+# 與 pd.read_excel 預設相同，這些字串視為空值
+XLSX_NA_VALUES = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                  "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+
+
+def _xlsx_first_sheet(zf):
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    sheet = workbook.find(f"{XLSX_NS}sheets/{XLSX_NS}sheet")
+    rel_id = sheet.get(f"{XLSX_REL_NS}id")
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels:
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target")
+            return target.lstrip("/") if target.startswith("/") else "xl/" + target
+    return "xl/worksheets/sheet1.xml"
+
+
+def _xlsx_shared_strings(zf):
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return []
+    strings = []
+    with zf.open("xl/sharedStrings.xml") as f:
+        for _, elem in ET.iterparse(f):
+            if elem.tag == f"{XLSX_NS}si":
+                strings.append("".join(t.text or "" for t in elem.iter(f"{XLSX_NS}t")))
+                elem.clear()
+    return strings
+
+
+def _xlsx_date_styles(zf):
+    # 回傳屬於日期格式的儲存格樣式索引
+    if "xl/styles.xml" not in zf.namelist():
+        return set()
+    styles = ET.fromstring(zf.read("xl/styles.xml"))
+    date_formats = set(XLSX_DATE_FORMATS)
+    for fmt in styles.iter(f"{XLSX_NS}numFmt"):
+        code = fmt.get("formatCode", "").lower()
+        code = "".join(part for i, part in enumerate(code.split('"')) if i % 2 == 0)
+        if any(ch in code for ch in "ymdhs") and "general" not in code:
+            date_formats.add(int(fmt.get("numFmtId")))
+    xfs = styles.find(f"{XLSX_NS}cellXfs")
+    if xfs is None:
+        return set()
+    return {i for i, xf in enumerate(xfs) if int(xf.get("numFmtId", 0)) in date_formats}
+
+
+def _xlsx_column(ref):
+    index = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        index = index * 26 + ord(ch.upper()) - 64
+    return index - 1
+
+
+def _xlsx_value(cell, shared, date_styles):
+    kind = cell.get("t", "n")
+    if kind == "inlineStr":
+        text = "".join(t.text or "" for t in cell.iter(f"{XLSX_NS}t"))
+        return None if text in XLSX_NA_VALUES else text
+    v = cell.find(f"{XLSX_NS}v")
+    if v is None or v.text is None:
+        return None
+    if kind in ("s", "str", "d"):
+        text = shared[int(v.text)] if kind == "s" else v.text
+        return None if text in XLSX_NA_VALUES else text
+    if kind == "b":
+        return v.text == "1"
+    if kind == "e":
+        return None
+    number = float(v.text)
+    if int(cell.get("s", 0)) in date_styles:
+        return EXCEL_EPOCH + timedelta(days=number)
+    return int(number) if number.is_integer() else number
+
+
+def read_xlsx_columns(path, columns=None, leading=0):
+    # 只讀第一個工作表；第一列為標題（與 pd.read_excel 相同）
+    # columns 為 None 時讀全部欄位，否則只讀這些欄位再加上最前面 leading 欄
+    with zipfile.ZipFile(path) as zf:
+        shared = _xlsx_shared_strings(zf)
+        date_styles = _xlsx_date_styles(zf)
+        header = None
+        positions = None
+        rows = []
+        kept = 0  # 最後一個有值的資料列之後的列數（依整列判斷，不只看讀取的欄位）
+        last_row = 0
+        with zf.open(_xlsx_first_sheet(zf)) as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag != f"{XLSX_NS}row":
+                    continue
+                values = {}
+                filled = False
+                next_col = 0
+                for cell in elem.iter(f"{XLSX_NS}c"):
+                    ref = cell.get("r")
+                    col = _xlsx_column(ref) if ref else next_col
+                    next_col = col + 1
+                    if positions is None or col in positions:
+                        values[col] = _xlsx_value(cell, shared, date_styles)
+                        filled = filled or values[col] is not None
+                    elif not filled:
+                        filled = _xlsx_value(cell, shared, date_styles) is not None
+                row_number = int(elem.get("r", last_row + 1))
+                elem.clear()
+                if header is None:
+                    header = {i: str(v) for i, v in values.items() if v is not None}
+                    positions = [i for n, i in enumerate(sorted(header))
+                                 if columns is None or header[i] in columns or n < leading]
+                    last_row = row_number
+                    continue
+                # 中間的空白列與 pandas 一樣保留為空列
+                rows.extend([[None] * len(positions)] * (row_number - last_row - 1))
+                rows.append([values.get(i) for i in positions])
+                if filled:
+                    kept = len(rows)
+                last_row = row_number
+    # pandas 會去掉結尾的全空白列，列數必須一致，complete_load 才能沿用這裡的 UUID
+    del rows[kept:]
+    if header is None:
+        return pd.DataFrame()
+    return pd.DataFrame(rows, columns=[header[i] for i in positions])
+
+
+SCHEMA_KEYWORD = "schema_seq="
+
+
+def xlsx_schema_seq(path):
+    # 資料檔已套用到第幾個 migration（記在活頁簿屬性的關鍵字）；沒有記錄的舊檔為 0，全部重播
+    try:
+        with zipfile.ZipFile(path) as zf:
+            core = ET.fromstring(zf.read("docProps/core.xml"))
+    except (OSError, KeyError, zipfile.BadZipFile, ET.ParseError):
+        return 0
+    for elem in core.iter():
+        if elem.tag.endswith("}keywords") and elem.text and elem.text.startswith(SCHEMA_KEYWORD):
+            try:
+                return int(elem.text[len(SCHEMA_KEYWORD):])
+            except ValueError:
+                return 0
+    return 0
+
+
+def excel_with_schema(df, seq):
+    def write(p):
+        with pd.ExcelWriter(p, engine="openpyxl") as writer:
+            df.to_excel(writer, index=False)
+            writer.book.properties.keywords = f"{SCHEMA_KEYWORD}{seq}"
+    return write
+
+
+class LazyFrames(dict):
+    # 資料庫 -> DataFrame；只載入摘要欄位的資料庫，第一次被取用時才補齊其餘欄位
+    def __init__(self, complete):
+        super().__init__()
+        self.pending = {}  # 資料庫 -> 讀取完整資料的 Future（尚未開始時為 None）
+        self.complete = complete
+        # API 執行緒、預先載入的執行緒也會取用資料；補齊與替換 DataFrame 只能有一個執行緒進行
+        self.lock = threading.RLock()
+
+    def partial(self, db_name):
+        return dict.get(self, db_name)
+
+    def _ready(self, db_name):
+        if db_name in self.pending:
+            with self.lock:
+                if db_name in self.pending:  # 等待期間可能已由其他執行緒補齊
+                    self.complete(db_name)
+
+    def __getitem__(self, db_name):
+        self._ready(db_name)
+        return dict.__getitem__(self, db_name)
+
+    def get(self, db_name, default=None):
+        self._ready(db_name)
+        return dict.get(self, db_name, default)
+
+    def values(self):
+        return [self[db_name] for db_name in self]
+
+    def items(self):
+        return [(db_name, self[db_name]) for db_name in self]
+
+    def __delitem__(self, db_name):
+        with self.lock:
+            self.pending.pop(db_name, None)
+            dict.__delitem__(self, db_name)
+
+
+class ArchiveStore:
+    # 🗄 封存：整列資料存在 archive/{資料庫}/index.json.gz（供查詢、匯出與 UUID 查找），
+    # 週期表、表格與異動紀錄等較大的檔案則每筆紀錄壓成一個 {uuid}.zip，還原時才解開
+    def __init__(self, folder=ARCHIVE_FOLDER):
+        self.folder = folder
+        self.cache = {}  # 資料庫 -> (stamp, 項目, DataFrame 或 None)
+
+    def index_path(self, db_name):
+        return os.path.join(self.folder, db_name, "index.json.gz")
+
+    def zip_path(self, db_name, uuid_str):
+        return os.path.join(self.folder, db_name, f"{uuid_str}.zip")
+
+    def databases(self):
+        if not os.path.isdir(self.folder):
+            return []
+        return [name for name in sorted(os.listdir(self.folder)) if os.path.exists(self.index_path(name))]
+
+    def entries(self, db_name):
+        # uuid -> {"row": {欄位: 值}, "archived": 封存時間, "files": [zip 內的檔名]}
+        path = self.index_path(db_name)
+        stamp = _file_stamp(path)
+        cached = self.cache.get(db_name)
+        if cached is None or cached[0] != stamp:
+            entries = {}
+            if stamp is not None:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    entries = json.load(f)
+            cached = (stamp, entries, None)
+            self.cache[db_name] = cached
+        return cached[1]
+
+    def frame(self, db_name):
+        entries = self.entries(db_name)
+        stamp, _, df = self.cache[db_name]
+        if df is None:
+            df = pd.DataFrame([entry["row"] for entry in entries.values()])
+            if not df.empty:
+                df["封存日期"] = [entry["archived"] for entry in entries.values()]
+            df = parse_link_cells(df)
+            self.cache[db_name] = (stamp, entries, df)
+        return df
+
+    def find(self, uuid_str):
+        for db_name in self.databases():
+            if uuid_str in self.entries(db_name):
+                return db_name
+        return None
+
+    @staticmethod
+    def bytes_writer(data):
+        def write(p):
+            with open(p, "wb") as f:
+                f.write(data)
+        return write
+
+    @staticmethod
+    def index_writer(entries):
+        return ArchiveStore.bytes_writer(gzip.compress(json.dumps(entries, ensure_ascii=False, default=str).encode("utf-8")))
+
+    @staticmethod
+    def zip_writer(members):
+        # members：zip 內檔名 -> 來源檔案路徑或位元組
+        def write(p):
+            with zipfile.ZipFile(p, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for name, source in members.items():
+                    if isinstance(source, bytes):
+                        zf.writestr(name, source)
+                    else:
+                        zf.write(source, name)
+        return write
+
+    def read_members(self, db_name, uuid_str):
+        path = self.zip_path(db_name, uuid_str)
+        if not os.path.exists(path):
+            return {}
+        with zipfile.ZipFile(path) as zf:
+            return {name: zf.read(name) for name in zf.namelist()}
+
+
+class SnapshotStore:
+    # 📜 版本紀錄：每次儲存寫一個 gzip JSON 差異檔（以 UUID 為鍵的整列內容與刪除清單），
+    # 第一次與每 CHECKPOINT_INTERVAL 次儲存改寫完整快照，重建任一版本最多讀取 interval 個檔案
+    # 檔名：{序號:08d}_{時間}_{列數}.{full|delta}.json.gz（較舊的檔案沒有列數）
+    def __init__(self, folder=HISTORY_FOLDER, interval=CHECKPOINT_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self.file_cache = {}  # 路徑 -> 解析後內容（歷史檔寫入後不再變動），最多保留 2 × interval 個檔案
+        self.touched_cache = {}  # 差異檔路徑 -> 其中新增、修改或刪除的 uuid
+        self.frame_cache = {}  # (資料庫, 序號) -> DataFrame
+
+    def db_folder(self, db_name):
+        return os.path.join(self.folder, db_name)
+
+    def versions(self, db_name):
+        # [(序號, 時間, 種類, 路徑)]，依序號排序
+        folder = self.db_folder(db_name)
+        if not os.path.isdir(folder):
+            return []
+        result = []
+        for name in os.listdir(folder):
+            if name.startswith(".") or not name.endswith(".json.gz"):
+                continue
+            try:
+                stem, kind = name[:-len(".json.gz")].rsplit(".", 1)
+                seq, stamp = stem.split("_", 2)[:2]
+                result.append((int(seq), datetime.strptime(stamp, "%Y%m%d-%H%M%S"), kind, os.path.join(folder, name)))
+            except ValueError:
+                continue
+        return sorted(result)
+
+    @staticmethod
+    def _rows(df):
+        values = serialize_link_cells(df).astype(object)
+        values = values.where(values.notna(), None)
+        return dict(zip(df["UUID"].astype(str), values.to_numpy().tolist()))
+
+    def record(self, db_name, df, changed, deleted, stage, now=None):
+        # 呼叫端需持有該資料庫歷史資料夾的鎖，序號才不會與其他工作站重複；df 須為全部分區的資料
+        if df.columns.empty or "UUID" not in df.columns:
+            return None
+        versions = self.versions(db_name)
+        seq = versions[-1][0] + 1 if versions else 1
+        full = not versions or seq % self.interval == 0
+        if not full and not changed and not deleted:
+            return None
+        subset = df if full else df[df["UUID"].astype(str).isin(changed)]
+        now = now or datetime.now()
+        payload = {
+            "seq": seq,
+            "time": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "columns": [str(c) for c in df.columns],
+            "rows": self._rows(subset),
+            "deleted": [] if full else sorted(deleted),
+        }
+        data = gzip.compress(json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8"))
+        name = f"{seq:08d}_{now.strftime('%Y%m%d-%H%M%S')}_{len(payload['rows'])}.{'full' if full else 'delta'}.json.gz"
+        os.makedirs(self.db_folder(db_name), exist_ok=True)
+
+        def write(p):
+            with open(p, "wb") as f:
+                f.write(data)
+        stage(os.path.join(self.db_folder(db_name), name), write)
+        return seq
+
+    def read(self, path):
+        if path not in self.file_cache:
+            if len(self.file_cache) >= self.interval * 2:
+                self.file_cache.clear()
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                self.file_cache[path] = json.load(f)
+        return self.file_cache[path]
+
+    def row_count(self, path):
+        # 版本列表用：新檔名帶有列數，不必解析內容
+        stem = os.path.basename(path)[:-len(".json.gz")].rsplit(".", 1)[0]
+        parts = stem.split("_")
+        if len(parts) == 3 and parts[2].isdigit():
+            return int(parts[2])
+        return len(self.read(path)["rows"])
+
+    def seq_at(self, db_name, when):
+        # 指定時間點當下的最新版本序號；早於第一版時回傳 None
+        seqs = [seq for seq, stamp, _, _ in self.versions(db_name) if stamp <= when]
+        return seqs[-1] if seqs else None
+
+    def frame_at(self, db_name, seq):
+        key = (db_name, seq)
+        if key in self.frame_cache:
+            return self.frame_cache[key]
+        versions = [v for v in self.versions(db_name) if v[0] <= seq]
+        starts = [i for i, v in enumerate(versions) if v[2] == "full"]
+        if not starts:
+            raise KeyError(f"{db_name} 沒有第 {seq} 版之前的完整快照")
+        rows = {}
+        columns = []
+        for _, _, _, path in versions[starts[-1]:]:
+            payload = self.read(path)
+            columns = payload["columns"]
+            for uuid_str in payload["deleted"]:
+                rows.pop(uuid_str, None)
+            for uuid_str, values in payload["rows"].items():
+                rows[uuid_str] = dict(zip(payload["columns"], values))
+        df = pd.DataFrame([[row.get(c) for c in columns] for row in rows.values()], columns=columns)
+        df = parse_link_cells(df)
+        if len(self.frame_cache) > 8:
+            self.frame_cache.clear()
+        self.frame_cache[key] = df
+        return df
+
+    def record_at(self, db_name, uuid_str, seq):
+        df = self.frame_at(db_name, seq)
+        rows = df[df["UUID"].astype(str) == uuid_str]
+        return None if rows.empty else rows.iloc[0]
+
+    def touched(self, db_name, uuid_str):
+        # 此列有變動（新增、修改或刪除）的版本序號
+        result = []
+        for seq, _, kind, path in self.versions(db_name):
+            if kind == "full":
+                continue
+            if path not in self.touched_cache:
+                # 只記住 uuid，不把整個差異檔留在記憶體中
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    payload = json.load(f)
+                self.touched_cache[path] = frozenset(payload["rows"]) | frozenset(payload["deleted"])
+            if uuid_str in self.touched_cache[path]:
+                result.append(seq)
+        return result
+
+    def diff(self, db_name, seq_a, seq_b, within=None):
+        # 回傳 (新增 uuid, 刪除 uuid, {uuid: {欄位: (舊值, 新值)}})；within(df) 回傳要比較的列（例如只看已載入的分區）
+        a = self.frame_at(db_name, seq_a)
+        b = self.frame_at(db_name, seq_b)
+        if within is not None:
+            keep = set(a.loc[within(a).to_numpy(), "UUID"].astype(str)) | set(b.loc[within(b).to_numpy(), "UUID"].astype(str))
+            a = a[a["UUID"].astype(str).isin(keep).to_numpy()]
+            b = b[b["UUID"].astype(str).isin(keep).to_numpy()]
+        a = a.set_index(a["UUID"].astype(str))
+        b = b.set_index(b["UUID"].astype(str))
+        added = [u for u in b.index if u not in a.index]
+        removed = [u for u in a.index if u not in b.index]
+        common = a.index.intersection(b.index)
+        columns = [c for c in b.columns if c not in ("UUID", VERSION_COLUMN)]
+        changed = {}
+        for col in columns:
+            old = a.loc[common, col].astype(object) if col in a.columns else pd.Series(None, index=common, dtype=object)
+            new = b.loc[common, col].astype(object)
+            old_text = old.where(old.notna(), "").astype(str)
+            new_text = new.where(new.notna(), "").astype(str)
+            for uuid_str in common[(old_text != new_text).to_numpy()]:
+                changed.setdefault(uuid_str, {})[col] = (old_text[uuid_str], new_text[uuid_str])
+        return added, removed, changed
+
+
+# 🗂 詳細頁資料（週期表、異動紀錄、自由表格）快取：以相關檔案的 stamp 當簽章判斷是否過期，
+# LRU 淘汰並限制總記憶體；背景執行緒預先載入前後幾筆
+class DetailCache:
+    def __init__(self, data_manager, max_bytes=DETAIL_CACHE_BYTES):
+        self.dm = data_manager
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (資料庫, uuid) -> (簽章, 內容, 位元組數)
+        self.changes = {}  # 資料庫 -> (stamp, {uuid: 異動紀錄})，整個異動紀錄檔只解析一次
+        self.total = 0
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detail")
+        self.pending = set()
+
+    def _signature(self, db_name, uuid_str):
+        paths = self.dm.period_paths(uuid_str) + self.dm.table_paths(uuid_str) + [self.dm._changes_path(db_name)]
+        return tuple((p, _file_stamp(p)) for p in paths)
+
+    def _changes_for(self, db_name, uuid_str):
+        path = self.dm._changes_path(db_name)
+        stamp = _file_stamp(path)
+        with self.lock:
+            cached = self.changes.get(db_name)
+        if cached is None or cached[0] != stamp:
+            groups = {}
+            if stamp is not None:
+                df = pd.read_excel(path)
+                if "uuid" in df.columns:
+                    groups = {key: part for key, part in df.groupby(df["uuid"].astype(str))}
+            cached = (stamp, groups)
+            with self.lock:
+                self.changes[db_name] = cached
+        return cached[1].get(uuid_str, pd.DataFrame())
+
+    def _load(self, db_name, uuid_str):
+        periods = []
+        for path in self.dm.period_paths(uuid_str):
+            try:
+                periods.append((path, self.dm.load_period(path)))
+            except Exception as e:
+                periods.append((path, pd.DataFrame([["讀取失敗", str(e)]])))
+        tables = []
+        for path in self.dm.table_paths(uuid_str):
+            title = os.path.basename(path)
+            try:
+                with pd.ExcelFile(path) as xls:
+                    data = pd.read_excel(xls, sheet_name="data", header=None)
+                    meta = pd.read_excel(xls, sheet_name="metadata") if "metadata" in xls.sheet_names else pd.DataFrame()
+                if "title" in meta.columns and not meta.empty:
+                    title = meta.at[0, "title"]
+            except Exception as e:
+                data = e  # 展開時顯示錯誤訊息
+            tables.append((path, title, data))
+        try:
+            changes = self._changes_for(db_name, uuid_str)
+        except Exception as e:
+            changes = pd.DataFrame([{"標題": "讀取失敗", "異動日期": str(e), "異動前": "", "異動後": ""}])
+        frames = [changes] + [df for _, df in periods if df is not None] + [d for _, _, d in tables if isinstance(d, pd.DataFrame)]
+        size = sum(int(df.memory_usage(deep=True).sum()) for df in frames)
+        return {"periods": periods, "tables": tables, "changes": changes}, size
+
+    def get(self, db_name, uuid_str):
+        key = (db_name, uuid_str)
+        signature = self._signature(db_name, uuid_str)
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None and cached[0] == signature:
+                self.entries.move_to_end(key)
+                return cached[1]
+        detail, size = self._load(db_name, uuid_str)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total -= old[2]
+            self.entries[key] = (signature, detail, size)
+            self.total += size
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.total -= evicted
+        return detail
+
+    def prefetch(self, db_name, uuids):
+        for uuid_str in uuids:
+            key = (db_name, uuid_str)
+            with self.lock:
+                if key in self.pending or key in self.entries:
+                    continue
+                self.pending.add(key)
+            self.pool.submit(self._prefetch_one, key)
+
+    def _prefetch_one(self, key):
+        try:
+            self.get(*key)
+        except Exception as e:
+            print("預先載入詳細資料失敗：", key, e)
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+
+# 🧊 欄式快照：每次儲存提交後輸出未壓縮的 Arrow IPC（Feather v2）檔，
+# 其他程序（報表、腳本、無視窗 API）以 memory map 零複製讀取，不必各自解析 xlsx
+# {資料庫}.json 記錄目前版本與檔名；檔名含版本號，新版寫好後才切換，舊版保留 COLUMNAR_KEEP 份
+class ColumnarStore:
+    def __init__(self, folder=COLUMNAR_FOLDER, keep=COLUMNAR_KEEP):
+        self.folder = folder
+        self.keep = keep
+
+    def manifest_path(self, db_name):
+        return os.path.join(self.folder, f"{db_name}.json")
+
+    def manifest(self, db_name):
+        try:
+            with open(self.manifest_path(db_name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _arrow_frame(df):
+        # Arrow 欄位需單一型別：文字欄（可能混雜數字、日期、連結）一律轉成字串，空值保留
+        out = serialize_link_cells(df).copy()
+        for col in _text_columns(out):
+            values = out[col].astype(object)
+            out[col] = values.where(values.isna(), values.astype(str))
+        out.columns = [str(c) for c in out.columns]
+        return out
+
+    def publish(self, db_name, df):
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        os.makedirs(self.folder, exist_ok=True)
+        version = (self.manifest(db_name) or {}).get("version", 0) + 1
+        name = f"{db_name}.{version:08d}.arrow"
+        table = pa.Table.from_pandas(self._arrow_frame(df), preserve_index=False)
+        atomic_write(os.path.join(self.folder, name), lambda p: feather.write_feather(table, p, compression="uncompressed"))
+        atomic_write(self.manifest_path(db_name), _dump_json({
+            "version": version, "file": name, "rows": len(df),
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}))
+        self._prune(db_name)
+        return version
+
+    def _prune(self, db_name):
+        files = sorted(f for f in os.listdir(self.folder) if f.startswith(f"{db_name}.") and f.endswith(".arrow"))
+        for name in files[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass  # Windows 上仍被其他程序映射時無法刪除，下次再清
+
+
+class ColumnarReader:
+    # 其他程序使用：table() 只在版本變動時重新映射，其餘直接回傳同一個 pyarrow.Table
+    def __init__(self, db_name, folder=COLUMNAR_FOLDER):
+        self.db_name = db_name
+        self.store = ColumnarStore(folder)
+        self.version = None
+        self._table = None
+
+    def table(self):
+        import pyarrow as pa
+        for _ in range(3):
+            manifest = self.store.manifest(self.db_name)
+            if manifest is None:
+                raise FileNotFoundError(f"「{self.db_name}」尚未輸出欄式快照")
+            if manifest["version"] == self.version:
+                return self._table
+            try:
+                source = pa.memory_map(os.path.join(self.store.folder, manifest["file"]), "r")
+            except FileNotFoundError:
+                continue  # 讀取 manifest 後該版已被清掉，重新讀一次
+            self._table = pa.ipc.open_file(source).read_all()
+            self.version = manifest["version"]
+            return self._table
+        raise FileNotFoundError(f"「{self.db_name}」的欄式快照持續更新中，請稍後再試")
+
+    def frame(self):
+        return self.table().to_pandas()
+
+
+# 🖨 詳細資料表批次輸出：主程序一次讀齊資料並轉成純文字（可傳給子程序），
+# 排版在 ProcessPoolExecutor 中進行；PDF 以 PyMuPDF 的 Story 由 HTML 排版，沒有安裝時只能輸出 HTML
+def sheet_text(val):
+    if isinstance(val, (ExternalLink, InternalLink)):
+        return val.label
+    if val is None or (not isinstance(val, (str, bytes, list, dict)) and pd.isna(val)):
+        return ""
+    if isinstance(val, float) and val.is_integer():
+        return str(int(val))
+    if isinstance(val, datetime) and val == datetime(val.year, val.month, val.day):
+        return val.strftime("%Y-%m-%d")
+    return str(val)
+
+
+def _sheet_table(rows, header=None):
+    parts = ["<table>"]
+    if header:
+        parts.append("<tr>" + "".join(f"<th>{html.escape(h)}</th>" for h in header) + "</tr>")
+    for row in rows:
+        parts.append("<tr>" + "".join(f"<td>{html.escape(v)}</td>" for v in row) + "</tr>")
+    parts.append("</table>")
+    return "".join(parts)
+
+
+def detail_sheet_html(sheet):
+    # 一筆資料的內容（不含 <html>），依 groups_{db}.json 的分組排列
+    parts = [f"<h1>{html.escape(sheet['db'])}：{html.escape(sheet['title'])}</h1>",
+             f"<p class=\"uuid\">{html.escape(sheet['uuid'])}</p>"]
+    for group, fields in sheet["groups"]:
+        parts.append(f"<h2>{html.escape(group)}</h2><table>")
+        parts.extend(f"<tr><td class=\"field\">{html.escape(f)}</td><td>{html.escape(v)}</td></tr>" for f, v in fields)
+        parts.append("</table>")
+    for title, header, rows in sheet["periods"]:
+        parts.append(f"<h2>週期表 {html.escape(title)}</h2>" + _sheet_table(rows, header))
+    for title, rows in sheet["tables"]:
+        parts.append(f"<h2>{html.escape(title)}</h2>" + _sheet_table(rows))
+    header, rows = sheet["changes"]
+    if rows:
+        parts.append("<h2>異動紀錄</h2>" + _sheet_table(rows, header))
+    return "".join(parts)
+
+
+def detail_sheets_document(sheets):
+    body = "".join(f"<section>{detail_sheet_html(s)}</section>" for s in sheets)
+    return (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>詳細資料表</title>"
+            f"<style>{SHEET_CSS}</style></head><body>{body}</body></html>")
+
+
+def _render_sheet_job(sheets, path, fmt):
+    # 子程序執行：把一批資料表寫成一個檔案，回傳筆數
+    if fmt == "html":
+        def write(p):
+            with open(p, "w", encoding="utf-8") as f:
+                f.write(detail_sheets_document(sheets))
+    else:
+        import fitz
+
+        def write(p):
+            writer = fitz.DocumentWriter(p)
+            page = fitz.paper_rect("a4")
+            area = page + (36, 36, -36, -36)
+            for sheet in sheets:
+                # 每筆從新的一頁開始
+                story = fitz.Story(html=detail_sheet_html(sheet), user_css=SHEET_CSS)
+                more = True
+                while more:
+                    device = writer.begin_page(page)
+                    more, _ = story.place(area)
+                    story.draw(device)
+                    writer.end_page()
+            writer.close()
+    atomic_write(path, write)
+    return len(sheets)
+
+
+def _sheet_filename(sheet, fmt):
+    name = re.sub(r'[\\/:*?"<>|\s]+', "_", sheet["title"]).strip("_") or "record"
+    return f"{sheet['db']}_{name}_{sheet['uuid'][:8]}.{fmt}"
+
+
+def render_detail_sheets(sheets, target, fmt="pdf", combined=False, progress=None, workers=None):
+    # combined：target 為單一檔案；否則 target 為資料夾，每筆一個檔案。progress(完成筆數, 總筆數)
+    if fmt == "pdf" and not HAS_FITZ:
+        raise RuntimeError("輸出 PDF 需要安裝 PyMuPDF（pip install pymupdf），或改為輸出 HTML")
+    total = len(sheets)
+    if combined:
+        folder = os.path.dirname(target) or "."
+        base, ext = os.path.splitext(os.path.basename(target))
+        batches = [sheets[i:i + SHEET_BATCH] for i in range(0, total, SHEET_BATCH)]
+        jobs = [(batch, os.path.join(folder, f".~{base}.part{n:04d}{ext}")) for n, batch in enumerate(batches)]
+    else:
+        os.makedirs(target, exist_ok=True)
+        jobs = [([sheet], os.path.join(target, _sheet_filename(sheet, fmt))) for sheet in sheets]
+    if combined and fmt == "html":
+        # HTML 只是字串相接，不必分批
+        _render_sheet_job(sheets, target, fmt)
+        jobs = []
+    done = 0
+    workers = workers or max(1, min(len(jobs), (os.cpu_count() or 2) - 1))
+    try:
+        if jobs:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for future in as_completed([pool.submit(_render_sheet_job, batch, path, fmt) for batch, path in jobs]):
+                    done += future.result()
+                    if progress:
+                        progress(done, total)
+        if combined and fmt == "pdf":
+            import fitz
+
+            def merge(p):
+                with fitz.open() as doc:
+                    for _, path in jobs:
+                        with fitz.open(path) as part:
+                            doc.insert_pdf(part)
+                    doc.save(p)
+            atomic_write(target, merge)
+    finally:
+        if combined:
+            for _, path in jobs:
+                if os.path.exists(path):
+                    os.remove(path)
+    if progress:
+        progress(total, total)
+    return [target] if combined else [path for _, path in jobs]
+
+
+def open_path(path):
+    import platform
+    if platform.system() == "Windows":
+        os.startfile(path)
+    elif platform.system() == "Darwin":
+        subprocess.Popen(["open", path])
+    else:
+        subprocess.Popen(["xdg-open", path])
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
 class DataManager:
-    def __init__(self, config):
+    def __init__(self, config, all_partitions=False):
         self.config = config
-        self.data = {} # 各資料庫名稱對應的 DataFrame
+        self.all_partitions = all_partitions  # 不開視窗的工作不受 partitions.json 的 load 限制
+        self.data = LazyFrames(self.complete_load)  # 各資料庫名稱對應的 DataFrame
+        self.loader = ThreadPoolExecutor(max_workers=1)
         self.templates = {}
         self.groups = {}
+        self.journal = None  # 進行中的 WriteJournal
+        self.stamps = {}  # 正規化路徑 -> (mtime_ns, size)，用來判斷磁碟上的檔案是否被他人更動
+        self.base_versions = {}  # 資料庫 -> {uuid: 載入時的版本}
+        self.dirty = {}  # 資料庫 -> 本機修改過、尚未儲存的 uuid
+        self.deleted = {}  # 資料庫 -> 本機刪除、尚未儲存的 uuid
+        self.uuid_index = {}  # 資料庫 -> {uuid: 列索引}
+        self.versions = {}  # 資料庫 -> 記憶體中資料的變更計數，供各種快取判斷是否過期
+        self.column_cache = {}  # (資料庫, 欄位, 種類) -> (版本, 值)
+        self.period_version = 0  # 任何週期表變動時遞增
+        self.field_types = {}  # 資料庫 -> {欄位: {"type": "ref", "target": 資料庫}}
+        self.link_forward = {}  # 資料庫 -> {uuid: {欄位: (目標 uuid, 標籤)}}
+        self.link_reverse = {}  # 目標 uuid -> {(資料庫, uuid, 欄位)}
+        self.links_stale = set()
+        self.unique_indexes = {}  # (資料庫, 欄位) -> (建立時的 DataFrame, {值: {uuid}}, 範圍外的列)
+        self.report_cache = {}  # (報表定義, 資料版本) -> DataFrame
+        self.period_cache = {}  # 週期表路徑 -> (stamp, DataFrame)
+        self.attachments = AttachmentStore()
+        self.due_index = DueIndex()
+        self.snapshots = SnapshotStore()
+        self.archive = ArchiveStore()
+        self.details = DetailCache(self)
+        self.columnar = ColumnarStore() if HAS_PYARROW else None
+        self.columnar_versions = {}  # 資料庫 -> 最近一次輸出的欄式快照版本
+        self.partitions = {}  # 資料庫 -> 分區欄位
+        self.partition_scope = {}  # 資料庫 -> 已載入的分區集合（None 為全部）
+        self.part_origin = {}  # 資料庫 -> {uuid: 磁碟上所在的分區}
+        self.stale_parts = {}  # 資料庫 -> 下次儲存必須重寫的分區（例如載入時才補上 UUID）
+        self.part_cache = {}  # 分區檔路徑 -> ((stamp, migration 序號), 讀入的 DataFrame)
+        self.outside_cache = {}  # 資料庫 -> (各分區檔 stamp 與範圍, 範圍外的列, 其 uuid 集合)
+        self.schema_seqs = {}  # 資料庫 -> 記憶體中的資料已套用到的 migration 序號
+        self.meta_seqs = {}  # 資料庫 -> 模板與分組已套用到的 migration 序號
+        WriteJournal.recover()
+        self.load_partition_config()
         self.load_all()
 
     def load_all(self):
-        for db_name, path in self.config.items():
-            if os.path.exists(path):
-                self.data[db_name] = pd.read_excel(path)
+        for db_name in self.config:
+            self.load_database(db_name)
+            self.load_meta(db_name)
+
+    def load_database(self, db_name):
+        path = self.config[db_name]
+        with self.data.lock:
+            self.data.pending.pop(db_name, None)
+        if db_name in self.partitions:
+            # 分區檔各自不大，直接完整讀取目前範圍內的分區（已套用 _prepare_frame 與 migration）
+            self.stale_parts[db_name] = set()
+            self.data[db_name] = self._read_disk(db_name)
+        else:
+            if os.path.exists(path) and os.path.getsize(path) > STREAM_THRESHOLD:
+                # 大型活頁簿：先串流讀取 UUID、版本與摘要欄位讓資料頁可用，其餘欄位在 complete_load 補齊
+                # 沒有設定摘要欄位的資料庫，卡片顯示最前面兩欄
+                df = read_xlsx_columns(path, {"UUID", VERSION_COLUMN, *SUMMARY_FIELDS.get(db_name, [])}, leading=2)
+                self.data.pending[db_name] = None
+            elif os.path.exists(path):
+                df = pd.read_excel(path)
             else:
-                self.data[db_name] = pd.DataFrame()
+                df = pd.DataFrame()
+            self.data[db_name] = self._upgrade(db_name, self._prepare_frame(df), xlsx_schema_seq(path))
+        self.schema_seqs[db_name] = self._latest_seq(db_name)
+        for storage in self.storage_paths(db_name):
+            self.stamps[os.path.normpath(storage)] = _file_stamp(storage)
+        self.base_versions[db_name] = self._versions_of(self.preview(db_name))
+        self.dirty[db_name] = set()
+        self.deleted[db_name] = set()
+        self.reindex(db_name)
+        self.links_stale.add(db_name)
+
+    def preview(self, db_name):
+        # 不等待其餘欄位載入；資料頁卡片與 UUID 查詢只需要摘要欄位
+        return self.data.partial(db_name)
+
+    def prefetch(self, db_name):
+        # 在背景開始讀取完整資料（例如使用者打開資料頁時）
+        with self.data.lock:
+            if db_name in self.data.pending and self.data.pending[db_name] is None:
+                self.data.pending[db_name] = self.loader.submit(pd.read_excel, self.config[db_name])
+
+    def complete_load(self, db_name):
+        # 由 LazyFrames 持鎖呼叫；替換完成後才移出 pending，其他執行緒不會先拿到只有摘要欄位的資料
+        self.prefetch(db_name)
+        full = self.data.pending[db_name].result()
+        partial = dict.__getitem__(self.data, db_name)
+        if len(full) == len(partial):
+            # 沿用串流讀取時的 UUID（包含當時才補上的），列順序與檔案相同
+            full["UUID"] = partial["UUID"].to_numpy()
+        else:
+            print("完整載入的列數與摘要不符，重新建立 UUID：", db_name)
+        dict.__setitem__(self.data, db_name, self._upgrade(db_name, self._prepare_frame(full), xlsx_schema_seq(self.config[db_name])))
+        self.data.pending.pop(db_name)
+        self.reindex(db_name)
+        self.links_stale.add(db_name)
+
+    def touch(self, db_name):
+        self.versions[db_name] = self.versions.get(db_name, 0) + 1
+
+    def reindex(self, db_name):
+        self.touch(db_name)
+        df = self.preview(db_name)
+        if "UUID" in df.columns:
+            self.uuid_index[db_name] = dict(zip(df["UUID"].astype(str), df.index))
+        else:
+            self.uuid_index[db_name] = {}
+
+    def load_meta(self, db_name):
+        # 模板與群組設定
+        template_path = f"data/templates_{db_name}.json"
+        group_path = f"data/groups_{db_name}.json"
+
+        if os.path.exists(template_path):
+            with open(template_path, "r", encoding="utf-8") as f:
+                self.templates[db_name] = json.load(f)
+        else:
+            self.templates[db_name] = [c for c in self.preview(db_name).columns if c not in ("UUID", VERSION_COLUMN)]
+        self.stamps[os.path.normpath(template_path)] = _file_stamp(template_path)
+        self.load_field_types(db_name)
+
+        if os.path.exists(group_path):
+            with open(group_path, "r", encoding="utf-8") as f:
+                self.groups[db_name] = json.load(f)
+        else:
+            self.groups[db_name] = {}
+        self.stamps[os.path.normpath(group_path)] = _file_stamp(group_path)
+
+        applied = 0
+        if os.path.exists(self.schema_path(db_name)):
+            with open(self.schema_path(db_name), "r", encoding="utf-8") as f:
+                applied = json.load(f).get("seq", 0)
+        for _, migration in self._migrations_after(db_name, applied):
+            self._migrate_meta(db_name, migration)
+        self.meta_seqs[db_name] = self._latest_seq(db_name)
+        self.load_field_types(db_name)
+
+    @staticmethod
+    def _prepare_frame(df):
+        # 每列都需要 UUID 與版本欄位才能在多人儲存時比對
+        if df.columns.empty:
+            return df
+        if "UUID" not in df.columns:
+            df["UUID"] = None
+        missing = df["UUID"].isna() | (df["UUID"].astype(str).str.strip() == "")
+        if missing.any():
+            df["UUID"] = df["UUID"].astype(object)
+            df.loc[missing, "UUID"] = [str(uuid.uuid4()) for _ in range(int(missing.sum()))]
+        if VERSION_COLUMN not in df.columns:
+            df[VERSION_COLUMN] = 0
+        df[VERSION_COLUMN] = pd.to_numeric(df[VERSION_COLUMN], errors="coerce").fillna(0).astype("int64")
+        return parse_link_cells(df)
+
+    @staticmethod
+    def _versions_of(df):
+        if df.columns.empty:
+            return {}
+        return dict(zip(df["UUID"].astype(str), df[VERSION_COLUMN].astype(int)))
+
+    # ✏️ 本機修改追蹤
+    def ensure_uuid(self, db_name, index):
+        df = self.data[db_name]
+        if "UUID" not in df.columns:
+            df["UUID"] = None
+        if not pd.notnull(df.at[index, "UUID"]) or str(df.at[index, "UUID"]).strip() == "":
+            df["UUID"] = df["UUID"].astype(object)
+            df.at[index, "UUID"] = str(uuid.uuid4())
+            self.uuid_index.setdefault(db_name, {})[df.at[index, "UUID"]] = index
+        return str(df.at[index, "UUID"])
+
+    def mark_dirty(self, db_name, index):
+        self.dirty[db_name].add(self.ensure_uuid(db_name, index))
+        self.touch(db_name)
+
+    def delete_row(self, db_name, index):
+        df = self.data[db_name]
+        uuid_str = self.ensure_uuid(db_name, index)
+        self.dirty[db_name].discard(uuid_str)
+        if uuid_str in self.base_versions[db_name]:
+            self.deleted[db_name].add(uuid_str)
+        self._drop_links(db_name, uuid_str)
+        df.drop(index, inplace=True)
+        df.reset_index(drop=True, inplace=True)
+        self.reindex(db_name)
+
+    def delete_rows(self, db_name, uuids):
+        # 一次刪除多列，只重設一次索引
+        df = self.data[db_name]
+        uuids = set(uuids)
+        mask = df["UUID"].astype(str).isin(uuids)
+        for uuid_str in df.loc[mask, "UUID"].astype(str):
+            self.dirty[db_name].discard(uuid_str)
+            if uuid_str in self.base_versions[db_name]:
+                self.deleted[db_name].add(uuid_str)
+            self._drop_links(db_name, uuid_str)
+        df.drop(df.index[mask.to_numpy()], inplace=True)
+        df.reset_index(drop=True, inplace=True)
+        self.reindex(db_name)
 
-            # 模板與群組設定
+    def move_row(self, db_name, index, direction):
+        df = self.data[db_name]
+        new_index = index + direction
+        if 0 <= new_index < len(df):
+            df.iloc[[index, new_index]] = df.iloc[[new_index, index]].values
+            self.reindex(db_name)
+
+    def append_row(self, db_name, values=None):
+        df = self.data[db_name]
+        new_row = {col: "" for col in df.columns}
+        new_row.update(values or {})
+        new_row["UUID"] = str(uuid.uuid4())
+        new_row[VERSION_COLUMN] = 0
+        df.loc[len(df)] = new_row
+        self.dirty[db_name].add(new_row["UUID"])
+        self.uuid_index[db_name][new_row["UUID"]] = len(df) - 1
+        self.touch(db_name)
+        return len(df) - 1
+
+    def set_values(self, db_name, index, values):
+        # 寫入多個欄位；型別不符的欄位先轉成 object，不存在的欄位自動新增
+        df = self.data[db_name]
+        for key, val in values.items():
+            if key in ("UUID", VERSION_COLUMN):
+                continue
+            if key not in df.columns:
+                df[key] = None
+            if not pd.api.types.is_object_dtype(df[key]):
+                df[key] = df[key].astype(object)
+            df.at[index, key] = val
+        self.mark_dirty(db_name, index)
+
+    def rollback_point(self, db_name):
+        # 在交易中（sync_from_disk 之後、修改之前）登記：交易失敗時整個資料庫的記憶體內容、dirty 與 deleted 回到此刻
+        # 載入版本與檔案 stamp 一併還原，之後儲存時會重新合併這段期間他人寫入的內容
+        df = self.data[db_name].copy()
+        dirty, deleted = set(self.dirty[db_name]), set(self.deleted[db_name])
+        base = dict(self.base_versions[db_name])
+        seq = self.schema_seqs.get(db_name, 0)
+        stamps = {os.path.normpath(p): self.stamps.get(os.path.normpath(p)) for p in self.storage_paths(db_name)}
+
+        def restore():
+            self.data[db_name] = df
+            self.dirty[db_name] = dirty
+            self.deleted[db_name] = deleted
+            self.base_versions[db_name] = base
+            self.schema_seqs[db_name] = seq
+            self.stamps.update(stamps)
+            self.reindex(db_name)
+            self.links_stale.add(db_name)
+        self.journal.after_rollback.append(restore)
+
+    def bulk_update(self, db_name, uuids, values, title="批次修改"):
+        # 多筆一次指定或清除（值為 None）欄位：整欄遮罩賦值、資料檔只寫一次、異動紀錄一次附加；回傳筆數
+        with self.transaction():
+            self.sync_from_disk(db_name)
+            df = self.data[db_name]
+            mask = df["UUID"].astype(str).isin(set(uuids)).to_numpy()
+            if not mask.any():
+                return 0
+            values = {k: v for k, v in values.items() if k not in ("UUID", VERSION_COLUMN)}
+            # 儲存失敗（例如違反欄位規則）時還原這幾欄，不讓整批不合規的修改留在記憶體中
+            before = {key: df[key].copy() if key in df.columns else None for key in values}
+            dirty_before = set(self.dirty[db_name])
+            for key, val in values.items():
+                if key not in df.columns:
+                    df[key] = None
+                if not pd.api.types.is_object_dtype(df[key]):
+                    df[key] = df[key].astype(object)
+                df.loc[mask, key] = val
+            changed = df.loc[mask, "UUID"].astype(str)
+            self.dirty[db_name].update(changed)
+            self.touch(db_name)
+            if set(values) & set(self.ref_fields(db_name)) or any(isinstance(v, InternalLink) for v in values.values()):
+                self.links_stale.add(db_name)
+            try:
+                self._append_bulk_changes(db_name, changed, values, title)
+                self.save_data(db_name)
+            except Exception:
+                for key, column in before.items():
+                    if column is None:
+                        df.drop(columns=[key], inplace=True)
+                    else:
+                        df[key] = column
+                self.dirty[db_name] = dirty_before
+                self.touch(db_name)
+                raise
+        return int(mask.sum())
+
+    def _append_bulk_changes(self, db_name, changed, values, title):
+        # 一次附加整批異動紀錄，異動前沿用各筆上一次的異動後
+        changes_path = self._changes_path(db_name)
+        if os.path.exists(changes_path):
+            changes = pd.read_excel(changes_path)
+        else:
+            changes = pd.DataFrame(columns=["標題", "異動日期", "異動前", "異動後", "uuid"])
+        previous = changes.groupby(changes["uuid"].astype(str))["異動後"].last()
+        batch = pd.DataFrame({
+            "標題": title,
+            "異動日期": datetime.today().strftime("%Y-%m-%d"),
+            "異動前": changed.map(previous).fillna("無").to_numpy(),
+            "異動後": "；".join(f"{k}：{'（清除）' if v is None else v}" for k, v in values.items()),
+            "uuid": changed.to_numpy(),
+        })
+        os.makedirs("data", exist_ok=True)
+        self.write_excel(changes_path, pd.concat([changes, batch], ignore_index=True) if not changes.empty else batch)
+
+    def index_of(self, db_name, uuid_str):
+        df = self.preview(db_name)
+        if df is None or "UUID" not in df.columns:
+            return None
+        index = self.uuid_index.get(db_name, {}).get(uuid_str)
+        if index is not None and index in df.index and df.at[index, "UUID"] == uuid_str:
+            return index
+        # 索引過期（例如外部直接改動 DataFrame）時重建一次
+        self.reindex(db_name)
+        return self.uuid_index[db_name].get(uuid_str)
+
+    # 🔍 查詢用的欄位型別轉換與等值索引（依資料版本快取）
+    def _cached(self, key, build):
+        version = self.versions.get(key[0], 0)
+        cached = self.column_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = build()
+        self.column_cache[key] = (version, value)
+        return value
+
+    def typed_column(self, db_name, column, kind):
+        def build():
+            col = self.data[db_name][column]
+            if pd.api.types.is_object_dtype(col):
+                # 連結儲存格以標籤參與文字查詢，不參與數字/日期轉換
+                links = link_mask(col.to_numpy())
+                if links.any():
+                    col = col.where(~links, col[links].map(lambda link: link.label) if kind == "text" else None)
+            if kind == "text":
+                return col.astype(object).where(col.notna(), "").astype(str)
+            if kind == "number":
+                return pd.to_numeric(col, errors="coerce")
+            return to_dates(col)
+        return self._cached((db_name, column, kind), build)
+
+    def value_positions(self, db_name, column):
+        # 欄位值（字串形式）-> 列位置陣列
+        return self._cached((db_name, column, "positions"),
+                            lambda: pd.Series(np.arange(len(self.data[db_name]))).groupby(
+                                self.typed_column(db_name, column, "text").to_numpy()).indices)
+
+    def sort_key(self, db_name, column):
+        # 能全部轉成數字就以數字排序，其次日期，否則以字串排序
+        def build():
+            text = self.typed_column(db_name, column, "text")
+            filled = (text.str.strip() != "").to_numpy()
+            number = self.typed_column(db_name, column, "number")
+            if number.notna().to_numpy().sum() == filled.sum():
+                return number.to_numpy()
+            date = self.typed_column(db_name, column, "date")
+            if date.notna().to_numpy().sum() == filled.sum():
+                return date.to_numpy()
+            return np.where(filled, text.to_numpy(), None)
+        return self._cached((db_name, column, "sort"), build)
+
+    def views_path(self, db_name):
+        return f"data/views_{db_name}.json"
+
+    def load_views(self, db_name):
+        path = self.views_path(db_name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_view(self, db_name, name, query):
+        views = self.load_views(db_name)
+        if query is None:
+            views.pop(name, None)
+        else:
+            views[name] = query.to_dict()
+        self.write_json(self.views_path(db_name), views)
+
+    # 🔗 跨資料庫關聯：模板中可宣告 {"name": 欄位, "type": "ref", "target": 資料庫}
+    def load_field_types(self, db_name):
+        self.field_types[db_name] = {
+            entry["name"]: entry for entry in self.templates.get(db_name, [])
+            if isinstance(entry, dict) and "name" in entry
+        }
+        self.links_stale.add(db_name)
+
+    def template_fields(self, db_name):
+        return [entry["name"] if isinstance(entry, dict) else entry for entry in self.templates.get(db_name, [])]
+
+    def set_template_fields(self, db_name, fields):
+        # 保留仍存在欄位的型別宣告
+        types = self.field_types.get(db_name, {})
+        self.templates[db_name] = [types.get(f, f) for f in dict.fromkeys(fields)]
+        self.load_field_types(db_name)
+
+    def ref_fields(self, db_name):
+        return {name: entry.get("target") for name, entry in self.field_types.get(db_name, {}).items()
+                if entry.get("type") == "ref"}
+
+    def _drop_links(self, db_name, uuid_str):
+        for field, (target, _) in self.link_forward.get(db_name, {}).pop(uuid_str, {}).items():
+            sources = self.link_reverse.get(target)
+            if sources is not None:
+                sources.discard((db_name, uuid_str, field))
+                if not sources:
+                    del self.link_reverse[target]
+
+    def _add_links(self, db_name, uuid_str, links):
+        if not links:
+            return
+        self.link_forward.setdefault(db_name, {})[uuid_str] = links
+        for field, (target, _) in links.items():
+            self.link_reverse.setdefault(target, set()).add((db_name, uuid_str, field))
+
+    def _row_links(self, db_name, row, columns):
+        refs = self.ref_fields(db_name)
+        links = {}
+        for col in columns:
+            val = row[col]
+            if isinstance(val, InternalLink):
+                links[col] = (val.uuid, val.label)
+            elif col in refs and isinstance(val, str) and val.strip():
+                # 關聯欄位也接受直接填入 UUID
+                links[col] = (val.strip(), val.strip())
+        return links
+
+    def _index_links(self, db_name):
+        for uuid_str in list(self.link_forward.get(db_name, {})):
+            self._drop_links(db_name, uuid_str)
+        self.link_forward[db_name] = {}
+        df = self.data.get(db_name)
+        if df is None or "UUID" not in df.columns:
+            return
+        # 先以向量化字串比對篩出可能含連結的儲存格，只解析這些
+        refs = self.ref_fields(db_name)
+        candidates = pd.Series(False, index=df.index)
+        columns = []
+        for col in _text_columns(df):
+            if col in ("UUID", VERSION_COLUMN):
+                continue
+            mask = pd.Series(link_mask(df[col].to_numpy(), InternalLink), index=df.index)
+            if col in refs:
+                mask |= df[col].notna() & (df[col].astype(object).astype(str).str.strip() != "")
+            if mask.any():
+                candidates |= mask
+                columns.append(col)
+        for index in df.index[candidates.to_numpy()]:
+            row = df.loc[index]
+            self._add_links(db_name, str(row["UUID"]), self._row_links(db_name, row, columns))
+
+    def _ensure_links(self):
+        for db_name in list(self.link_forward):
+            if db_name not in self.data:
+                self.links_stale.add(db_name)
+        while self.links_stale:
+            db_name = self.links_stale.pop()
+            if db_name in self.data:
+                self._index_links(db_name)
+            else:
+                for uuid_str in list(self.link_forward.get(db_name, {})):
+                    self._drop_links(db_name, uuid_str)
+                self.link_forward.pop(db_name, None)
+
+    def update_links(self, db_name, uuid_str):
+        # 儲存單筆時只重新解析該列
+        self._ensure_links()
+        self._drop_links(db_name, uuid_str)
+        index = self.index_of(db_name, uuid_str)
+        if index is None:
+            return
+        df = self.data[db_name]
+        columns = [c for c in df.columns if c not in ("UUID", VERSION_COLUMN)]
+        self._add_links(db_name, uuid_str, self._row_links(db_name, df.loc[index], columns))
+
+    def links_from(self, db_name, uuid_str):
+        self._ensure_links()
+        return dict(self.link_forward.get(db_name, {}).get(uuid_str, {}))
+
+    def backlinks(self, uuid_str):
+        # 回傳 [(來源資料庫, 來源 uuid, 欄位)]
+        self._ensure_links()
+        return sorted(self.link_reverse.get(uuid_str, ()))
+
+    def joined_column(self, db_name, field, target_column):
+        # 依關聯索引把目標資料庫的欄位對應回來源列（匯出用）
+        self._ensure_links()
+        df = self.data[db_name]
+        forward = self.link_forward.get(db_name, {})
+        targets = df["UUID"].astype(str).map(lambda u: forward.get(u, {}).get(field, (None,))[0])
+        target_db = self.ref_fields(db_name).get(field)
+        candidates = [target_db] if target_db in self.data else list(self.data)
+        result = pd.Series(None, index=df.index, dtype=object)
+        for name in candidates:
+            target_df = self.data[name]
+            if "UUID" not in target_df.columns or target_column not in target_df.columns:
+                continue
+            unique = target_df.drop_duplicates("UUID")
+            lookup = pd.Series(unique[target_column].to_numpy(), index=unique["UUID"].astype(str))
+            result = result.where(result.notna(), targets.map(lookup))
+        return result
+
+    # ✅ 欄位規則：模板中可宣告 {"name": 欄位, "unique": true, "required": true, "regex": 正規表示式, "min": 下限, "max": 上限}
+    def constraints(self, db_name):
+        return {name: entry for name, entry in self.field_types.get(db_name, {}).items()
+                if any(key in entry for key in ("unique", "required", "regex", "min", "max"))}
+
+    @staticmethod
+    def _rule_failures(text, spec):
+        # 回傳 {規則: 布林遮罩}；唯一性需要其他列的值，另外判斷
+        filled = text != ""
+        failures = {}
+        if spec.get("required"):
+            failures["required"] = ~filled
+        if spec.get("regex"):
+            failures["regex"] = filled & ~text.str.fullmatch(spec["regex"]).astype(bool)
+        if "min" in spec or "max" in spec:
+            number = pd.to_numeric(text.where(filled), errors="coerce")
+            bad = filled & number.isna()
+            if "min" in spec:
+                bad |= number < float(spec["min"])
+            if "max" in spec:
+                bad |= number > float(spec["max"])
+            failures["range"] = bad
+        return failures
+
+    def unique_index(self, db_name, field):
+        # 值 -> 持有該值的 uuid；換掉 DataFrame 時重建，其餘情況由檢查時逐列補上，過期項目在查詢時過濾
+        # 部分載入時範圍外分區的列也要算進來（分區檔變動時一併重建）
+        df = self.data[db_name]
+        outside = self.outside_rows(db_name)
+        cached = self.unique_indexes.get((db_name, field))
+        if cached is not None and cached[0] is df and cached[2] is outside:
+            return cached[1]
+        index = {}
+        frame = df if outside is None or outside.empty else pd.concat([df, outside], ignore_index=True)
+        if field in frame.columns:
+            text = constraint_text(frame[field])
+            filled = (text != "").to_numpy()
+            uuids = frame["UUID"].astype(str).to_numpy()[filled]
+            index = {value: set(uuids[positions]) for value, positions in
+                     pd.Series(np.arange(len(uuids))).groupby(text.to_numpy()[filled]).indices.items()}
+        self.unique_indexes[(db_name, field)] = (df, index, outside)
+        return index
+
+    def _holds(self, db_name, field, uuid_str, value):
+        index = self.index_of(db_name, uuid_str)
+        if index is None:
+            # 不在記憶體中的列只可能來自範圍外的分區，內容以磁碟為準（索引隨分區檔 stamp 重建）
+            cached = self.outside_cache.get(db_name)
+            return cached is not None and uuid_str in cached[2] and uuid_str not in self.deleted[db_name]
+        return constraint_text(self.data[db_name].loc[[index], field]).iat[0] == value
+
+    def _unique_clashes(self, db_name, field, uuids, text):
+        index = self.unique_index(db_name, field)
+        clashes = []
+        for uuid_str, value in zip(uuids, text):
+            if not value:
+                clashes.append(False)
+                continue
+            holders = index.setdefault(value, set())
+            clashes.append(any(self._holds(db_name, field, other, value) for other in holders if other != uuid_str))
+            if uuid_str:
+                holders.add(uuid_str)
+        return pd.Series(clashes, index=text.index, dtype=bool)
+
+    def _violations(self, db_name, rows, unique=None):
+        # unique 為 None 時以雜湊索引比對整個資料庫，否則傳入向量化算好的 {欄位: 重複遮罩}
+        frames = []
+        for field, spec in self.constraints(db_name).items():
+            text = constraint_text(rows[field]) if field in rows.columns else pd.Series("", index=rows.index, dtype=object)
+            failures = self._rule_failures(text, spec)
+            if spec.get("unique"):
+                failures["unique"] = (unique[field] if unique is not None else
+                                      self._unique_clashes(db_name, field, rows["UUID"].astype(str), text))
+            for rule, mask in failures.items():
+                mask = mask.to_numpy()
+                if mask.any():
+                    frames.append(pd.DataFrame({"UUID": rows["UUID"].astype(str).to_numpy()[mask], "欄位": field,
+                                                "規則": CONSTRAINT_RULES[rule], "值": text.to_numpy()[mask]}))
+        if not frames:
+            return pd.DataFrame(columns=VALIDATION_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    def check_constraints(self, db_name):
+        # 儲存前只檢查本機修改過的列；唯一性以雜湊索引查詢，不掃描整欄
+        if not self.constraints(db_name) or not self.dirty[db_name]:
+            return
+        positions = [i for i in (self.index_of(db_name, u) for u in self.dirty[db_name]) if i is not None]
+        violations = self._violations(db_name, self.data[db_name].loc[positions])
+        if not violations.empty:
+            raise ValidationError(db_name, violations)
+
+    def check_values(self, db_name, values, uuid_str=None):
+        # 寫入前先檢查（API 用），避免不合規的內容留在記憶體中
+        if not self.constraints(db_name):
+            return
+        df = self.data[db_name]
+        index = self.index_of(db_name, uuid_str) if uuid_str else None
+        row = df.loc[[index]].copy() if index is not None else pd.DataFrame({"UUID": [uuid_str or ""]})
+        row = row.astype(object)
+        for key, val in values.items():
+            if key not in ("UUID", VERSION_COLUMN):
+                row[key] = [val]
+        violations = self._violations(db_name, row)
+        if not violations.empty:
+            raise ValidationError(db_name, violations)
+
+    def validate_database(self, db_name):
+        # 整個資料庫一次檢查：各規則以向量化運算判斷，唯一性用 duplicated（含範圍外分區的列，只回報已載入的列）
+        df = self.data[db_name]
+        if df.columns.empty:
+            return pd.DataFrame(columns=VALIDATION_COLUMNS)
+        everything = self.unified_frame(db_name)
+        unique = {}
+        for field, spec in self.constraints(db_name).items():
+            if spec.get("unique"):
+                text = (constraint_text(everything[field]) if field in everything.columns
+                        else pd.Series("", index=everything.index, dtype=object))
+                clash = ((text != "") & text.duplicated(keep=False)).to_numpy()[:len(df)]
+                unique[field] = pd.Series(clash, index=df.index)
+        return self._violations(db_name, df, unique)
+
+    # 🧬 模糊重複偵測與合併
+    def find_duplicates(self, db_name, fields=None, threshold=DEDUP_THRESHOLD):
+        # 以 2-gram 倒排索引分組，只比較至少共用一個 2-gram 的資料；回傳 [UUID_A, UUID_B, 相似度]
+        df = self.data[db_name]
+        fields = [f for f in (fields or DEDUP_FIELDS.get(db_name) or SUMMARY_FIELDS.get(db_name, [])) if f in df.columns]
+        if not fields or df.empty:
+            return pd.DataFrame(columns=["UUID_A", "UUID_B", "相似度"])
+        grams = [[_bigrams(text) for text in normalize_text(df[f])] for f in fields]
+        postings = {}
+        for pos, row_grams in enumerate(zip(*grams)):
+            for gram in set().union(*row_grams):
+                postings.setdefault(gram, []).append(pos)
+        candidates = set()
+        for positions in postings.values():
+            if 1 < len(positions) <= DEDUP_MAX_BLOCK:
+                candidates.update((a, b) for i, a in enumerate(positions) for b in positions[i + 1:])
+        uuids = df["UUID"].astype(str).to_numpy()
+        pairs = []
+        for a, b in candidates:
+            # 兩邊都有值的欄位取平均；主要欄位（第一個）空白的資料不比對
+            scores = [_dice(g[a], g[b]) for g in grams if g[a] and g[b]]
+            if not grams[0][a] or not grams[0][b] or not scores:
+                continue
+            score = sum(scores) / len(scores)
+            if score >= threshold:
+                pairs.append((uuids[a], uuids[b], round(score, 3)))
+        result = pd.DataFrame(pairs, columns=["UUID_A", "UUID_B", "相似度"])
+        return result.sort_values("相似度", ascending=False, ignore_index=True)
+
+    def _next_file_number(self, folder, prefix):
+        numbers = [int(f[len(prefix):-5]) for f in os.listdir(folder)
+                   if f.startswith(prefix) and f.endswith(".xlsx") and f[len(prefix):-5].isdigit()] if os.path.isdir(folder) else []
+        return max(numbers, default=0) + 1
+
+    def merge_records(self, db_name, keep_uuid, drop_uuids):
+        # 把重複資料併入保留的那一筆：空白欄位由被合併者補上，關聯、週期表、表格與異動紀錄改指向保留者
+        drop_uuids = [u for u in drop_uuids if u != keep_uuid]
+        with self.transaction() as journal:
+            self.sync_from_disk(db_name)
+            df = self.data[db_name]
+            keep_index = self.index_of(db_name, keep_uuid)
+            drop_index = [i for i in (self.index_of(db_name, u) for u in drop_uuids) if i is not None]
+            if keep_index is None or not drop_index:
+                return 0
+            drop_uuids = [str(df.at[i, "UUID"]) for i in drop_index]
+            # 儲存失敗（例如補上的值不符欄位規則）時，補值、刪除與連結改指向都不留在記憶體中
+            self.rollback_point(db_name)
+            fills = {}
+            for col in df.columns:
+                if col in ("UUID", VERSION_COLUMN):
+                    continue
+                texts = constraint_text(df.loc[[keep_index] + drop_index, col])
+                if texts.iat[0] == "" and (texts != "").any():
+                    fills[col] = df.at[texts.index[(texts != "").to_numpy()][0], col]
+            if fills:
+                self.set_values(db_name, keep_index, fills)
+
+            # 🔗 其他資料指向被合併者的連結
+            touched_dbs = {db_name}
+            for drop in drop_uuids:
+                for src_db, src_uuid, field in self.backlinks(drop):
+                    if src_db == db_name and src_uuid in drop_uuids:
+                        continue
+                    self.sync_from_disk(src_db)
+                    index = self.index_of(src_db, src_uuid)
+                    if index is None:
+                        continue
+                    if src_db not in touched_dbs:
+                        self.rollback_point(src_db)
+                    val = self.data[src_db].at[index, field]
+                    self.set_values(src_db, index, {field: InternalLink(val.label, keep_uuid) if isinstance(val, InternalLink) else keep_uuid})
+                    self.update_links(src_db, src_uuid)
+                    touched_dbs.add(src_db)
+
+            # 📅 週期表：同編號的併成一個檔（詳細頁只顯示第 1 份），其餘改用保留者的下一個編號；📋 表格一律改編號
+            moved = []
+            periods = {}
+            table_prefix = f"{keep_uuid}_table_"
+            table_number = self._next_file_number(TABLES_FOLDER, table_prefix)
+            for drop in drop_uuids:
+                for path in self.period_paths(drop):
+                    target = os.path.join(PERIOD_FOLDER, f"{keep_uuid}_period_{os.path.basename(path).split('_period_', 1)[1]}")
+                    if target not in periods:
+                        periods[target] = [self.load_period(target)] if os.path.exists(target) else []
+                    periods[target].append(pd.read_excel(path))
+                    moved.append(path)
+                for path in self.table_paths(drop):
+                    self.write_file(os.path.join(TABLES_FOLDER, f"{table_prefix}{table_number}.xlsx"),
+                                    lambda p, src=path: shutil.copyfile(src, p))
+                    table_number += 1
+                    moved.append(path)
+            for target, frames in periods.items():
+                self.write_excel(target, pd.concat(frames, ignore_index=True))
+
+            # 📝 異動紀錄
+            changes_path = self._changes_path(db_name)
+            if os.path.exists(changes_path):
+                changes = pd.read_excel(changes_path)
+                mask = changes["uuid"].astype(str).isin(drop_uuids)
+                if mask.any():
+                    changes["uuid"] = changes["uuid"].astype(object)
+                    changes.loc[mask, "uuid"] = keep_uuid
+                    self.write_excel(changes_path, changes)
+
+            self.delete_rows(db_name, drop_uuids)
+            for name in touched_dbs:
+                self.save_data(name)
+            self.update_links(db_name, keep_uuid)
+            journal.after_commit.append(lambda: self._remove_files(moved))
+        return len(drop_uuids)
+
+    def find_uuid(self, uuid_str):
+        # 跨資料庫查詢 UUID，回傳 (資料庫, 列索引)
+        for db_name in self.data:
+            index = self.index_of(db_name, uuid_str)
+            if index is not None:
+                return db_name, index
+        return None, None
+
+    # 🔄 與磁碟上的版本比對、合併
+    def _read_disk(self, db_name):
+        path = self.config[db_name]
+        if db_name in self.partitions:
+            df, self.part_origin[db_name], stale = self._read_partitions(db_name, self.partition_scope[db_name])
+            self.stale_parts[db_name] |= stale
+            return df
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=["UUID", VERSION_COLUMN])
+        return self._read_excel(db_name, path)
+
+    def _find_conflicts(self, db_name, disk_df):
+        disk_versions = self._versions_of(disk_df)
+        base = self.base_versions[db_name]
+        conflicts = []
+        for uuid_str in self.dirty[db_name] | self.deleted[db_name]:
+            if uuid_str not in base:
+                continue  # 本機新增的資料列
+            if disk_versions.get(uuid_str) != base[uuid_str]:
+                conflicts.append(uuid_str)
+        return sorted(conflicts)
+
+    def _merge_from_disk(self, db_name, disk_df):
+        # 本機修改過的列保留本機內容，其餘列以磁碟為準；順序以本機為主，他人新增的列附加在最後
+        # 其他工作站可能已變更欄位結構，本機資料先套用相同的 migration 再合併
+        local = self._upgrade(db_name, self.data[db_name], self.schema_seqs.get(db_name, 0))
+        self.schema_seqs[db_name] = self._latest_seq(db_name)
+        self.links_stale.add(db_name)
+        if local.columns.empty:
+            self.data[db_name] = disk_df
+            self.base_versions[db_name] = self._versions_of(disk_df)
+            self.reindex(db_name)
+            return
+        dirty = self.dirty[db_name]
+        deleted = self.deleted[db_name]
+        base = self.base_versions[db_name]
+        remote = disk_df.drop_duplicates("UUID", keep="last")
+        remote = remote.set_index(remote["UUID"].astype(str))
+        local_uuids = local["UUID"].astype(str)
+        local_i = local.set_index(local_uuids)
+        local_i = local_i[~local_i.index.duplicated(keep="last")]
+
+        order = [u for u in local_i.index if u in dirty or u in remote.index or u not in base]
+        local_set = set(local_i.index)
+        order += [u for u in remote.index if u not in local_set and u not in deleted]
+        from_local = [u for u in order if u in dirty or u not in remote.index]
+        from_local_set = set(from_local)
+        from_remote = [u for u in order if u not in from_local_set]
+
+        merged = pd.concat([local_i.loc[from_local], remote.loc[from_remote]])
+        merged = merged.reindex(order).reset_index(drop=True)
+        self.data[db_name] = merged
+        self.reindex(db_name)
+
+        versions = self._versions_of(remote)
+        for uuid_str in dirty:
+            if uuid_str in base:
+                versions[uuid_str] = base[uuid_str]
+        self.base_versions[db_name] = versions
+
+    def resolve_conflicts(self, db_name, keep_local=True):
+        # keep_local：以本機內容覆蓋他人修改；否則捨棄本機修改並重新載入
+        if keep_local:
+            disk_versions = self._versions_of(self._read_disk(db_name))
+            base = self.base_versions[db_name]
+            for uuid_str in self.dirty[db_name] | self.deleted[db_name]:
+                if uuid_str in disk_versions:
+                    base[uuid_str] = disk_versions[uuid_str]
+                else:
+                    base.pop(uuid_str, None)
+                    self.deleted[db_name].discard(uuid_str)
+        else:
+            self.load_database(db_name)
+
+    def refresh_database(self, db_name):
+        paths = self.storage_paths(db_name)
+        with ExitStack() as locks:
+            for path in paths:
+                locks.enter_context(FileLock(path))
+            stamps = {os.path.normpath(path): _file_stamp(path) for path in paths}
+            self._merge_from_disk(db_name, self._read_disk(db_name))
+        self.stamps.update(stamps)
+
+    def poll_changes(self):
+        # 只比對 mtime/大小，有變動的來源才重新讀取
+        changed = []
+        for db_name in self.config:
+            if db_name not in self.data:
+                continue
+            if any(_file_stamp(path) != self.stamps.get(os.path.normpath(path)) for path in self.storage_paths(db_name)):
+                self.refresh_database(db_name)
+                changed.append(db_name)
             template_path = f"data/templates_{db_name}.json"
             group_path = f"data/groups_{db_name}.json"
+            if (_file_stamp(template_path) != self.stamps.get(os.path.normpath(template_path))
+                    or _file_stamp(group_path) != self.stamps.get(os.path.normpath(group_path))):
+                self.load_meta(db_name)
+                if db_name not in changed:
+                    changed.append(db_name)
+        return changed
+
+    # 🖨 詳細資料表：欄位依分組、週期表、自訂表格與異動紀錄，全部轉成純文字
+    def detail_sheets(self, db_name, uuids):
+        # 在主執行緒從記憶體取出欄位值（DataFrame 不是執行緒安全的）；週期表、表格與異動紀錄由 fill_detail_sheets 補上
+        df = self.data[db_name]
+        groups = self.groups.get(db_name) or {"欄位": [c for c in df.columns if c not in ("UUID", VERSION_COLUMN)]}
+        summary = [c for c in SUMMARY_FIELDS.get(db_name, []) if c in df.columns]
+        ref_fields = self.ref_fields(db_name)
+        sheets = []
+        for uuid_str in uuids:
+            index = self.index_of(db_name, uuid_str)
+            if index is None:
+                continue
+            row = df.loc[index]
+            fields = []
+            for group, names in groups.items():
+                values = []
+                for field in names:
+                    if not field:
+                        continue
+                    val = row.get(field, "")
+                    if field in ref_fields and isinstance(val, str) and val.strip():
+                        target = self.index_of(ref_fields[field], val.strip())
+                        if target is not None:
+                            target_row = self.data[ref_fields[field]].loc[target]
+                            val = " ".join(sheet_text(target_row.get(c)) for c in SUMMARY_FIELDS.get(ref_fields[field], [])) or val
+                    values.append((field, sheet_text(val)))
+                fields.append((group, values))
+            sheets.append({
+                "db": db_name, "uuid": uuid_str,
+                "title": " ".join(sheet_text(row.get(c)) for c in summary) or uuid_str,
+                "groups": fields,
+            })
+        return sheets
+
+    def fill_detail_sheets(self, sheets, progress=None):
+        # 只讀檔案，可在背景執行緒執行；progress(已讀取筆數, 總筆數)
+        for done, sheet in enumerate(sheets, 1):
+            # 不經過 LRU，避免大量輸出把畫面正在使用的詳細資料擠出快取
+            detail, _ = self.details._load(sheet["db"], sheet["uuid"])
+            periods = []
+            for path, period in detail["periods"]:
+                if period is None:
+                    continue
+                periods.append((os.path.splitext(os.path.basename(path))[0].split("_period_")[-1], [str(c) for c in period.columns],
+                                [[sheet_text(v) for v in values] for values in period.itertuples(index=False)]))
+            tables = [(sheet_text(title), [[sheet_text(v) for v in values] for values in data.itertuples(index=False)])
+                      for _, title, data in detail["tables"] if isinstance(data, pd.DataFrame)]
+            changes = detail["changes"].drop(columns=["uuid"], errors="ignore")
+            sheet.update({
+                "periods": periods, "tables": tables,
+                "changes": ([str(c) for c in changes.columns],
+                            [[sheet_text(v) for v in values] for values in changes.itertuples(index=False)]),
+            })
+            if progress:
+                progress(done, len(sheets))
+        return sheets
+
+    # 🗂 分區儲存：PARTITIONS_PATH 宣告分區欄位後，每個分區存成 {資料檔}_part_{分區}.xlsx，
+    # 分區欄位空白的列（以及啟用分區前的舊資料）留在原資料檔，第一次儲存時舊資料自動搬到各分區檔。
+    # 記憶體中仍是單一 DataFrame（只含已載入的分區），資料頁、查詢與 UUID 索引照常使用；
+    # 儲存時只重寫有變動的分區檔，範圍外的列原樣保留
+    def load_partition_config(self):
+        try:
+            with open(PARTITIONS_PATH, "r", encoding="utf-8") as f:
+                declared = json.load(f)
+        except (OSError, ValueError):
+            declared = {}
+        for db_name, spec in declared.items():
+            if db_name not in self.config or not spec.get("by"):
+                continue
+            self.partitions[db_name] = spec["by"]
+            load = None if self.all_partitions else spec.get("load")
+            # 分區欄位空白（尚未分配）的列在每個範圍都看得到
+            self.partition_scope[db_name] = set(partition_names(pd.Series(load, dtype=object))) | {""} if load else None
+            self.stale_parts[db_name] = set()
+
+    def partition_keys(self, db_name, df):
+        column = self.partitions[db_name]
+        if column not in df.columns:
+            return pd.Series("", index=df.index)
+        return partition_names(df[column])
+
+    def in_scope(self, db_name, df):
+        # 列是否屬於目前載入的分區（未分區或全部載入時皆為 True）
+        scope = self.partition_scope.get(db_name)
+        if scope is None:
+            return pd.Series(True, index=df.index)
+        return self.partition_keys(db_name, df).isin(scope)
+
+    def partition_path(self, db_name, key):
+        path = self.config[db_name]
+        if not key:
+            return path
+        stem, ext = os.path.splitext(path)
+        return f"{stem}_part_{key}{ext}"
 
-            if os.path.exists(template_path):
-                with open(template_path, "r", encoding="utf-8") as f:
-                    self.templates[db_name] = json.load(f)
+    def partition_files(self, db_name, scope=None):
+        # 磁碟上的分區檔 {分區: 路徑}；原資料檔（空白分區）一律列入
+        path = self.config[db_name]
+        folder = os.path.dirname(path) or "."
+        stem, ext = os.path.splitext(os.path.basename(path))
+        prefix = f"{stem}_part_"
+        files = {"": path}
+        if os.path.isdir(folder):
+            for name in sorted(os.listdir(folder)):
+                key = name[len(prefix):-len(ext)]
+                if name.startswith(prefix) and name.endswith(ext) and key and (scope is None or key in scope):
+                    files[key] = os.path.join(folder, name)
+        return files
+
+    def storage_paths(self, db_name):
+        # 記憶體中的資料所依據的檔案（比對 stamp、上鎖用）
+        if db_name not in self.partitions:
+            return [self.config[db_name]]
+        return list(self.partition_files(db_name, self.partition_scope[db_name]).values())
+
+    def _read_partitions(self, db_name, scope):
+        # 讀取範圍內的分區檔，回傳 (合併後的資料, {uuid: 所在分區}, 需要重寫的分區)
+        frames, origin, stale = [], {}, set()
+        for key, path in self.partition_files(db_name, scope).items():
+            if not os.path.exists(path):
+                continue
+            df = pd.read_excel(path)
+            if not df.empty and ("UUID" not in df.columns or df["UUID"].isna().any()):
+                stale.add(key)
+            df = self._upgrade(db_name, self._prepare_frame(df), xlsx_schema_seq(path))
+            if df.columns.empty:
+                continue
+            if scope is not None:
+                df = df[self.partition_keys(db_name, df).isin(scope).to_numpy()]
+            # 同一 UUID 同時留在較早的檔案（例如搬移到分區檔前的舊資料檔）時，該檔下次儲存要重寫掉舊的副本
+            stale.update(origin[u] for u in df["UUID"].astype(str) if origin.get(u, key) != key)
+            origin.update(dict.fromkeys(df["UUID"].astype(str), key))
+            frames.append(df)
+        filled = [df for df in frames if not df.empty]
+        if len(filled) > 1:
+            # 舊資料檔排在最前面，同一 UUID 以分區檔為準
+            merged = pd.concat(filled, ignore_index=True).drop_duplicates("UUID", keep="last").reset_index(drop=True)
+        elif filled or frames:
+            merged = (filled or frames)[0].reset_index(drop=True)
+        else:
+            merged = pd.DataFrame(columns=["UUID", VERSION_COLUMN])
+        return merged, origin, stale
+
+    def _write_partitions(self, db_name, df):
+        # 只重寫有變動列所在（或原本所在）的分區檔；部分載入時保留檔案中範圍外的列
+        keys = self.partition_keys(db_name, df)
+        uuids = df["UUID"].astype(str)
+        origin = self.part_origin.get(db_name, {})
+        changed = self.dirty[db_name] | self.deleted[db_name]
+        targets = set(self.stale_parts[db_name])
+        targets.update(keys[uuids.isin(changed).to_numpy()])
+        targets.update(origin[u] for u in changed if u in origin)
+        # 分區改變的列：新分區檔要寫入，原本所在的檔案也要重寫，否則舊副本會在下次載入時復活
+        moved = (uuids.map(origin) != keys).to_numpy()
+        targets.update(keys[moved])
+        targets.update(origin[u] for u in uuids[moved] if u in origin)
+        scope = self.partition_scope[db_name]
+        loaded = set(uuids) | self.deleted[db_name]
+        for key in sorted(targets):
+            path = self.partition_path(db_name, key)
+            rows = df[(keys == key).to_numpy()]
+            if scope is not None and os.path.exists(path):
+                self.lock_path(path)
+                disk = self._read_excel(db_name, path)
+                if not disk.columns.empty:
+                    outside = ~disk["UUID"].astype(str).isin(loaded) & ~self.partition_keys(db_name, disk).isin(scope)
+                    if outside.any():
+                        rows = pd.concat([rows, disk[outside.to_numpy()]], ignore_index=True)
+            self.write_file(path, excel_with_schema(serialize_link_cells(rows), self.schema_seqs[db_name]))
+
+        def after_write():
+            self.part_origin[db_name] = dict(zip(uuids, keys))
+            self.stale_parts[db_name] = set()
+        self.journal.after_commit.append(after_write)
+
+    def set_partition_scope(self, db_name, keys):
+        # 切換載入的分區（None 為全部）並重新讀取；未儲存的修改會被捨棄
+        self.partition_scope[db_name] = None if keys is None else set(keys) | {""}
+        self.load_database(db_name)
+
+    def outside_rows(self, db_name):
+        # 部分載入時範圍外分區的列（全部載入時為 None）；各分區檔依 stamp 快取，只重讀變動過的檔案
+        scope = self.partition_scope.get(db_name)
+        if scope is None:
+            return None
+        seq = self.schema_seqs.get(db_name)
+        stamps = []
+        for path in self.partition_files(db_name, None).values():
+            stamp = (_file_stamp(path), seq)
+            if stamp[0] is None:
+                continue
+            cached = self.part_cache.get(path)
+            if cached is None or cached[0] != stamp:
+                cached = self.part_cache[path] = (stamp, self._read_excel(db_name, path))
+            stamps.append((path, stamp))
+        signature = (tuple(stamps), frozenset(scope))
+        cached = self.outside_cache.get(db_name)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        frames = []
+        for path, _ in stamps:
+            df = self.part_cache[path][1]
+            if not df.columns.empty:
+                frames.append(df[~self.partition_keys(db_name, df).isin(scope).to_numpy()])
+        if frames:
+            # 同一 UUID 以後面的分區檔為準，與 _read_partitions 相同
+            outside = pd.concat(frames, ignore_index=True).drop_duplicates("UUID", keep="last").reset_index(drop=True)
+        else:
+            outside = pd.DataFrame(columns=["UUID", VERSION_COLUMN])
+        self.outside_cache[db_name] = (signature, outside, set(outside["UUID"].astype(str)))
+        return outside
+
+    def unified_frame(self, db_name):
+        # 跨全部分區的唯讀檢視（匯出、附件引用計數、欄式快照、唯一性檢查用）：已載入的列以記憶體為準，其餘分區從磁碟補上
+        df = self.data[db_name]
+        outside = self.outside_rows(db_name)
+        if outside is None:
+            return df
+        loaded = set(df["UUID"].astype(str)) | self.deleted[db_name]
+        others = outside[~outside["UUID"].astype(str).isin(loaded).to_numpy()]
+        if others.empty:
+            return df
+        return pd.concat([df, others], ignore_index=True)
+
+    # 👀 外部修改的增量重新載入
+    def watch_folders(self):
+        folders = {os.path.dirname(path) or "." for path in self.config.values()}
+        folders.update({"data", PERIOD_FOLDER, TABLES_FOLDER})
+        for folder in folders:
+            os.makedirs(folder, exist_ok=True)
+        return sorted(folders)
+
+    def classify_path(self, path):
+        # 將檔案路徑對應到資料來源：(種類, 資料庫或 UUID)
+        path = os.path.normpath(path)
+        folder, name = os.path.split(path)
+        if name.startswith(".") or name.startswith("~$"):
+            return None  # 暫存檔、鎖檔、Excel 的擁有者檔案
+        for db_name, db_path in self.config.items():
+            if path == os.path.normpath(db_path):
+                return ("data", db_name)
+            if db_name in self.partitions:
+                stem, ext = os.path.splitext(os.path.normpath(db_path))
+                if path.startswith(stem + "_part_") and path.endswith(ext):
+                    return ("data", db_name)
+        if folder == os.path.normpath("data"):
+            for prefix, kind in (("templates_", "meta"), ("groups_", "meta"), ("migrations_", "meta"), ("changes_", "changes")):
+                if name.startswith(prefix):
+                    db_name = os.path.splitext(name[len(prefix):])[0]
+                    if db_name in self.config:
+                        return (kind, db_name)
+        if name.endswith(".xlsx"):
+            if folder == os.path.normpath(PERIOD_FOLDER) and "_period_" in name:
+                return ("period", name.split("_period_")[0])
+            if folder == os.path.normpath(TABLES_FOLDER) and "_table_" in name:
+                return ("table", name.split("_table_")[0])
+        return None
+
+    def reload_source(self, path):
+        # 只重新載入變動的來源；自己寫入的檔案（stamp 相同）直接忽略
+        source = self.classify_path(path)
+        if source is None:
+            return None
+        norm = os.path.normpath(path)
+        stamp = _file_stamp(path)
+        if self.stamps.get(norm) == stamp:
+            return None
+        kind, key = source
+        if kind == "data":
+            if key not in self.data:
+                return None
+            self.refresh_database(key)
+        elif kind == "meta":
+            self.load_meta(key)
+        elif kind == "period":
+            self.period_cache.pop(norm, None)
+            self.due_index.mark_stale(norm)
+            self.period_version += 1
+        self.stamps[norm] = stamp
+        return source
+
+    def _invalidate(self, path):
+        self.period_cache.pop(os.path.normpath(path), None)
+        source = self.classify_path(path)
+        if source and source[0] == "period":
+            self.due_index.mark_stale(path)
+            self.period_version += 1
+
+    def due_items(self):
+        # 全部資料庫中已過期或即將到期的週期項目（只處理有變動的週期表）
+        self.due_index.refresh(self.load_period)
+        return self.due_index.due()
+
+    def is_due(self, uuid_str):
+        self.due_index.refresh(self.load_period)
+        return self.due_index.is_due(uuid_str)
+
+    # 📎 附件引用計數：以儲存格內的外部連結 JSON 為準
+    def attachment_refcounts(self):
+        counts = Counter()
+        # 部分載入時範圍外分區的附件也算引用，否則會被當成孤兒回收
+        archived = [self.archive.frame(db_name) for db_name in self.archive.databases()]
+        for df in [self.unified_frame(db_name) for db_name in list(self.data)] + archived:
+            for col in df.columns:
+                if not pd.api.types.is_object_dtype(df[col]):
+                    continue
+                values = df[col].to_numpy()
+                for link in values[link_mask(values, ExternalLink)]:
+                    counts[_link_path(link.path)] += 1
+        return counts
+
+    def collect_attachment_garbage(self):
+        return self.attachments.collect_garbage(self.attachment_refcounts())
+
+    # 📅 週期表（依檔案 stamp 快取）
+    def period_paths(self, uuid_str):
+        if not os.path.isdir(PERIOD_FOLDER):
+            return []
+        return [os.path.join(PERIOD_FOLDER, f) for f in sorted(os.listdir(PERIOD_FOLDER))
+                if f.startswith(f"{uuid_str}_period_") and f.endswith(".xlsx")]
+
+    def load_period(self, path):
+        norm = os.path.normpath(path)
+        stamp = _file_stamp(path)
+        if stamp is None:
+            self.period_cache.pop(norm, None)
+            return None
+        cached = self.period_cache.get(norm)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        df = pd.read_excel(path)
+        self.period_cache[norm] = (stamp, df)
+        return df
+
+    def period_frame(self, db_name):
+        # 某資料庫所有紀錄的週期表合併成一張表（含 uuid），依資料與週期表版本快取
+        def build():
+            df = self.data[db_name]
+            if "UUID" not in df.columns or not os.path.isdir(PERIOD_FOLDER):
+                return pd.DataFrame(columns=["uuid"] + PERIOD_COLUMNS)
+            by_uuid = {}
+            for name in sorted(os.listdir(PERIOD_FOLDER)):
+                if "_period_" in name and name.endswith(".xlsx") and not name.startswith("."):
+                    by_uuid.setdefault(name.split("_period_")[0], []).append(os.path.join(PERIOD_FOLDER, name))
+            frames = []
+            for uuid_str in df["UUID"].astype(str):
+                for path in by_uuid.get(uuid_str, []):
+                    try:
+                        df_period = self.load_period(path)
+                    except Exception as e:
+                        print("讀取週期表格失敗：", path, e)
+                        continue
+                    if df_period is None or df_period.empty:
+                        continue
+                    part = df_period.reindex(columns=PERIOD_COLUMNS)
+                    part.insert(0, "uuid", uuid_str)
+                    frames.append(part)
+            if not frames:
+                return pd.DataFrame(columns=["uuid"] + PERIOD_COLUMNS)
+            return pd.concat(frames, ignore_index=True)
+        key = (db_name, "__period__", "frame")
+        version = (self.versions.get(db_name, 0), self.period_version)
+        cached = self.column_cache.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, build())
+            self.column_cache[key] = cached
+        return cached[1]
+
+    # 🛠 定期工單：週期項目進入提醒期時自動開單，以 (uuid, 項目, 到期日) 判斷是否已開過
+    def load_work_orders(self):
+        if not os.path.exists(WORK_ORDERS_PATH):
+            return pd.DataFrame(columns=WORK_ORDER_COLUMNS)
+        return pd.read_excel(WORK_ORDERS_PATH).reindex(columns=WORK_ORDER_COLUMNS)
+
+    @staticmethod
+    def _work_order_keys(df):
+        return (df["uuid"].fillna("").astype(str) + "\x1f" + df["項目"].fillna("").astype(str) + "\x1f" +
+                df["到期日"].fillna("").astype(str))
+
+    def generate_work_orders(self, today=None):
+        # 各資料庫的週期表合併後一次計算到期日與提醒日；重複執行不會重複開單。回傳新開的工單
+        today = pd.Timestamp(today or datetime.today()).normalize()  # date 或 datetime 皆可
+        frames = []
+        for db_name in self.config:
+            periods = self.period_frame(db_name)
+            if periods.empty:
+                continue
+            schedule = compute_schedule(periods)
+            due = (schedule["下次執行日期"].notna() & (schedule["提醒日期"] <= today)).to_numpy()
+            if not due.any():
+                continue
+            frames.append(pd.DataFrame({
+                "資料庫": db_name,
+                "uuid": periods.loc[due, "uuid"].astype(str).to_numpy(),
+                "項目": periods.loc[due, "標題"].fillna("").astype(str).to_numpy(),
+                "到期日": schedule.loc[due, "下次執行日期"].dt.strftime("%Y-%m-%d").to_numpy(),
+                "提醒日": schedule.loc[due, "提醒日期"].dt.strftime("%Y-%m-%d").to_numpy(),
+            }))
+        if not frames:
+            return pd.DataFrame(columns=WORK_ORDER_COLUMNS)
+        candidates = pd.concat(frames, ignore_index=True)
+        with self.transaction():
+            # 先鎖定再讀取，多個工作站（或排程）同時執行也不會重複開單
+            self.lock_path(WORK_ORDERS_PATH)
+            orders = self.load_work_orders()
+            keys = self._work_order_keys(candidates)
+            new = candidates[~keys.isin(set(self._work_order_keys(orders))) & ~keys.duplicated()].copy()
+            if new.empty:
+                return new.reindex(columns=WORK_ORDER_COLUMNS)
+            numbers = orders["工單號"].dropna().astype(str).str.extract(r"(\d+)$")[0].astype(float)
+            start = int(numbers.max()) + 1 if numbers.notna().any() else 1
+            new = new.sort_values(["到期日", "資料庫"], ignore_index=True)
+            new.insert(0, "工單號", [f"WO{n:06d}" for n in range(start, start + len(new))])
+            new["建立日期"] = today.strftime("%Y-%m-%d")
+            new["狀態"] = "待處理"
+            new["完成日期"] = ""
+            self.write_excel(WORK_ORDERS_PATH, pd.concat([orders, new], ignore_index=True) if not orders.empty else new)
+        return new
+
+    def complete_work_orders(self, numbers, done_date=None):
+        # 標記完成，並把對應週期項目的「此次執行日期」更新為完成日，下一輪到期時會再開新單
+        done = (done_date or datetime.today()).strftime("%Y-%m-%d")
+        with self.transaction():
+            self.lock_path(WORK_ORDERS_PATH)
+            orders = self.load_work_orders()
+            mask = orders["工單號"].astype(str).isin(set(numbers)) & (orders["狀態"] != "完成")
+            if not mask.any():
+                return 0
+            orders["狀態"] = orders["狀態"].astype(object)
+            orders["完成日期"] = orders["完成日期"].astype(object)
+            orders.loc[mask, "狀態"] = "完成"
+            orders.loc[mask, "完成日期"] = done
+            for uuid_str, items in orders[mask].groupby(orders["uuid"].astype(str))["項目"]:
+                items = set(items.fillna("").astype(str))
+                for path in self.period_paths(uuid_str):
+                    df_period = self.load_period(path)
+                    if df_period is None or "標題" not in df_period.columns:
+                        continue
+                    hit = df_period["標題"].fillna("").astype(str).isin(items)
+                    if not hit.any():
+                        continue
+                    df_period = df_period.reindex(columns=list(dict.fromkeys(PERIOD_COLUMNS + list(df_period.columns))))
+                    df_period[["此次執行日期", "下次執行日期"]] = df_period[["此次執行日期", "下次執行日期"]].astype(object)
+                    df_period.loc[hit, "此次執行日期"] = done
+                    # 只重算完成的項目，其他項目手動填的下次執行日期保持不變
+                    next_dates = add_months(df_period.loc[hit, "此次執行日期"], df_period.loc[hit, "下次間隔__月"])
+                    df_period.loc[hit, "下次執行日期"] = next_dates.dt.strftime("%Y-%m-%d").fillna("").to_numpy()
+                    self.write_excel(path, df_period)
+            self.write_excel(WORK_ORDERS_PATH, orders)
+        return int(mask.sum())
+
+    # 📊 分組統計與樞紐報表（結果依資料版本快取，資料沒變動時直接回傳）
+    def load_reports(self):
+        reports = dict(DEFAULT_REPORTS)
+        if os.path.exists(REPORTS_PATH):
+            with open(REPORTS_PATH, "r", encoding="utf-8") as f:
+                reports.update(json.load(f))
+        return reports
+
+    def save_report(self, name, spec):
+        saved = {}
+        if os.path.exists(REPORTS_PATH):
+            with open(REPORTS_PATH, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        if spec is None:
+            saved.pop(name, None)
+        else:
+            saved[name] = spec
+        self.write_json(REPORTS_PATH, saved)
+
+    def report_source(self, source):
+        if source.startswith(PERIOD_SOURCE_PREFIX):
+            db_name = source[len(PERIOD_SOURCE_PREFIX):]
+            return self.period_frame(db_name), (self.versions.get(db_name, 0), self.period_version)
+        return self.data[source], (self.versions.get(source, 0),)
+
+    def run_report(self, spec):
+        df, version = self.report_source(spec["source"])
+        key = (json.dumps(spec, ensure_ascii=False, sort_keys=True), version)
+        if key in self.report_cache:
+            return self.report_cache[key]
+
+        rows = [c for c in spec.get("rows", []) if c]
+        pivot = spec.get("pivot") or None
+        value = spec.get("value") or None
+        agg = spec.get("agg", "count")
+        months = set(spec.get("months", []))
+        missing = [c for c in rows + [pivot, value] if c and c not in df.columns]
+        if missing:
+            raise KeyError(f"找不到欄位：{', '.join(missing)}")
+
+        keys = {}
+        for col in rows + ([pivot] if pivot else []):
+            if col in months:
+                keys[col] = to_dates(df[col]).dt.strftime("%Y-%m").fillna("(空白)")
             else:
-                self.templates[db_name] = list(self.data[db_name].columns)
-
-            if os.path.exists(group_path):
-                with open(group_path, "r", encoding="utf-8") as f:
-                    self.groups[db_name] = json.load(f)
+                keys[col] = df[col].astype(object).where(df[col].notna(), "(空白)").astype(str)
+        work = pd.DataFrame(keys, index=df.index)
+        group_cols = list(keys)
+        if value:
+            work["__值"] = pd.to_numeric(df[value], errors="coerce") if agg != "count" else df[value]
+        if not group_cols:
+            result = pd.DataFrame({REPORT_AGGREGATIONS[agg]: [len(work) if not value and agg == "count" else work["__值"].agg(agg)]})
+        else:
+            grouped = work.groupby(group_cols, sort=True)
+            result = grouped.size() if not value and agg == "count" else grouped["__值"].agg(agg)
+            if pivot:
+                result = result.unstack(pivot, fill_value=0 if agg == "count" else None)
+                result.columns = [str(c) for c in result.columns]
+                result = result.reset_index()
             else:
-                self.groups[db_name] = {}
+                result = result.rename(f"{value or ''}{REPORT_AGGREGATIONS[agg]}").reset_index()
+
+        if len(self.report_cache) > 32:
+            self.report_cache.clear()
+        self.report_cache[key] = result
+        return result
+
+    @contextmanager
+    def transaction(self):
+        # 巢狀呼叫時併入外層交易，由最外層統一提交
+        if self.journal is not None:
+            yield self.journal
+            return
+        self.journal = WriteJournal()
+        try:
+            yield self.journal
+        except Exception:
+            self.journal.rollback()
+            raise
+        else:
+            self.journal.commit()
+        finally:
+            self.journal.release_locks()
+            self.journal = None
+
+    def lock_path(self, path):
+        # 在目前交易中取得檔案鎖（同一交易重複要求不會重複上鎖）
+        if path not in self.journal.locks:
+            self.journal.locks[path] = FileLock(path).acquire()
+
+    def write_file(self, path, write_func):
+        with self.transaction() as journal:
+            self.lock_path(path)
+            journal.stage(path, write_func)
+            def after_write():
+                self.stamps[os.path.normpath(path)] = _file_stamp(path)
+                self._invalidate(path)
+            journal.after_commit.append(after_write)
+
+    def write_excel(self, path, df, **kwargs):
+        kwargs.setdefault("index", False)
+        self.write_file(path, lambda p: df.to_excel(p, **kwargs))
+
+    def write_json(self, path, obj):
+        self.write_file(path, _dump_json(obj))
+
+    def sync_from_disk(self, db_name):
+        # 交易中鎖定資料檔（分區資料庫為範圍內的所有分區檔），若他人已修改則先合併
+        # （有衝突時丟出 ConflictError，記憶體內容不變）
+        paths = self.storage_paths(db_name)
+        for path in paths:
+            self.lock_path(path)
+        stamps = {os.path.normpath(path): _file_stamp(path) for path in paths}
+        if any(stamp != self.stamps.get(norm) for norm, stamp in stamps.items()):
+            disk_df = self._read_disk(db_name)
+            conflicts = self._find_conflicts(db_name, disk_df)
+            if conflicts:
+                raise ConflictError(db_name, conflicts)
+            self._merge_from_disk(db_name, disk_df)
+            self.stamps.update(stamps)
 
     def save_data(self, db_name):
         path = self.config[db_name]
-        self.data[db_name].to_excel(path, index=False)
+        with self.transaction() as journal:
+            # 版本序號以歷史資料夾的鎖排序（分區資料庫各工作站鎖的分區檔不同），並讓完整快照讀到其他分區已提交的內容
+            self.lock_path(self.snapshots.db_folder(db_name))
+            self.sync_from_disk(db_name)
+            self.check_constraints(db_name)
+
+            df = self.data[db_name]
+            if not df.columns.empty:
+                if VERSION_COLUMN not in df.columns:
+                    df[VERSION_COLUMN] = 0
+                # 新版本 = 載入時（或解決衝突後）的磁碟版本 + 1
+                touched = df["UUID"].astype(str).isin(self.dirty[db_name])
+                current = df.loc[touched, "UUID"].astype(str).map(self.base_versions[db_name])
+                current = current.fillna(df.loc[touched, VERSION_COLUMN]).fillna(0)
+                previous = dict(zip(df.loc[touched, "UUID"].astype(str), df.loc[touched, VERSION_COLUMN]))
+                df.loc[touched, VERSION_COLUMN] = current.astype("int64") + 1
+
+                def undo_versions():
+                    # 沒有寫入時版本號不能先加上去，否則呼叫端手上的 _rev 會被誤判為過期
+                    frame = self.data[db_name]
+                    if VERSION_COLUMN in frame.columns:
+                        uuids = frame["UUID"].astype(str)
+                        frame[VERSION_COLUMN] = uuids.map(previous).fillna(frame[VERSION_COLUMN]).fillna(0).astype("int64").to_numpy()
+                journal.after_rollback.append(undo_versions)
+                self.touch(db_name)
+                self.snapshots.record(db_name, self.unified_frame(db_name), self.dirty[db_name], self.deleted[db_name], journal.stage)
+            if db_name in self.partitions and not df.columns.empty:
+                self._write_partitions(db_name, df)
+            else:
+                # 記下已套用的 migration，下次載入只重播之後的（欄位名稱重複使用時不會把資料清掉）
+                self.write_file(path, excel_with_schema(serialize_link_cells(df), self.schema_seqs.get(db_name, 0)))
+
+            def after_save():
+                self.base_versions[db_name] = self._versions_of(self.data[db_name])
+                self.dirty[db_name] = set()
+                self.deleted[db_name] = set()
+                if self.columnar is not None:
+                    try:
+                        self.columnar_versions[db_name] = self.columnar.publish(db_name, self.unified_frame(db_name))
+                    except Exception as e:
+                        print("輸出欄式快照失敗：", db_name, e)
+            journal.after_commit.append(after_save)
+
+    def restore_snapshot(self, db_name, seq, uuids=None):
+        # 以歷史版本覆蓋目前資料（指定 uuids 時只還原這些列），之後照常 save_data，還原本身也會成為新的一版
+        # 部分載入時只還原已載入分區的列，範圍外分區維持原狀
+        snapshot = self.snapshots.frame_at(db_name, seq)
+        df = self.data[db_name]
+        outside = self.outside_rows(db_name)
+        if outside is not None:
+            elsewhere = set(outside["UUID"].astype(str)) - set(df["UUID"].astype(str))
+            snapshot = snapshot[self.in_scope(db_name, snapshot).to_numpy() & ~snapshot["UUID"].astype(str).isin(elsewhere).to_numpy()]
+        snap = snapshot.set_index(snapshot["UUID"].astype(str))
+        current = df.set_index(df["UUID"].astype(str))
+        current = current[~current.index.duplicated(keep="last")]
+        if uuids is None:
+            target = list(snap.index)
+            removed = [u for u in current.index if u not in snap.index]
+            order = target
+        else:
+            target = [u for u in uuids if u in snap.index]
+            removed = [u for u in uuids if u not in snap.index and u in current.index]
+            order = [u for u in current.index if u not in removed] + [u for u in target if u not in current.index]
+        columns = list(df.columns) + [c for c in snapshot.columns if c not in df.columns]
+        snap_columns = [c for c in snapshot.columns if c != VERSION_COLUMN]
+        restored = current.reindex(columns=columns).astype(object).reindex(order)
+        restored.loc[target, snap_columns] = snap.loc[target, snap_columns].astype(object).to_numpy()
+        # 版本欄位沿用目前值，save_data 會依載入時的版本遞增
+        restored[VERSION_COLUMN] = current[VERSION_COLUMN].reindex(order).fillna(0).astype("int64").to_numpy()
+        self.data[db_name] = restored.reset_index(drop=True)
+        self.dirty[db_name] = (self.dirty[db_name] | set(target)) - set(removed)
+        self.deleted[db_name] |= {u for u in removed if u in self.base_versions[db_name]}
+        self.reindex(db_name)
+        self.links_stale.add(db_name)
+        return len(target), len(removed)
+
+    # 🗄 封存與還原
+    def table_paths(self, uuid_str):
+        if not os.path.isdir(TABLES_FOLDER):
+            return []
+        return [os.path.join(TABLES_FOLDER, f) for f in sorted(os.listdir(TABLES_FOLDER))
+                if f.startswith(f"{uuid_str}_table_") and f.endswith(".xlsx")]
+
+    def _changes_path(self, db_name):
+        return os.path.join("data", f"changes_{db_name}.xlsx")
+
+    def _remove_files(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print("刪除檔案失敗：", path, e)
+            self.stamps.pop(os.path.normpath(path), None)
+            self._invalidate(path)
+
+    def archive_records(self, db_name, uuids):
+        # 把資料列連同週期表、表格與異動紀錄移到封存區；回傳封存筆數
+        with self.transaction() as journal:
+            self.sync_from_disk(db_name)
+            df = self.data[db_name]
+            rows = df[df["UUID"].astype(str).isin(set(uuids))]
+            if rows.empty:
+                return 0
+            # 儲存失敗時列要留在記憶體中，不能只剩待刪除清單而沒有封存檔
+            self.rollback_point(db_name)
+            records = SnapshotStore._rows(rows)
+            columns = [str(c) for c in rows.columns]
+            entries = dict(self.archive.entries(db_name))
+            changes_path = self._changes_path(db_name)
+            changes = pd.read_excel(changes_path) if os.path.exists(changes_path) else None
+            archived_changes = changes["uuid"].astype(str).isin(records) if changes is not None else None
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            moved = []
+            os.makedirs(os.path.join(self.archive.folder, db_name), exist_ok=True)
+            for uuid_str, values in records.items():
+                members = {}
+                for path in self.period_paths(uuid_str) + self.table_paths(uuid_str):
+                    members[f"{os.path.basename(os.path.dirname(path))}/{os.path.basename(path)}"] = path
+                    moved.append(path)
+                if changes is not None:
+                    own = changes[changes["uuid"].astype(str) == uuid_str]
+                    if not own.empty:
+                        members["changes.json"] = own.astype(object).where(own.notna(), None).to_json(
+                            orient="records", force_ascii=False, date_format="iso").encode("utf-8")
+                journal.stage(self.archive.zip_path(db_name, uuid_str), ArchiveStore.zip_writer(members))
+                entries[uuid_str] = {"row": dict(zip(columns, values)), "archived": now, "files": sorted(members)}
+            self.write_file(self.archive.index_path(db_name), ArchiveStore.index_writer(entries))
+            if changes is not None and archived_changes.any():
+                self.write_excel(changes_path, changes[~archived_changes])
+            self.delete_rows(db_name, records)
+            self.save_data(db_name)
+            journal.after_commit.append(lambda: self._remove_files(moved))
+        return len(records)
+
+    def restore_archived(self, db_name, uuids):
+        with self.transaction() as journal:
+            self.sync_from_disk(db_name)
+            entries = dict(self.archive.entries(db_name))
+            uuids = [u for u in uuids if u in entries]
+            if not uuids:
+                return 0
+            # 儲存失敗時不把仍在封存索引中的列留在記憶體中
+            self.rollback_point(db_name)
+            restored_changes = []
+            for uuid_str in uuids:
+                for name, content in self.archive.read_members(db_name, uuid_str).items():
+                    if name == "changes.json":
+                        restored_changes.extend(json.loads(content.decode("utf-8")))
+                        continue
+                    folder, filename = name.split("/", 1)
+                    target = os.path.join(PERIOD_FOLDER if folder == PERIOD_FOLDER else TABLES_FOLDER, filename)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    self.write_file(target, ArchiveStore.bytes_writer(content))
+            if restored_changes:
+                changes_path = self._changes_path(db_name)
+                changes = pd.read_excel(changes_path) if os.path.exists(changes_path) else None
+                self.write_excel(changes_path, pd.concat([changes, pd.DataFrame(restored_changes)], ignore_index=True))
+            rows = parse_link_cells(pd.DataFrame([entries.pop(u)["row"] for u in uuids]))
+            df = self.data[db_name]
+            self.data[db_name] = pd.concat([df, rows.reindex(columns=list(dict.fromkeys([*df.columns, *rows.columns])))],
+                                           ignore_index=True)
+            self.dirty[db_name].update(uuids)
+            self.reindex(db_name)
+            self.links_stale.add(db_name)
+            self.write_file(self.archive.index_path(db_name), ArchiveStore.index_writer(entries))
+            self.save_data(db_name)
+            zips = [self.archive.zip_path(db_name, u) for u in uuids]
+            journal.after_commit.append(lambda: self._remove_files(zips))
+        return len(uuids)
+
+    def archived_row(self, uuid_str):
+        # 透明查找：熱資料找不到時回傳 (資料庫, 列)
+        db_name = self.archive.find(uuid_str)
+        if db_name is None:
+            return None, None
+        df = self.archive.frame(db_name)
+        return db_name, df[df["UUID"].astype(str) == uuid_str].iloc[0]
+
+    # 🧱 結構變更：新增/重新命名/刪除/變更型別/移動分組，依序記錄在 data/migrations_{db}.json
+    # 每個操作重複套用不會有副作用，其他安裝的舊資料（或舊模板）載入時重播一次即可升級
+    def migrations_path(self, db_name):
+        return f"data/migrations_{db_name}.json"
+
+    def schema_path(self, db_name):
+        # 模板與分組已套用到的 migration 序號（資料檔的序號記在活頁簿屬性）
+        return f"data/schema_{db_name}.json"
+
+    def load_migrations(self, db_name):
+        path = self.migrations_path(db_name)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _migrations_after(self, db_name, applied):
+        return [(seq, m) for seq, m in ((m.get("seq", i + 1), m) for i, m in enumerate(self.load_migrations(db_name)))
+                if seq > applied]
+
+    def _latest_seq(self, db_name):
+        return max((m.get("seq", i + 1) for i, m in enumerate(self.load_migrations(db_name))), default=0)
+
+    def _read_excel(self, db_name, path):
+        return self._upgrade(db_name, self._prepare_frame(pd.read_excel(path)), xlsx_schema_seq(path))
+
+    @staticmethod
+    def _migrate_frame(df, migration):
+        # 只動欄位標頭，O(欄位數)；retype 才需要轉換該欄的值
+        op, name = migration["op"], migration.get("name")
+        if df.columns.empty:
+            return
+        if op == "add" and name not in df.columns:
+            df[name] = migration.get("default")
+        elif op == "rename" and migration["old"] in df.columns and migration["new"] not in df.columns:
+            df.rename(columns={migration["old"]: migration["new"]}, inplace=True)
+        elif op == "drop" and name in df.columns:
+            df.drop(columns=[name], inplace=True)
+        elif op == "retype" and name in df.columns:
+            df[name] = retype_column(df[name], migration["kind"])
+
+    def _migrate_meta(self, db_name, migration):
+        op, name = migration["op"], migration.get("name")
+        template = self.templates.setdefault(db_name, [])
+        groups = self.groups.setdefault(db_name, {})
+        fields = self.template_fields(db_name)
+        if op == "add":
+            if name not in fields:
+                template.append(name)
+            if migration.get("group") and not any(name in members for members in groups.values()):
+                groups.setdefault(migration["group"], []).append(name)
+        elif op == "rename":
+            old, new = migration["old"], migration["new"]
+            if old in fields and new not in fields:
+                i = fields.index(old)
+                template[i] = dict(template[i], name=new) if isinstance(template[i], dict) else new
+            for members in groups.values():
+                if old in members and new not in members:
+                    members[members.index(old)] = new
+        elif op == "drop":
+            template[:] = [entry for entry, field in zip(template, fields) if field != name]
+            for members in groups.values():
+                members[:] = [m for m in members if m != name]
+        elif op == "retype" and name in fields:
+            i = fields.index(name)
+            template[i] = dict(template[i] if isinstance(template[i], dict) else {"name": name}, kind=migration["kind"])
+        elif op == "move":
+            for members in groups.values():
+                if name in members:
+                    members.remove(name)
+            members = groups.setdefault(migration["group"], [])
+            position = migration.get("position")
+            members.insert(len(members) if position is None else position, name)
+
+    def _upgrade(self, db_name, df, applied=0):
+        # 只重播 applied 之後的 migration
+        for _, migration in self._migrations_after(db_name, applied):
+            self._migrate_frame(df, migration)
+        return df
+
+    def migrate(self, db_name, op, save=True, **args):
+        # save=False 時由呼叫端在同一交易中自行 save_data（避免重複寫入資料檔）
+        if op not in MIGRATION_OPS:
+            raise ValueError(f"不支援的結構變更：{op}")
+        df = self.data[db_name]
+        fields = set(df.columns) | set(self.template_fields(db_name))
+        name = args.get("old", args.get("name"))
+        if {name, args.get("new")} & {"UUID", VERSION_COLUMN}:
+            raise ValueError("UUID 與版本欄位不可變更")
+        if op in ("rename", "drop", "retype", "move") and name not in fields:
+            raise ValueError(f"沒有欄位「{name}」")
+        if (op == "add" and name in fields) or (op == "rename" and args["new"] in fields):
+            raise ValueError(f"欄位「{args.get('new', name)}」已存在")
+        if op == "retype" and args["kind"] not in FIELD_KINDS:
+            raise ValueError(f"不支援的型別：{args['kind']}")
+        migration = {"op": op, **args, "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        with self.transaction() as journal:
+            self.sync_from_disk(db_name)
+            log = self.load_migrations(db_name)
+            migration["seq"] = self._latest_seq(db_name) + 1
+            journal.after_rollback.append(self._migration_undo(db_name, migration))
+            self._migrate_frame(self.data[db_name], migration)
+            self._migrate_meta(db_name, migration)
+            self.schema_seqs[db_name] = self.meta_seqs[db_name] = migration["seq"]
+            self.load_field_types(db_name)
+            self.touch(db_name)
+            for key in [k for k in self.unique_indexes if k[0] == db_name]:
+                del self.unique_indexes[key]
+            self.write_json(self.migrations_path(db_name), log + [migration])
+            self.save_templates(db_name)
+            self.save_groups(db_name)
+            if save and op != "move":
+                # 資料列的版本不變，其他工作站合併時不會視為衝突
+                self.save_data(db_name)
+        return migration
+
+    def _migration_undo(self, db_name, migration):
+        # 交易失敗時把記憶體中的欄位、模板與分組還原；欄位值依 UUID 對回（儲存時可能已合併他人的列）
+        op, name = migration["op"], migration.get("name")
+        df = self.data[db_name]
+        columns = list(df.columns)
+        saved = None
+        if op in ("drop", "retype") and name in df.columns:
+            saved = pd.Series(df[name].to_numpy(), index=df["UUID"].astype(str).to_numpy())
+            saved = saved[~saved.index.duplicated(keep="last")]
+        templates = copy.deepcopy(self.templates.get(db_name, []))
+        groups = copy.deepcopy(self.groups.get(db_name, {}))
+        seqs = (self.schema_seqs.get(db_name, 0), self.meta_seqs.get(db_name, 0))
+
+        def undo():
+            frame = self.data[db_name]
+            if op == "add" and name not in columns:
+                frame.drop(columns=[name], inplace=True, errors="ignore")
+            elif op == "rename" and migration["new"] in frame.columns:
+                frame.rename(columns={migration["new"]: migration["old"]}, inplace=True)
+            elif saved is not None:
+                values = frame["UUID"].astype(str).map(saved).astype(object)
+                if name in frame.columns:
+                    frame[name] = values.to_numpy()
+                else:
+                    frame.insert(min(columns.index(name), len(frame.columns)), name, values.to_numpy())
+            self.templates[db_name] = templates
+            self.groups[db_name] = groups
+            self.schema_seqs[db_name], self.meta_seqs[db_name] = seqs
+            self.load_field_types(db_name)
+            self.touch(db_name)
+            for key in [k for k in self.unique_indexes if k[0] == db_name]:
+                del self.unique_indexes[key]
+        return undo
+
+    def add_column(self, db_name, name, group=None, default=None, save=True):
+        return self.migrate(db_name, "add", save, name=name, group=group, default=default)
+
+    def rename_column(self, db_name, old, new, save=True):
+        return self.migrate(db_name, "rename", save, old=old, new=new)
+
+    def drop_column(self, db_name, name, save=True):
+        return self.migrate(db_name, "drop", save, name=name)
+
+    def retype_column(self, db_name, name, kind, save=True):
+        return self.migrate(db_name, "retype", save, name=name, kind=kind)
+
+    def move_field(self, db_name, name, group, position=None):
+        return self.migrate(db_name, "move", name=name, group=group, position=position)
 
     def save_templates(self, db_name):
-        with open(f"data/templates_{db_name}.json", "w", encoding="utf-8") as f:
-            json.dump(self.templates[db_name], f, ensure_ascii=False, indent=2)
+        self.write_json(f"data/templates_{db_name}.json", self.templates[db_name])
+        self.write_json(self.schema_path(db_name), {"seq": self.meta_seqs.get(db_name, 0)})
 
     def save_groups(self, db_name):
-        with open(f"data/groups_{db_name}.json", "w", encoding="utf-8") as f:
-            json.dump(self.groups[db_name], f, ensure_ascii=False, indent=2)
+        self.write_json(f"data/groups_{db_name}.json", self.groups[db_name])
+        self.write_json(self.schema_path(db_name), {"seq": self.meta_seqs.get(db_name, 0)})
+
+def read_config():
+    if not os.path.exists(CONFIG_PATH):
+        default_config = {
+            "車輛": "data/vehicles.xlsx",
+            "廠商": "data/vendors.xlsx"
+        }
+        os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
+        atomic_write(CONFIG_PATH, _dump_json(default_config))
+        return default_config
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _json_value(val):
+    if isinstance(val, ExternalLink):
+        return {"label": val.label, "path": val.path}
+    if isinstance(val, InternalLink):
+        return {"label": val.label, "uuid": val.uuid}
+    if val is None or (not isinstance(val, (str, bytes, list, dict)) and pd.isna(val)):
+        return None
+    if isinstance(val, np.generic):
+        return val.item()
+    if hasattr(val, "isoformat"):
+        return val.isoformat()
+    return val
+
+
+def _cell_value(val):
+    # API 傳入的 {"label", "path"} / {"label", "uuid"} 轉成連結物件
+    if isinstance(val, dict) and "label" in val:
+        if "path" in val:
+            return ExternalLink(val["label"], val["path"])
+        if "uuid" in val:
+            return InternalLink(val["label"], val["uuid"])
+    return val
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class _PooledHTTPServer(HTTPServer):
+    # 以固定大小的執行緒池處理連線，避免大量請求時無限制開執行緒
+    def __init__(self, address, handler, workers):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+class ApiServer:
+    # 🌐 本機 HTTP/JSON API。DataManager 不是執行緒安全的：與 GUI 同時執行時由 dispatch 交給 Tk 主執行緒，
+    # 無介面執行時以鎖序列化。GET 回應帶 ETag（資料版本），If-None-Match 相同時直接回 304
+    def __init__(self, data_manager, dispatch=None, host=API_HOST, port=API_PORT, workers=API_WORKERS):
+        self.dm = data_manager
+        self.lock = threading.RLock()
+        self.nonce = uuid.uuid4().hex  # 版本計數每次啟動從 0 開始，ETag 加上本次啟動的識別碼
+        self.dispatch = dispatch or self._locked
+        self.address = (host, port)
+        self.workers = workers
+        self.httpd = None
+        self.routes = [
+            ("GET", r"/api/databases", self.list_databases),
+            ("GET", r"/api/due", self.due),
+            ("GET", r"/api/(?P<db>[^/]+)/records", self.list_records),
+            ("POST", r"/api/(?P<db>[^/]+)/records", self.create_record),
+            ("GET", r"/api/(?P<db>[^/]+)/records/(?P<uuid>[^/]+)", self.get_record),
+            ("PUT", r"/api/(?P<db>[^/]+)/records/(?P<uuid>[^/]+)", self.update_record),
+            ("PATCH", r"/api/(?P<db>[^/]+)/records/(?P<uuid>[^/]+)", self.update_record),
+            ("DELETE", r"/api/(?P<db>[^/]+)/records/(?P<uuid>[^/]+)", self.delete_record),
+            ("GET", r"/api/(?P<db>[^/]+)/export", self.export),
+        ]
+
+    def _locked(self, func):
+        with self.lock:
+            return func()
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self, method):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, headers, payload = api.handle(method, unquote(url.path), parse_qs(url.query), body, self.headers)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                if method != "HEAD":
+                    self.wfile.write(payload)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def do_PUT(self):
+                self._serve("PUT")
+
+            def do_PATCH(self):
+                self._serve("PATCH")
+
+            def do_DELETE(self):
+                self._serve("DELETE")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = _PooledHTTPServer(self.address, Handler, self.workers)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"API 服務啟動：http://{self.address[0]}:{self.httpd.server_port}/api/databases")
+        return self
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def handle(self, method, path, params, body, headers):
+        # 回傳 (狀態碼, 標頭, 內容位元組)
+        for route_method, pattern, func in self.routes:
+            match = re.fullmatch(pattern, path.rstrip("/"))
+            if match is None or route_method != method:
+                continue
+            args = match.groupdict()
+            try:
+                if "db" in args and args["db"] not in self.dm.config:
+                    raise ApiError(404, f"沒有資料庫：{args['db']}")
+                if method == "GET":
+                    etag = '"' + hashlib.sha1(repr((self._version(args.get("db")), path, sorted(params.items()))).encode()).hexdigest() + '"'
+                    if headers.get("If-None-Match") == etag:
+                        return 304, {"ETag": etag}, b""
+                payload = json.loads(body.decode("utf-8")) if body else {}
+                result = self.dispatch(lambda: func(params=params, payload=payload, **args))
+                status, content_type, data = result if isinstance(result, tuple) else (200, "application/json; charset=utf-8", result)
+                if not isinstance(data, bytes):
+                    data = json.dumps(data, ensure_ascii=False, default=_json_value).encode("utf-8")
+                response_headers = {"Content-Type": content_type}
+                if method == "GET":
+                    response_headers["ETag"] = etag
+                return status, response_headers, data
+            except ApiError as e:
+                return self._error(e.status, str(e))
+            except ConflictError as e:
+                return self._error(409, f"{e}：{', '.join(e.uuids[:10])}")
+            except ValidationError as e:
+                return self._error(422, f"{e}：{'；'.join(e.lines())}")
+            except TimeoutError as e:
+                return self._error(423, str(e))
+            except (ValueError, KeyError) as e:
+                return self._error(400, str(e))
+            except Exception as e:
+                # 其他錯誤（例如寫檔失敗）也要回應，不讓連線沒有回應就關閉
+                print("API 處理失敗：", method, path, e)
+                return self._error(500, str(e))
+        return self._error(404 if all(re.fullmatch(p, path.rstrip("/")) is None for _, p, _ in self.routes) else 405,
+                           f"不支援：{method} {path}")
+
+    @staticmethod
+    def _error(status, message):
+        return status, {"Content-Type": "application/json; charset=utf-8"}, json.dumps(
+            {"error": message}, ensure_ascii=False).encode("utf-8")
+
+    def _version(self, db_name):
+        # 資料檔的 stamp 讓其他工作站寫入、但尚未輪詢合併時也不會誤回 304
+        if db_name is not None:
+            stamps = [_file_stamp(path) for path in self.dm.storage_paths(db_name)]
+            return self.nonce, self.dm.versions.get(db_name, 0), stamps
+        return (self.nonce, tuple(sorted(self.dm.versions.items())), self.dm.period_version,
+                datetime.today().strftime("%Y-%m-%d"))
+
+    @staticmethod
+    def _param(params, name, default=None):
+        values = params.get(name)
+        return values[0] if values else default
+
+    @staticmethod
+    def _record(df, index):
+        return {str(col): _json_value(val) for col, val in df.loc[index].items()}
+
+    def _index(self, db, uuid):
+        index = self.dm.index_of(db, uuid)
+        if index is None:
+            raise ApiError(404, f"找不到 UUID 為 {uuid} 的資料")
+        return index
+
+    def _rows(self, db, params):
+        # 結構化查詢（query 參數為 Query.to_dict 的 JSON）加上 q 全文搜尋
+        query_text = self._param(params, "query")
+        query = Query.from_dict(json.loads(query_text)) if query_text else None
+        rows = query.compile(self.dm, db)() if query is not None and not query.is_empty() else self.dm.data[db].index
+        keyword = self._param(params, "q")
+        if keyword:
+            df = self.dm.data[db]
+            hit = np.zeros(len(df), dtype=bool)
+            for col in df.columns:
+                if col != VERSION_COLUMN:
+                    hit |= self.dm.typed_column(db, col, "text").str.contains(keyword, regex=False).to_numpy()
+            rows = rows[hit[df.index.get_indexer(rows)]]
+        return rows
+
+    def list_databases(self, params, payload):
+        return {"databases": [{"name": db, "count": len(self.dm.preview(db)), "version": self.dm.versions.get(db, 0)}
+                              for db in self.dm.config if db in self.dm.data]}
+
+    def list_records(self, db, params, payload):
+        rows = self._rows(db, params)
+        per_page = min(max(int(self._param(params, "per_page", API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+        pages = max(1, -(-len(rows) // per_page))
+        page = min(max(int(self._param(params, "page", 1)), 1), pages)
+        df = self.dm.data[db]
+        fields = [f for f in (self._param(params, "fields", "") or "").split(",") if f in df.columns]
+        view = df.loc[rows[(page - 1) * per_page:page * per_page], (["UUID"] + [f for f in fields if f != "UUID"]) if fields else df.columns]
+        items = [{str(col): _json_value(val) for col, val in zip(view.columns, values)} for values in view.itertuples(index=False)]
+        return {"items": items, "page": page, "per_page": per_page, "pages": pages, "total": len(rows)}
+
+    def get_record(self, db, uuid, params, payload):
+        return self._record(self.dm.data[db], self._index(db, uuid))
+
+    def create_record(self, db, params, payload):
+        values = {k: _cell_value(v) for k, v in payload.items()}
+        with self.dm.transaction() as journal:
+            self.dm.sync_from_disk(db)
+            self.dm.check_values(db, values)
+            index = self.dm.append_row(db)
+            uuid_str = str(self.dm.data[db].at[index, "UUID"])
+
+            def undo():
+                # 儲存失敗時移除新增的列，之後的儲存不會把呼叫端以為失敗的資料寫進檔案
+                index = self.dm.index_of(db, uuid_str)
+                if index is not None:
+                    self.dm.delete_row(db, index)
+            journal.after_rollback.append(undo)
+            self.dm.set_values(db, index, values)
+            self.dm.save_data(db)
+            self.dm.update_links(db, uuid_str)
+        return 201, "application/json; charset=utf-8", self._record(self.dm.data[db], self._index(db, uuid_str))
+
+    def update_record(self, db, uuid, params, payload):
+        with self.dm.transaction() as journal:
+            self.dm.sync_from_disk(db)
+            index = self._index(db, uuid)
+            df = self.dm.data[db]
+            # 帶 _rev 時做樂觀鎖：版本不符代表呼叫端拿到的資料已過期
+            if VERSION_COLUMN in payload and int(payload[VERSION_COLUMN]) != int(df.at[index, VERSION_COLUMN]):
+                raise ApiError(409, f"版本不符：目前為 {int(df.at[index, VERSION_COLUMN])}")
+            values = {k: _cell_value(v) for k, v in payload.items()}
+            self.dm.check_values(db, values, uuid)
+            before = {k: df.at[index, k] for k in values if k in df.columns}
+            added = [k for k in values if k not in df.columns and k not in ("UUID", VERSION_COLUMN)]
+            was_dirty = uuid in self.dm.dirty[db]
+
+            def undo():
+                # 儲存失敗時把這一列的值（與順便新增的欄位）還原
+                frame = self.dm.data[db]
+                index = self.dm.index_of(db, uuid)
+                if index is not None:
+                    for key, val in before.items():
+                        frame.at[index, key] = val
+                frame.drop(columns=added, inplace=True, errors="ignore")
+                if not was_dirty:
+                    self.dm.dirty[db].discard(uuid)
+                self.dm.touch(db)
+                self.dm.links_stale.add(db)
+            journal.after_rollback.append(undo)
+            self.dm.set_values(db, index, values)
+            self.dm.save_data(db)
+            self.dm.update_links(db, uuid)
+        return self._record(self.dm.data[db], self._index(db, uuid))
+
+    def delete_record(self, db, uuid, params, payload):
+        with self.dm.transaction() as journal:
+            self.dm.sync_from_disk(db)
+            index = self._index(db, uuid)
+            row = self.dm.data[db].loc[[index]].copy()
+            was_dirty = uuid in self.dm.dirty[db]
+
+            def undo():
+                # 儲存失敗時把刪掉的列放回原位置，不留在待刪除清單中
+                frame = self.dm.data[db]
+                if self.dm.index_of(db, uuid) is None:
+                    self.dm.data[db] = pd.concat([frame.iloc[:index], row, frame.iloc[index:]], ignore_index=True)
+                self.dm.deleted[db].discard(uuid)
+                if was_dirty:
+                    self.dm.dirty[db].add(uuid)
+                self.dm.reindex(db)
+                self.dm.links_stale.add(db)
+            journal.after_rollback.append(undo)
+            self.dm.delete_row(db, index)
+            self.dm.save_data(db)
+        return {"deleted": uuid}
+
+    def due(self, params, payload):
+        items = []
+        for next_date, remind_date, uuid_str, title, _ in self.dm.due_items():
+            db_name, _ = self.dm.find_uuid(uuid_str)
+            items.append({"database": db_name, "uuid": uuid_str, "title": title,
+                          "next_date": next_date, "remind_date": remind_date})
+        return {"items": items, "total": len(items)}
+
+    def export(self, db, params, payload):
+        df = self.dm.data[db].loc[self._rows(db, params)]
+        fields = [f for f in (self._param(params, "fields", "") or "").split(",") if f in df.columns]
+        df = serialize_link_cells(df[fields] if fields else df.drop(columns=[VERSION_COLUMN], errors="ignore"))
+        fmt = self._param(params, "format", "csv")
+        if fmt == "csv":
+            return 200, "text/csv; charset=utf-8", df.to_csv(index=False).encode("utf-8-sig")
+        if fmt == "xlsx":
+            buffer = io.BytesIO()
+            df.to_excel(buffer, index=False)
+            return 200, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", buffer.getvalue()
+        if fmt == "json":
+            return [{str(col): _json_value(val) for col, val in zip(df.columns, values)} for values in df.itertuples(index=False)]
+        raise ApiError(400, f"不支援的格式：{fmt}")
+
+
+def run_work_orders():
+    # 不開視窗產生定期工單（可交給排程器每天執行）
+    load_heavy_modules()
+    new = DataManager(read_config(), all_partitions=True).generate_work_orders()
+    print(f"新增 {len(new)} 張工單")
+    for row in new.itertuples(index=False):
+        print(row.工單號, row.到期日, row.資料庫, row.項目, row.uuid)
+
+
+def serve_headless(port=API_PORT):
+    # 不開視窗，只提供 API；定期檢查其他工作站對檔案的修改
+    load_heavy_modules()
+    server = ApiServer(DataManager(read_config(), all_partitions=True), port=port).start()
+    try:
+        while True:
+            time.sleep(POLL_INTERVAL_MS / 1000)
+            server.dispatch(server.dm.poll_changes)
+    except KeyboardInterrupt:
+        server.stop()
+
 
 class App:
-    def __init__(self, root):
+    def __init__(self, root, api_port=None):
+        self.api_port = api_port
+        self.api = None
+        self.api_calls = queue.Queue()
         self.edit_mode = tk.BooleanVar(value=False)
         self.data_edit_mode = tk.BooleanVar(value=False)
         self.root = root
         self.root.title("資料管理系統主頁")
-        self.database_config = self.load_config()
-        self.data_manager = DataManager(self.database_config)
-        self.summary_fields = {
-            "車輛": ["車牌"],
-            "廠商": ["名稱"]
-        }
-
+        self.summary_fields = dict(SUMMARY_FIELDS)
+
+        self.detail_refresh = None  # (uuid, 重新繪製函式, 是否編輯中)
+        self.thumbnails = ThumbnailCache()
+        self.data_manager = None
+        self.watcher = None
+        # 啟動時間分段：先畫出首頁，套件與資料在背景載入完成後才啟用功能
+        self.startup_timings = [("建立視窗", time.perf_counter() - STARTUP_BEGIN)]
+        self.startup_result = queue.Queue()
         self.build_home_page()
+        self.root.after_idle(self.start_background_load)
+
+    def start_background_load(self):
+        self.startup_timings.append(("首頁顯示", time.perf_counter() - STARTUP_BEGIN))
+
+        def load():
+            try:
+                begin = time.perf_counter()
+                load_heavy_modules()
+                timings = [("載入套件", time.perf_counter() - begin)]
+                begin = time.perf_counter()
+                config = self.load_config()
+                data_manager = DataManager(config)
+                timings.append(("載入資料", time.perf_counter() - begin))
+                self.startup_result.put((config, data_manager, timings))
+            except Exception as e:
+                self.startup_result.put(e)
+
+        threading.Thread(target=load, daemon=True).start()
+        self.root.after(STARTUP_POLL_MS, self.finish_background_load)
+
+    def finish_background_load(self):
+        try:
+            result = self.startup_result.get_nowait()
+        except queue.Empty:
+            self.root.after(STARTUP_POLL_MS, self.finish_background_load)
+            return
+        if isinstance(result, Exception):
+            messagebox.showerror("載入失敗", str(result))
+            return
+        self.database_config, self.data_manager, timings = result
+        self.startup_timings.extend(timings)
+        self.watcher = FileWatcher(self.data_manager.watch_folders()).start()
+        self.root.after(POLL_INTERVAL_MS, self.process_file_events)
+        if self.api_port is not None:
+            self.api = ApiServer(self.data_manager, dispatch=self.run_in_main_thread, port=self.api_port).start()
+            self.root.after(STARTUP_POLL_MS, self.process_api_calls)
+        self.startup_timings.append(("完成", time.perf_counter() - STARTUP_BEGIN))
+        print("啟動時間：" + "，".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup_timings))
+        if getattr(self, "loading_label", None) is not None and self.loading_label.winfo_exists():
+            self.build_home_page()
+
+    def run_in_main_thread(self, func):
+        # API 執行緒呼叫：交給 Tk 主執行緒執行並等待結果，與畫面操作不會同時修改 DataManager
+        future = Future()
+        self.api_calls.put((func, future))
+        return future.result()
+
+    def process_api_calls(self):
+        changed = False
+        while True:
+            try:
+                func, future = self.api_calls.get_nowait()
+            except queue.Empty:
+                break
+            before = dict(self.data_manager.versions)
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+            changed = changed or before != self.data_manager.versions
+        if changed:
+            self.refresh_grid()
+        self.root.after(STARTUP_POLL_MS, self.process_api_calls)
+
+    def process_file_events(self):
+        # 外部（Excel 或其他工作站）修改檔案時，只重新載入該來源並更新目前畫面
+        sources = set()
+        for path in self.watcher.drain():
+            try:
+                source = self.data_manager.reload_source(path)
+            except Exception as e:
+                print("重新載入失敗：", path, e)
+                continue
+            if source:
+                sources.add(source)
+
+        db_name = getattr(self, "current_database", None)
+        if (any(kind in ("data", "meta") and key == db_name for kind, key in sources)
+                and hasattr(self, "grid_frame") and self.grid_frame.winfo_exists()):
+            self.refresh_grid()
+
+        if self.detail_refresh and self.current_detail_window.winfo_exists():
+            uuid_str, rerender, is_editing = self.detail_refresh
+            affected = any(
+                (kind in ("data", "meta", "changes") and key == db_name) or
+                (kind in ("period", "table") and key == uuid_str)
+                for kind, key in sources)
+            if affected and not is_editing.get():
+                rerender()
+        self.root.after(POLL_INTERVAL_MS, self.process_file_events)
+
+    def show_thumbnail(self, label, future):
+        # 背景產生完成後回到主執行緒解碼並顯示
+        if not label.winfo_exists():
+            return
+        if not future.done():
+            self.root.after(100, lambda: self.show_thumbnail(label, future))
+            return
+        try:
+            thumb_path = future.result()
+            if not thumb_path:
+                label.config(text="")
+                return
+            photo = self.thumbnails.decode(thumb_path)
+        except Exception as e:
+            print("縮圖產生失敗：", e)
+            label.config(text="")
+            return
+        label.config(image=photo, text="", width=photo.width())
+        label.image = photo  # 保留參考，避免被回收
+
+    def run_save(self, db_name, action):
+        # 執行儲存動作並處理多人衝突；回傳 False 代表使用者取消
+        while True:
+            try:
+                action()
+                return True
+            except ConflictError as e:
+                answer = messagebox.askyesnocancel(
+                    "資料衝突",
+                    f"{e}：\n" + "\n".join(e.uuids[:10]) +
+                    "\n\n是：以本機內容覆蓋\n否：捨棄本機修改並重新載入\n取消：暫不儲存")
+                if answer is None:
+                    return False
+                self.data_manager.resolve_conflicts(db_name, keep_local=answer)
+                if not answer:
+                    return True
+            except ValidationError as e:
+                messagebox.showwarning("資料不符合規則", f"{e}：\n" + "\n".join(e.lines()))
+                return False
+            except TimeoutError as e:
+                messagebox.showwarning("檔案使用中", str(e))
+                return False
 
     def build_export_page(self):
         self.clear_window()
@@ -78,8 +4153,173 @@ class App:
         for db_name in self.database_config:
             tk.Button(self.root, text=db_name, width=20,
                       command=lambda db=db_name: self.build_export_field_selector(db)).pack(pady=5)
+        tk.Button(self.root, text="📅 週期排程", width=20, command=self.export_period_schedule).pack(pady=5)
+
+        tk.Label(self.root, text="📊 報表", font=("Arial", 12)).pack(pady=(15, 5))
+        for name, spec in self.data_manager.load_reports().items():
+            tk.Button(self.root, text=name, width=20,
+                      command=lambda n=name, s=spec: self.export_report(n, s)).pack(pady=2)
         tk.Button(self.root, text="🔙 返回主頁", command=self.build_home_page).pack(pady=20)
 
+    def export_report(self, name, spec):
+        try:
+            result = self.data_manager.run_report(spec)
+        except Exception as e:
+            messagebox.showerror("報表失敗", str(e))
+            return
+        save_path = filedialog.asksaveasfilename(defaultextension=".xlsx",
+        filetypes=[("Excel 檔案", "*.xlsx")],
+        initialfile=f"{name}.xlsx")
+        if save_path:
+            result.to_excel(save_path, index=False)
+            messagebox.showinfo("匯出成功", f"已匯出至：\n{save_path}")
+
+    def build_report_page(self):
+        self.clear_window()
+        tk.Label(self.root, text="📊 統計報表", font=("Arial", 14)).pack(pady=10)
+        reports = self.data_manager.load_reports()
+        sources = list(self.data_manager.data) + [PERIOD_SOURCE_PREFIX + db for db in self.data_manager.data]
+        agg_names = list(REPORT_AGGREGATIONS.values())
+        agg_codes = {v: k for k, v in REPORT_AGGREGATIONS.items()}
+
+        form = tk.Frame(self.root)
+        form.pack(pady=5)
+        report_var = tk.StringVar()
+        source_var = tk.StringVar(value=sources[0] if sources else "")
+        row_var = tk.StringVar()
+        month_var = tk.BooleanVar(value=False)
+        pivot_var = tk.StringVar()
+        value_var = tk.StringVar()
+        agg_var = tk.StringVar(value=REPORT_AGGREGATIONS["count"])
+        name_var = tk.StringVar()
+
+        tk.Label(form, text="報表：").grid(row=0, column=0, sticky="e")
+        ttk.Combobox(form, textvariable=report_var, values=list(reports), width=20, state="readonly").grid(row=0, column=1, sticky="w")
+        tk.Label(form, text="資料來源：").grid(row=1, column=0, sticky="e")
+        ttk.Combobox(form, textvariable=source_var, values=sources, width=20, state="readonly").grid(row=1, column=1, sticky="w")
+        tk.Label(form, text="分組欄位：").grid(row=2, column=0, sticky="e")
+        row_combo = ttk.Combobox(form, textvariable=row_var, width=20, state="readonly")
+        row_combo.grid(row=2, column=1, sticky="w")
+        tk.Checkbutton(form, text="日期依月份分組", variable=month_var).grid(row=2, column=2, sticky="w")
+        tk.Label(form, text="樞紐欄位：").grid(row=3, column=0, sticky="e")
+        pivot_combo = ttk.Combobox(form, textvariable=pivot_var, width=20, state="readonly")
+        pivot_combo.grid(row=3, column=1, sticky="w")
+        tk.Label(form, text="數值欄位：").grid(row=4, column=0, sticky="e")
+        value_combo = ttk.Combobox(form, textvariable=value_var, width=20, state="readonly")
+        value_combo.grid(row=4, column=1, sticky="w")
+        tk.Label(form, text="統計方式：").grid(row=5, column=0, sticky="e")
+        ttk.Combobox(form, textvariable=agg_var, values=agg_names, width=20, state="readonly").grid(row=5, column=1, sticky="w")
+
+        def update_columns(*args):
+            try:
+                df, _ = self.data_manager.report_source(source_var.get())
+            except KeyError:
+                return
+            columns = [""] + [c for c in df.columns if c not in (VERSION_COLUMN, "UUID", "uuid")]
+            for combo in (row_combo, pivot_combo, value_combo):
+                combo.config(values=columns)
+        source_var.trace_add("write", update_columns)
+        update_columns()
+
+        def current_spec():
+            spec = {"source": source_var.get(), "rows": [row_var.get()] if row_var.get() else [],
+                    "agg": agg_codes.get(agg_var.get(), "count")}
+            if pivot_var.get():
+                spec["pivot"] = pivot_var.get()
+            if value_var.get():
+                spec["value"] = value_var.get()
+            if month_var.get() and row_var.get():
+                spec["months"] = [row_var.get()]
+            return spec
+
+        def load_report(*args):
+            spec = reports.get(report_var.get())
+            if not spec:
+                return
+            source_var.set(spec["source"])
+            row_var.set((spec.get("rows") or [""])[0])
+            month_var.set(bool(spec.get("months")))
+            pivot_var.set(spec.get("pivot", ""))
+            value_var.set(spec.get("value", ""))
+            agg_var.set(REPORT_AGGREGATIONS.get(spec.get("agg", "count")))
+            name_var.set(report_var.get())
+            run()
+        report_var.trace_add("write", load_report)
+
+        result_frame = tk.Frame(self.root)
+        result_frame.pack(fill="both", expand=True, padx=10, pady=5)
+        tree = ttk.Treeview(result_frame, show="headings")
+        xscroll = tk.Scrollbar(result_frame, orient="horizontal", command=tree.xview)
+        yscroll = tk.Scrollbar(result_frame, orient="vertical", command=tree.yview)
+        tree.configure(xscrollcommand=xscroll.set, yscrollcommand=yscroll.set)
+        xscroll.pack(side="bottom", fill="x")
+        yscroll.pack(side="right", fill="y")
+        tree.pack(side="left", fill="both", expand=True)
+
+        def run():
+            try:
+                result = self.data_manager.run_report(current_spec())
+            except Exception as e:
+                messagebox.showerror("報表失敗", str(e))
+                return
+            tree.delete(*tree.get_children())
+            columns = [str(c) for c in result.columns]
+            tree.config(columns=columns)
+            for col in columns:
+                tree.heading(col, text=col)
+                tree.column(col, width=100, anchor="center")
+            for values in result.itertuples(index=False):
+                tree.insert("", "end", values=["" if pd.isna(v) else (round(v, 2) if isinstance(v, float) else v) for v in values])
+
+        def save():
+            name = name_var.get().strip()
+            if not name:
+                messagebox.showwarning("缺少名稱", "請輸入報表名稱")
+                return
+            self.data_manager.save_report(name, current_spec())
+            reports[name] = current_spec()
+            messagebox.showinfo("已儲存", f"已儲存報表「{name}」，可在匯出頁面直接匯出")
+
+        action = tk.Frame(self.root)
+        action.pack(pady=5)
+        tk.Button(action, text="▶ 產生報表", command=run).pack(side="left", padx=5)
+        tk.Label(action, text="名稱：").pack(side="left")
+        tk.Entry(action, textvariable=name_var, width=16).pack(side="left")
+        tk.Button(action, text="💾 儲存報表", command=save).pack(side="left", padx=5)
+        tk.Button(action, text="📤 匯出", command=lambda: self.export_report(name_var.get().strip() or "報表", current_spec())).pack(side="left", padx=5)
+        tk.Button(action, text="🔙 返回主頁", command=self.build_home_page).pack(side="left", padx=5)
+
+    def export_period_schedule(self):
+        # 匯出所有週期表（含計算後的下次執行／提醒日期）與未來排程推算
+        frames = []
+        for db_name, df in self.data_manager.data.items():
+            part = self.data_manager.period_frame(db_name)
+            if part.empty:
+                continue
+            label_fields = [c for c in self.summary_fields.get(db_name, []) if c in df.columns]
+            summaries = df[label_fields].astype(str).agg(" ".join, axis=1) if label_fields else pd.Series("", index=df.index)
+            part = part.copy()
+            part.insert(0, "資料庫", db_name)
+            part.insert(1, "摘要", part["uuid"].map(dict(zip(df["UUID"].astype(str), summaries))))
+            frames.append(part)
+        if not frames:
+            messagebox.showinfo("沒有資料", "目前沒有任何週期表格")
+            return
+        periods = pd.concat(frames, ignore_index=True)
+        schedule = compute_schedule(periods)
+        periods["下次執行日期"] = schedule["下次執行日期"].dt.strftime("%Y-%m-%d")
+        periods["提醒日期"] = schedule["提醒日期"].dt.strftime("%Y-%m-%d")
+        projection = project_occurrences(periods.drop(columns=["提醒日期"]))
+
+        save_path = filedialog.asksaveasfilename(defaultextension=".xlsx",
+        filetypes=[("Excel 檔案", "*.xlsx")],
+        initialfile="週期排程_匯出.xlsx")
+        if save_path:
+            with pd.ExcelWriter(save_path, engine="openpyxl") as writer:
+                periods.sort_values("下次執行日期", kind="stable").to_excel(writer, index=False, sheet_name="週期表")
+                projection.to_excel(writer, index=False, sheet_name=f"未來{PROJECTION_COUNT}次")
+            messagebox.showinfo("匯出成功", f"已匯出至：\n{save_path}")
+
     def build_export_field_selector(self, db_name):
         self.clear_window()
         tk.Label(self.root, text=f"選擇要匯出的欄位：{db_name}", font=("Arial", 14)).pack(pady=10)
@@ -88,10 +4328,13 @@ class App:
         top_frame = tk.Frame(self.root)
         top_frame.pack(pady=10)
 
+        include_archived = tk.BooleanVar(value=False)
         tk.Button(top_frame, text="📤 匯出資料", command=lambda: self.export_selected_fields(
             db_name,
-            [f for f, v in field_vars.items() if v.get() == 1]
+            [f for f, v in field_vars.items() if v.get() == 1],
+            include_archived.get()
         )).pack(side="left", padx=10)
+        tk.Checkbutton(top_frame, text="包含封存資料", variable=include_archived).pack(side="left", padx=10)
 
         tk.Button(top_frame, text="🔙 返回", command=self.build_export_page).pack(side="left", padx=10)
 
@@ -134,9 +4377,33 @@ class App:
                 field_vars[f] = tk.IntVar()
                 tk.Checkbutton(group_frame, text=f, variable=field_vars[f]).pack(anchor="w")
 
-    def export_selected_fields(self, db_name, selected_fields):
-        df = self.data_manager.data[db_name]
-        export_df = df[selected_fields].copy()
+        # 🔗 關聯欄位可一併匯出目標資料庫的欄位
+        for field, target_db in self.data_manager.ref_fields(db_name).items():
+            if target_db not in self.data_manager.data:
+                continue
+            wrapper = tk.Frame(scrollable_frame)
+            wrapper.pack(pady=5, fill="x")
+            group_frame = tk.LabelFrame(wrapper, text=f"🔗 {field} → {target_db}", width=600)
+            group_frame.pack(pady=5)
+            for target_field in self.data_manager.template_fields(target_db):
+                key = f"{field}{JOIN_SEPARATOR}{target_field}"
+                field_vars[key] = tk.IntVar()
+                tk.Checkbutton(group_frame, text=key, variable=field_vars[key]).pack(anchor="w")
+
+    def export_selected_fields(self, db_name, selected_fields, include_archived=False):
+        df = self.data_manager.unified_frame(db_name)
+        if include_archived:
+            archived = self.data_manager.archive.frame(db_name)
+            if not archived.empty:
+                df = pd.concat([df, archived.drop(columns=["封存日期"])], ignore_index=True)
+        export_df = df[[f for f in selected_fields if f in df.columns]].copy()
+        for key in selected_fields:
+            if JOIN_SEPARATOR in key and key not in df.columns:
+                field, target_field = key.split(JOIN_SEPARATOR, 1)
+                # 封存列不在關聯索引內，對應欄位留空
+                joined = self.data_manager.joined_column(db_name, field, target_field).reset_index(drop=True)
+                export_df[key] = joined.reindex(export_df.index).to_numpy()
+        export_df = serialize_link_cells(export_df[[f for f in selected_fields if f in export_df.columns]])
         save_path = filedialog.asksaveasfilename(defaultextension=".xlsx",
         filetypes=[("Excel 檔案", "*.xlsx")],
         initialfile=f"{db_name}_匯出.xlsx")
@@ -146,7 +4413,10 @@ class App:
 
     def open_database(self, db_name):
         self.current_database = db_name
+        self.data_manager.prefetch(db_name)
         self.current_page = 0
+        self.current_query = None
+        self.selected_uuids = set()
         self.build_data_page()
 
     def toggle_data_edit_mode(self):
@@ -166,31 +4436,194 @@ class App:
 
         if self.data_edit_mode.get():
             tk.Button(control_frame, text="➕ 新增資料", command=self.add_new_entry).pack(side="left", padx=5)
+            tk.Button(control_frame, text="☑ 全選" + ("查詢結果" if getattr(self, "current_query", None) is not None else ""),
+                      command=self.select_view_rows).pack(side="left", padx=5)
+            tk.Button(control_frame, text="✎ 批次編輯", command=self.open_bulk_edit_dialog).pack(side="left", padx=5)
+            if getattr(self, "current_query", None) is not None:
+                tk.Button(control_frame, text="🗄 封存查詢結果", command=self.archive_query_results).pack(side="left", padx=5)
+            tk.Button(control_frame, text="🗄 封存區", command=lambda: self.build_archive_page(self.current_database)).pack(side="left", padx=5)
+            tk.Button(control_frame, text="🧬 重複資料", command=lambda: self.build_dedup_page(self.current_database)).pack(side="left", padx=5)
+
+        if self.current_database in self.data_manager.partitions:
+            self.build_partition_picker(control_frame)
+        tk.Button(control_frame, text="🔍 查詢", command=self.open_query_dialog).pack(side="left", padx=5)
+        tk.Button(control_frame, text="🖨 列印", command=self.open_print_dialog).pack(side="left", padx=5)
+        tk.Button(control_frame, text="📜 版本紀錄", command=lambda: self.build_history_page(self.current_database)).pack(side="left", padx=5)
+        if self.data_manager.constraints(self.current_database):
+            tk.Button(control_frame, text="✔ 驗證資料", command=lambda: self.build_validation_page(self.current_database)).pack(side="left", padx=5)
+        if getattr(self, "current_query", None) is not None:
+            tk.Button(control_frame, text="✖ 清除查詢", command=lambda: self.apply_query(None)).pack(side="left", padx=5)
 
         tk.Button(control_frame, text="🔙 返回資料庫", command=self.open_db_select_page).pack(side="left", padx=5)
 
+        self.pager_frame = tk.Frame(self.root)
+        self.pager_frame.pack()
+
         self.grid_frame = tk.Frame(self.root)
         self.grid_frame.pack(padx=10, pady=10)
 
         self.refresh_grid()
 
-    def load_config(self):
-        if not os.path.exists(CONFIG_PATH):
-            default_config = {
-                "車輛": "data/vehicles.xlsx",
-                "廠商": "data/vendors.xlsx"
+    def build_partition_picker(self, parent):
+        # 分區資料庫：只載入選定的分區，「全部」為跨分區的合併檢視
+        dm = self.data_manager
+        db_name = self.current_database
+        scope = dm.partition_scope[db_name]
+        current = "全部" if scope is None else "、".join(sorted(k for k in scope if k))
+        var = tk.StringVar(value=current)
+
+        def choose(_event=None):
+            if dm.dirty[db_name] or dm.deleted[db_name]:
+                if not messagebox.askyesno("切換分區", "尚有未儲存的修改，切換後將捨棄，確定繼續？"):
+                    var.set(current)
+                    return
+            dm.set_partition_scope(db_name, None if var.get() == "全部" else {var.get()})
+            self.current_page = 0
+            self.current_query = None
+            self.selected_uuids = set()
+            self.build_data_page()
+
+        tk.Label(parent, text="分區：").pack(side="left")
+        combo = ttk.Combobox(parent, textvariable=var, values=["全部"] + [k for k in dm.partition_files(db_name) if k],
+                             width=12, state="readonly")
+        combo.pack(side="left", padx=5)
+        combo.bind("<<ComboboxSelected>>", choose)
+
+    def view_rows(self):
+        # 目前查詢結果的列索引（依資料版本快取），沒有查詢時為原始順序
+        query = getattr(self, "current_query", None)
+        if query is None:
+            return self.data_manager.preview(self.current_database).index
+        key = (self.current_database, self.data_manager.versions.get(self.current_database), id(query))
+        cached = getattr(self, "_view_cache", None)
+        if cached is None or cached[0] != key:
+            cached = (key, query.compile(self.data_manager, self.current_database)())
+            self._view_cache = cached
+        return cached[1]
+
+    def apply_query(self, query):
+        self.current_query = None if query is None or query.is_empty() else query
+        self.current_page = 0
+        self.build_data_page()
+
+    def change_page(self, delta):
+        self.current_page += delta
+        self.refresh_grid()
+
+    def open_query_dialog(self):
+        db_name = self.current_database
+        df = self.data_manager.data[db_name]
+        columns = [c for c in df.columns if c != VERSION_COLUMN]
+        op_names = list(QUERY_OPERATORS.values())
+        op_codes = {v: k for k, v in QUERY_OPERATORS.items()}
+        current = getattr(self, "current_query", None) or Query()
+
+        win = tk.Toplevel(self.root)
+        win.title(f"{db_name} 查詢")
+
+        # 📌 已儲存的檢視
+        views_frame = tk.Frame(win)
+        views_frame.pack(fill="x", padx=10, pady=5)
+        tk.Label(views_frame, text="已儲存檢視：").pack(side="left")
+        views = self.data_manager.load_views(db_name)
+        view_var = tk.StringVar()
+        ttk.Combobox(views_frame, textvariable=view_var, values=sorted(views), width=20, state="readonly").pack(side="left", padx=5)
+
+        filters_frame = tk.LabelFrame(win, text="篩選條件（全部符合）", padx=5, pady=5)
+        filters_frame.pack(fill="x", padx=10, pady=5)
+        sort_frame = tk.LabelFrame(win, text="排序", padx=5, pady=5)
+        sort_frame.pack(fill="x", padx=10, pady=5)
+
+        filter_rows = []
+        sort_rows = []
+
+        def add_filter(spec=None):
+            spec = spec or {}
+            row = tk.Frame(filters_frame)
+            row.pack(fill="x", pady=2)
+            vars_ = {
+                "column": tk.StringVar(value=spec.get("column", "")),
+                "op": tk.StringVar(value=QUERY_OPERATORS.get(spec.get("op", "eq"))),
+                "value": tk.StringVar(value=str(spec.get("value", ""))),
             }
-            os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
-            with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-                json.dump(default_config, f, ensure_ascii=False, indent=2)
-            return default_config
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+            ttk.Combobox(row, textvariable=vars_["column"], values=columns, width=15, state="readonly").pack(side="left")
+            ttk.Combobox(row, textvariable=vars_["op"], values=op_names, width=14, state="readonly").pack(side="left", padx=5)
+            tk.Entry(row, textvariable=vars_["value"], width=20).pack(side="left")
+            entry = (row, vars_)
+            tk.Button(row, text="刪除", command=lambda: (row.destroy(), filter_rows.remove(entry))).pack(side="left", padx=5)
+            filter_rows.append(entry)
+
+        def fill(query):
+            for row, _ in filter_rows:
+                row.destroy()
+            filter_rows.clear()
+            for spec in query.filters:
+                add_filter(spec)
+            for i, (column_var, order_var) in enumerate(sort_rows):
+                spec = query.sort[i] if i < len(query.sort) else {}
+                column_var.set(spec.get("column", ""))
+                order_var.set("遞增" if spec.get("ascending", True) else "遞減")
+
+        for i in range(3):
+            row = tk.Frame(sort_frame)
+            row.pack(fill="x", pady=2)
+            tk.Label(row, text=f"第 {i + 1} 鍵：").pack(side="left")
+            column_var = tk.StringVar()
+            order_var = tk.StringVar(value="遞增")
+            ttk.Combobox(row, textvariable=column_var, values=[""] + columns, width=15, state="readonly").pack(side="left")
+            ttk.Combobox(row, textvariable=order_var, values=["遞增", "遞減"], width=6, state="readonly").pack(side="left", padx=5)
+            sort_rows.append((column_var, order_var))
+
+        def build_query():
+            filters = [{"column": v["column"].get(), "op": op_codes.get(v["op"].get(), "eq"), "value": v["value"].get()}
+                       for _, v in filter_rows if v["column"].get()]
+            sort = [{"column": c.get(), "ascending": o.get() == "遞增"} for c, o in sort_rows if c.get()]
+            return Query(filters, sort)
+
+        def load_view():
+            if view_var.get() in views:
+                fill(Query.from_dict(views[view_var.get()]))
+
+        def delete_view():
+            name = view_var.get()
+            if name and messagebox.askyesno("刪除檢視", f"確定要刪除檢視「{name}」？", parent=win):
+                self.data_manager.save_view(db_name, name, None)
+                win.destroy()
+                self.open_query_dialog()
+
+        def save_view():
+            name = name_var.get().strip()
+            if not name:
+                messagebox.showwarning("缺少名稱", "請輸入檢視名稱", parent=win)
+                return
+            self.data_manager.save_view(db_name, name, build_query())
+            views[name] = build_query().to_dict()
+            messagebox.showinfo("已儲存", f"已儲存檢視「{name}」", parent=win)
+
+        tk.Button(views_frame, text="載入", command=load_view).pack(side="left", padx=2)
+        tk.Button(views_frame, text="刪除", command=delete_view).pack(side="left", padx=2)
+
+        fill(current)
+        tk.Button(win, text="➕ 新增條件", command=add_filter).pack(anchor="w", padx=10)
+
+        save_frame = tk.Frame(win)
+        save_frame.pack(fill="x", padx=10, pady=5)
+        tk.Label(save_frame, text="檢視名稱：").pack(side="left")
+        name_var = tk.StringVar()
+        tk.Entry(save_frame, textvariable=name_var, width=20).pack(side="left", padx=5)
+        tk.Button(save_frame, text="💾 儲存檢視", command=save_view).pack(side="left")
+
+        action_frame = tk.Frame(win)
+        action_frame.pack(pady=10)
+        tk.Button(action_frame, text="套用", command=lambda: (win.destroy(), self.apply_query(build_query()))).pack(side="left", padx=5)
+        tk.Button(action_frame, text="取消", command=win.destroy).pack(side="left", padx=5)
+
+    def load_config(self):
+        return read_config()
 
     def save_config(self):
         os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
-        with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-            json.dump(self.database_config, f, ensure_ascii=False, indent=2)
+        self.data_manager.write_json(CONFIG_PATH, self.database_config)
 
     def clear_window(self):
         for widget in self.root.winfo_children():
@@ -199,45 +4632,563 @@ class App:
     def build_home_page(self):
         self.clear_window()
         self.root.geometry("800x600")
+        state = "normal" if self.data_manager is not None else "disabled"
         tk.Label(self.root, text="請選擇功能", font=("Arial", 16)).pack(pady=20)
-        tk.Button(self.root, text="✏️ 編輯資料", width=20, height=2, command=self.open_db_select_page).pack(pady=10)
-        tk.Button(self.root, text="📤 匯出資料", width=20, height=2, command=self.build_export_page).pack(pady=10)
+        tk.Button(self.root, text="✏️ 編輯資料", width=20, height=2, state=state, command=self.open_db_select_page).pack(pady=10)
+        tk.Button(self.root, text="📤 匯出資料", width=20, height=2, state=state, command=self.build_export_page).pack(pady=10)
+        tk.Button(self.root, text="📅 到期總覽", width=20, height=2, state=state, command=self.build_dashboard_page).pack(pady=10)
+        tk.Button(self.root, text="📊 統計報表", width=20, height=2, state=state, command=self.build_report_page).pack(pady=10)
+        tk.Button(self.root, text="🛠 定期工單", width=20, height=2, state=state, command=self.build_work_order_page).pack(pady=10)
+        if self.data_manager is None:
+            self.loading_label = tk.Label(self.root, text="⏳ 資料載入中…", fg="gray")
+            self.loading_label.pack(pady=10)
+        else:
+            self.loading_label = None
+            tk.Label(self.root, text="啟動：" + "｜".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup_timings),
+                     fg="gray", font=("Arial", 8)).pack(side="bottom", pady=5)
+
+    def build_dashboard_page(self):
+        self.clear_window()
+        tk.Label(self.root, text="📅 到期總覽（已過期／即將到期）", font=("Arial", 14)).pack(pady=10)
+
+        # 每個 UUID 對應的資料庫與篩選欄位，用來合併到期項目
+        lookups = []
+        for db_name, df in self.data_manager.data.items():
+            if "UUID" not in df.columns:
+                continue
+            cols = [c for c in DASHBOARD_FILTERS if c in df.columns]
+            label_fields = [c for c in self.summary_fields.get(db_name, []) if c in df.columns]
+            part = df[["UUID"] + cols].copy()
+            part["資料庫"] = db_name
+            part["摘要"] = df[label_fields].astype(str).agg(" ".join, axis=1) if label_fields else ""
+            lookups.append(part)
+        lookup = pd.concat(lookups, ignore_index=True) if lookups else pd.DataFrame(columns=["UUID", "資料庫", "摘要"])
+        for col in DASHBOARD_FILTERS:
+            if col not in lookup.columns:
+                lookup[col] = None
+
+        due = pd.DataFrame(self.data_manager.due_items(), columns=["下次執行日期", "提醒日期", "UUID", "項目", "路徑"])
+        due = due.merge(lookup.drop_duplicates("UUID"), on="UUID", how="inner")
+        today = datetime.today().strftime("%Y-%m-%d")
+        due["狀態"] = (due["下次執行日期"] < today).map({True: "已過期", False: "即將到期"})
+
+        filter_frame = tk.Frame(self.root)
+        filter_frame.pack(pady=5)
+        filter_vars = {}
+        for col in DASHBOARD_FILTERS:
+            tk.Label(filter_frame, text=f"{col}：").pack(side="left")
+            choices = ["全部"] + sorted(set(str(v) for v in due[col].dropna()))
+            var = tk.StringVar(value="全部")
+            combo = ttk.Combobox(filter_frame, textvariable=var, values=choices, width=12, state="readonly")
+            combo.pack(side="left", padx=5)
+            combo.bind("<<ComboboxSelected>>", lambda e: fill())
+            filter_vars[col] = var
+
+        columns = ["狀態", "下次執行日期", "資料庫", "摘要", "項目"] + DASHBOARD_FILTERS
+        tree_frame = tk.Frame(self.root)
+        tree_frame.pack(fill="both", expand=True, padx=10, pady=5)
+        tree = ttk.Treeview(tree_frame, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=100, anchor="center")
+        yscroll = tk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=yscroll.set)
+        tree.pack(side="left", fill="both", expand=True)
+        yscroll.pack(side="right", fill="y")
+        tree.tag_configure("已過期", background="#ffcccc")
+        tree.tag_configure("即將到期", background="#ffffcc")
+        count_label = tk.Label(self.root, text="")
+        count_label.pack()
+
+        def fill():
+            tree.delete(*tree.get_children())
+            mask = pd.Series(True, index=due.index)
+            for col, var in filter_vars.items():
+                if var.get() != "全部":
+                    mask &= due[col].astype(str) == var.get()
+            view = due[mask]
+            for i, row in enumerate(view[columns].itertuples(index=False)):
+                tree.insert("", "end", iid=str(view.index[i]), values=[("" if pd.isna(v) else v) for v in row], tags=(row[0],))
+            count_label.config(text=f"共 {len(view)} 筆")
+
+        def open_selected(event=None):
+            selected = tree.selection()
+            if not selected:
+                return
+            item = due.loc[int(selected[0])]
+            self.current_database = item["資料庫"]
+            self.current_page = 0
+            index = self.data_manager.index_of(item["資料庫"], item["UUID"])
+            if index is not None:
+                self.open_detail(index)
+
+        tree.bind("<Double-1>", open_selected)
+        fill()
+        tk.Button(self.root, text="🔙 返回主頁", command=self.build_home_page).pack(pady=10)
+
+    def build_work_order_page(self):
+        self.clear_window()
+        tk.Label(self.root, text="🛠 定期工單", font=("Arial", 14)).pack(pady=10)
+        control = tk.Frame(self.root)
+        control.pack(pady=5)
+        show_done = tk.BooleanVar(value=False)
+
+        columns = ["工單號", "到期日", "資料庫", "摘要", "項目", "狀態", "完成日期"]
+        tree = ttk.Treeview(self.root, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=200 if col == "摘要" else 100, anchor="center")
+        tree.tag_configure("overdue", background="#ffcccc")
+        tree.pack(fill="both", expand=True, padx=10, pady=5)
+        status = tk.Label(self.root, text="")
+        status.pack()
+        orders = {}
+
+        def fill():
+            df = self.data_manager.load_work_orders()
+            if not show_done.get():
+                df = df[df["狀態"] != "完成"]
+            orders.clear()
+            tree.delete(*tree.get_children())
+            today = datetime.today().strftime("%Y-%m-%d")
+            for row in df.sort_values("到期日").itertuples(index=False):
+                number = str(row.工單號)
+                orders[number] = row
+                summary = self.record_summary(row.資料庫, str(row.uuid)) if row.資料庫 in self.data_manager.config else str(row.uuid)
+                done_date = "" if pd.isna(row.完成日期) else row.完成日期
+                tree.insert("", "end", iid=number, values=[number, row.到期日, row.資料庫, summary, row.項目, row.狀態, done_date],
+                            tags=("overdue",) if row.狀態 != "完成" and str(row.到期日) < today else ())
+            status.config(text=f"共 {len(df)} 張")
+
+        def generate():
+            try:
+                new = self.data_manager.generate_work_orders()
+            except TimeoutError as e:
+                messagebox.showwarning("檔案使用中", str(e))
+                return
+            messagebox.showinfo("產生工單", f"新增 {len(new)} 張工單")
+            fill()
+
+        def complete():
+            numbers = list(tree.selection())
+            if not numbers or not messagebox.askyesno("完成工單", f"將 {len(numbers)} 張工單標記為今天完成，並更新對應週期表的執行日期？"):
+                return
+            try:
+                self.data_manager.complete_work_orders(numbers)
+            except TimeoutError as e:
+                messagebox.showwarning("檔案使用中", str(e))
+                return
+            fill()
+
+        def open_selected(event):
+            selection = tree.selection()
+            if selection:
+                self.open_record(orders[selection[0]].uuid)
+
+        tk.Button(control, text="⚙ 產生到期工單", command=generate).pack(side="left", padx=5)
+        tk.Button(control, text="✔ 完成", command=complete).pack(side="left", padx=5)
+        tk.Checkbutton(control, text="顯示已完成", variable=show_done, command=fill).pack(side="left", padx=5)
+        tree.bind("<Double-1>", open_selected)
+        fill()
+        tk.Button(self.root, text="🔙 返回主頁", command=self.build_home_page).pack(pady=10)
 
     def delete_entry(self, index):
-        df = self.data_manager.data[self.current_database]
-        df.drop(index, inplace=True)
-        df.reset_index(drop=True, inplace=True)
-        self.data_manager.save_data(self.current_database)
+        self.data_manager.delete_row(self.current_database, index)
+        self.run_save(self.current_database, lambda: self.data_manager.save_data(self.current_database))
         self.refresh_grid()
 
     def move_entry(self, index, direction):
-        df = self.data_manager.data[self.current_database]
-        new_index = index + direction
-        if 0 <= new_index < len(df):
-            df.iloc[[index, new_index]] = df.iloc[[new_index, index]].values
-        self.data_manager.save_data(self.current_database)
+        self.data_manager.move_row(self.current_database, index, direction)
+        self.run_save(self.current_database, lambda: self.data_manager.save_data(self.current_database))
         self.refresh_grid()
 
+    def archive_entries(self, uuids):
+        db_name = self.current_database
+        if not uuids or not messagebox.askyesno("確認封存", f"確定要封存 {len(uuids)} 筆資料嗎？\n週期表、表格與異動紀錄會一併移到封存區，之後可再還原。"):
+            return
+        result = {}
+        if self.run_save(db_name, lambda: result.setdefault("count", self.data_manager.archive_records(db_name, uuids))):
+            messagebox.showinfo("已封存", f"已封存 {result.get('count', 0)} 筆資料")
+        self.build_data_page()
+
+    def archive_query_results(self):
+        df = self.data_manager.data[self.current_database]
+        rows = self.view_rows()
+        self.archive_entries(df.loc[rows, "UUID"].astype(str).tolist())
+
+    def build_archive_page(self, db_name):
+        self.clear_window()
+        tk.Label(self.root, text=f"🗄 {db_name} 封存區", font=("Arial", 14)).pack(pady=10)
+        control = tk.Frame(self.root)
+        control.pack(pady=5)
+        search_var = tk.StringVar()
+        tk.Label(control, text="搜尋：").pack(side="left")
+        search_entry = tk.Entry(control, textvariable=search_var, width=25)
+        search_entry.pack(side="left")
+
+        archived = self.data_manager.archive.frame(db_name)
+        label_fields = [c for c in self.summary_fields.get(db_name, []) if c in archived.columns]
+        columns = label_fields + ["封存日期", "UUID"] if not archived.empty else ["UUID"]
+        tree = ttk.Treeview(self.root, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=260 if col == "UUID" else 140, anchor="center")
+        tree.pack(fill="both", expand=True, padx=10, pady=5)
+        count_label = tk.Label(self.root, text="", fg="gray")
+        count_label.pack()
+
+        # 所有欄位合併成一個字串欄，搜尋時只做一次向量化比對
+        haystack = (archived.astype(object).where(archived.notna(), "").astype(str).agg(" ".join, axis=1)
+                    if not archived.empty else pd.Series(dtype=str))
+
+        def fill(*args):
+            tree.delete(*tree.get_children())
+            keyword = search_var.get().strip()
+            view = archived[haystack.str.contains(keyword, regex=False)] if keyword else archived
+            for values in view[columns].itertuples(index=False) if not view.empty else []:
+                tree.insert("", "end", iid=str(values[-1]), values=["" if pd.isna(v) else v for v in values])
+            count_label.config(text=f"共 {len(view)} 筆")
+
+        def open_selected(event=None):
+            for uuid_str in tree.selection():
+                self.open_archived_record(db_name, uuid_str)
+
+        def restore_selected():
+            uuids = list(tree.selection())
+            if not uuids or not messagebox.askyesno("確認還原", f"確定要還原 {len(uuids)} 筆資料嗎？"):
+                return
+            if self.run_save(db_name, lambda: self.data_manager.restore_archived(db_name, uuids)):
+                messagebox.showinfo("已還原", f"已還原 {len(uuids)} 筆資料")
+            self.build_archive_page(db_name)
+
+        search_var.trace_add("write", fill)
+        tree.bind("<Double-1>", open_selected)
+        tk.Button(control, text="查看", command=open_selected).pack(side="left", padx=5)
+        tk.Button(control, text="還原選取", command=restore_selected).pack(side="left", padx=5)
+        tk.Button(control, text="🔙 返回", command=lambda: self.open_database(db_name)).pack(side="left", padx=5)
+        fill()
+
+    def open_archived_record(self, db_name, uuid_str):
+        # 封存資料以唯讀方式顯示，需要修改時先還原
+        archived = self.data_manager.archive.frame(db_name)
+        rows = archived[archived["UUID"].astype(str) == uuid_str]
+        if rows.empty:
+            return
+        row = rows.iloc[0]
+        top = tk.Toplevel(self.root)
+        top.title(f"🗄 {db_name} 封存資料")
+        top.geometry("600x500")
+        tk.Label(top, text=f"封存於 {row.get('封存日期', '')}，以下為唯讀內容", fg="gray").pack(pady=5)
+        frame = tk.Frame(top)
+        frame.pack(fill="both", expand=True, padx=10)
+        for group_name, fields in self.data_manager.groups.get(db_name, {}).items():
+            group_frame = tk.LabelFrame(frame, text=group_name, padx=5, pady=5)
+            group_frame.pack(fill="x", pady=3)
+            for field in fields:
+                val = row.get(field, "")
+                text = val.label if isinstance(val, LINK_TYPES) else ("" if pd.isna(val) else str(val))
+                tk.Label(group_frame, text=f"{field}：{text}", anchor="w").pack(fill="x")
+        files = self.data_manager.archive.entries(db_name).get(uuid_str, {}).get("files", [])
+        if files:
+            tk.Label(top, text="封存檔案：" + "、".join(files), wraplength=560, justify="left").pack(pady=5)
+
+        def restore():
+            if self.run_save(db_name, lambda: self.data_manager.restore_archived(db_name, [uuid_str])):
+                top.destroy()
+                self.open_record(uuid_str)
+
+        tk.Button(top, text="還原此筆", command=restore).pack(side="left", padx=10, pady=10)
+        tk.Button(top, text="關閉", command=top.destroy).pack(side="left", padx=10, pady=10)
+
     def add_new_entry(self):
         df = self.data_manager.data[self.current_database]
         if df.empty and df.columns.empty:
             messagebox.showwarning("欄位未定義", f"「{self.current_database}」尚未設定任何欄位，請先編輯欄位模板或手動加入資料後再使用新增功能。")
             return
-        new_row = {col: "" for col in df.columns}
-        df.loc[len(df)] = new_row
-        self.data_manager.save_data(self.current_database)
+        required = [f for f, spec in self.data_manager.constraints(self.current_database).items() if spec.get("required")]
+        if required:
+            self.open_new_entry_form(required)
+            return
+        self.data_manager.append_row(self.current_database)
+        self.run_save(self.current_database, lambda: self.data_manager.save_data(self.current_database))
+        self.refresh_grid()
+
+    def toggle_selected(self, uuid_str, selected):
+        if selected:
+            self.selected_uuids.add(uuid_str)
+        else:
+            self.selected_uuids.discard(uuid_str)
+
+    def select_view_rows(self):
+        # 全選目前查詢結果（沒有查詢時為全部資料）；已全選時改為清除
+        df = self.data_manager.preview(self.current_database)
+        uuids = set(df.loc[self.view_rows(), "UUID"].astype(str))
+        self.selected_uuids = set() if uuids <= self.selected_uuids else self.selected_uuids | uuids
         self.refresh_grid()
 
+    def open_bulk_edit_dialog(self):
+        db_name = self.current_database
+        uuids = set(self.selected_uuids)
+        if not uuids:
+            messagebox.showwarning("未選取", "請先勾選要修改的資料，或使用「☑ 全選」")
+            return
+        df = self.data_manager.data[db_name]
+        columns = [c for c in self.data_manager.template_fields(db_name) if c not in ("UUID", VERSION_COLUMN)]
+        columns += [c for c in df.columns if c not in columns and c not in ("UUID", VERSION_COLUMN)]
+
+        top = tk.Toplevel(self.root)
+        top.title(f"批次編輯 {len(uuids)} 筆{db_name}資料")
+        rows_frame = tk.LabelFrame(top, text="要修改的欄位", padx=5, pady=5)
+        rows_frame.pack(fill="x", padx=10, pady=5)
+        edit_rows = []
+
+        def add_row():
+            row = tk.Frame(rows_frame)
+            row.pack(fill="x", pady=2)
+            vars_ = {"column": tk.StringVar(), "clear": tk.BooleanVar(), "value": tk.StringVar()}
+            ttk.Combobox(row, textvariable=vars_["column"], values=columns, width=15, state="readonly").pack(side="left")
+            entry = tk.Entry(row, textvariable=vars_["value"], width=30)
+            entry.pack(side="left", padx=5)
+            tk.Checkbutton(row, text="清除", variable=vars_["clear"],
+                           command=lambda: entry.config(state="disabled" if vars_["clear"].get() else "normal")).pack(side="left")
+            edit_rows.append(vars_)
+
+        add_row()
+        tk.Button(top, text="➕ 新增欄位", command=add_row).pack(anchor="w", padx=10)
+        title_frame = tk.Frame(top)
+        title_frame.pack(fill="x", padx=10, pady=5)
+        tk.Label(title_frame, text="異動標題：").pack(side="left")
+        title_var = tk.StringVar(value="批次修改")
+        tk.Entry(title_frame, textvariable=title_var, width=30).pack(side="left")
+
+        def apply():
+            values = {}
+            for vars_ in edit_rows:
+                column = vars_["column"].get()
+                if column:
+                    values[column] = None if vars_["clear"].get() else vars_["value"].get().strip()
+            if not values:
+                messagebox.showwarning("未指定欄位", "請至少選擇一個欄位", parent=top)
+                return
+            result = {}
+            action = lambda: result.setdefault("count", self.data_manager.bulk_update(
+                db_name, uuids, values, title_var.get().strip() or "批次修改"))
+            if self.run_save(db_name, action):
+                top.destroy()
+                self.selected_uuids = set()
+                messagebox.showinfo("已修改", f"已修改 {result.get('count', 0)} 筆資料")
+                self.refresh_grid()
+
+        tk.Button(top, text="套用", command=apply).pack(pady=10)
+
+    def open_print_dialog(self):
+        # 輸出勾選的資料（沒有勾選時為目前查詢結果）的詳細資料表
+        db_name = self.current_database
+        df = self.data_manager.preview(db_name)
+        uuids = [u for u in df.loc[self.view_rows(), "UUID"].astype(str) if not self.selected_uuids or u in self.selected_uuids]
+        if not uuids:
+            messagebox.showwarning("沒有資料", "目前沒有可輸出的資料")
+            return
+        top = tk.Toplevel(self.root)
+        top.title(f"列印 {len(uuids)} 筆{db_name}詳細資料")
+        source = "勾選的資料" if self.selected_uuids else ("查詢結果" if getattr(self, "current_query", None) is not None else "全部資料")
+        tk.Label(top, text=f"{source}，共 {len(uuids)} 筆").pack(padx=10, pady=5)
+        fmt_var = tk.StringVar(value="pdf" if HAS_FITZ else "html")
+        fmt_frame = tk.Frame(top)
+        fmt_frame.pack(padx=10)
+        tk.Radiobutton(fmt_frame, text="PDF", variable=fmt_var, value="pdf",
+                       state="normal" if HAS_FITZ else "disabled").pack(side="left")
+        tk.Radiobutton(fmt_frame, text="HTML", variable=fmt_var, value="html").pack(side="left")
+        combined_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(top, text="合併成單一檔案（否則每筆一個檔案）", variable=combined_var).pack(padx=10, anchor="w")
+        status_var = tk.StringVar()
+        bar = ttk.Progressbar(top, length=300, maximum=len(uuids))
+        bar.pack(padx=10, pady=5)
+        tk.Label(top, textvariable=status_var).pack(padx=10)
+        updates = queue.Queue()
+
+        def start():
+            fmt, combined = fmt_var.get(), combined_var.get()
+            if combined:
+                target = filedialog.asksaveasfilename(parent=top, defaultextension=f".{fmt}", initialfile=f"{db_name}_詳細資料.{fmt}",
+                                                      filetypes=[(fmt.upper(), f"*.{fmt}")])
+            else:
+                target = filedialog.askdirectory(parent=top)
+            if not target:
+                return
+            start_button.config(state="disabled")
+            status_var.set("讀取資料…")
+            # 欄位值在主執行緒先複製出來，背景執行緒只讀週期表、表格等檔案，不碰 DataFrame
+            sheets = self.data_manager.detail_sheets(db_name, uuids)
+
+            def work():
+                # 讀檔與輸出都在背景執行緒，兩個階段的進度經由同一個佇列回報
+                try:
+                    self.data_manager.fill_detail_sheets(
+                        sheets, progress=lambda done, total: updates.put(("讀取資料", done, total)))
+                    files = render_detail_sheets(sheets, target, fmt, combined,
+                                                 progress=lambda done, total: updates.put(("已完成", done, total)))
+                    updates.put(files)
+                except Exception as e:
+                    updates.put(e)
+
+            threading.Thread(target=work, daemon=True).start()
+            top.after(100, poll)
+
+        def poll():
+            result = None
+            while not updates.empty():
+                result = updates.get()
+                if isinstance(result, tuple):
+                    phase, done, total = result
+                    bar.config(maximum=max(total, 1), value=done)
+                    status_var.set(f"{phase} {done} / {total} 筆")
+                    result = None
+            if isinstance(result, Exception):
+                start_button.config(state="normal")
+                messagebox.showerror("輸出失敗", str(result), parent=top)
+            elif result is not None:
+                status_var.set(f"已輸出 {len(result)} 個檔案")
+                messagebox.showinfo("輸出完成", f"已輸出至：\n{os.path.dirname(result[0]) if len(result) > 1 else result[0]}", parent=top)
+            else:
+                top.after(100, poll)
+
+        start_button = tk.Button(top, text="開始輸出", command=start)
+        start_button.pack(pady=10)
+
+    def open_new_entry_form(self, fields):
+        # 有必填欄位時先填好再新增，未通過檢查的新列不留在記憶體中
+        db_name = self.current_database
+        top = tk.Toplevel(self.root)
+        top.title(f"新增{db_name}資料")
+        vars_ = {}
+        for field in fields:
+            row = tk.Frame(top)
+            row.pack(fill="x", padx=10, pady=3)
+            tk.Label(row, text=f"{field}：", width=12, anchor="e").pack(side="left")
+            vars_[field] = tk.StringVar()
+            tk.Entry(row, textvariable=vars_[field], width=30).pack(side="left")
+
+        def submit():
+            index = self.data_manager.append_row(db_name, {f: v.get().strip() for f, v in vars_.items()})
+            uuid_str = str(self.data_manager.data[db_name].at[index, "UUID"])
+            if not self.run_save(db_name, lambda: self.data_manager.save_data(db_name)):
+                index = self.data_manager.index_of(db_name, uuid_str)
+                if index is not None:
+                    self.data_manager.delete_row(db_name, index)
+                return
+            top.destroy()
+            self.refresh_grid()
+            index = self.data_manager.index_of(db_name, uuid_str)
+            if index is not None:
+                self.open_detail(index)
+
+        tk.Button(top, text="新增", command=submit).pack(pady=10)
+
+    def build_dedup_page(self, db_name):
+        self.clear_window()
+        tk.Label(self.root, text=f"🧬 {db_name} 可能重複的資料", font=("Arial", 14)).pack(pady=10)
+        pairs = self.data_manager.find_duplicates(db_name)
+        fields = DEDUP_FIELDS.get(db_name) or self.summary_fields.get(db_name, [])
+        tk.Label(self.root, text=f"比對欄位：{'、'.join(fields)}（忽略全形/半形、空白、標點與公司類型）", fg="gray").pack()
+        status = tk.Label(self.root, text=f"找到 {len(pairs)} 組")
+        status.pack(pady=5)
+
+        columns = ["相似度", "資料 A", "資料 B"]
+        tree = ttk.Treeview(self.root, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=80 if col == "相似度" else 280)
+        tree.pack(fill="both", expand=True, padx=10, pady=5)
+        for i, row in pairs.iterrows():
+            tree.insert("", "end", iid=str(i), values=[f"{row['相似度']:.0%}", self.record_summary(db_name, row["UUID_A"]),
+                                                      self.record_summary(db_name, row["UUID_B"])])
+
+        def open_side(event):
+            selection = tree.selection()
+            if selection:
+                side = "UUID_A" if tree.identify_column(event.x) in ("#1", "#2") else "UUID_B"
+                self.open_record(pairs.at[int(selection[0]), side])
+
+        def merge(keep_side):
+            selection = tree.selection()
+            if not selection:
+                messagebox.showwarning("未選取", "請先選取一組資料")
+                return
+            pair = pairs.loc[int(selection[0])]
+            keep, drop = (pair["UUID_A"], pair["UUID_B"]) if keep_side == "A" else (pair["UUID_B"], pair["UUID_A"])
+            if not messagebox.askyesno("確認合併", f"保留：{self.record_summary(db_name, keep)}\n併入並刪除：{self.record_summary(db_name, drop)}\n\n"
+                                       "空白欄位會以被合併者補上，關聯、週期表、表格與異動紀錄改指向保留的資料。"):
+                return
+            if self.run_save(db_name, lambda: self.data_manager.merge_records(db_name, keep, [drop])):
+                for iid in tree.get_children():
+                    if drop in (pairs.at[int(iid), "UUID_A"], pairs.at[int(iid), "UUID_B"]):
+                        tree.delete(iid)
+                status.config(text=f"已合併，剩 {len(tree.get_children())} 組")
+
+        tree.bind("<Double-1>", open_side)
+        buttons = tk.Frame(self.root)
+        buttons.pack(pady=5)
+        tk.Button(buttons, text="⬅ 保留 A 合併", command=lambda: merge("A")).pack(side="left", padx=5)
+        tk.Button(buttons, text="保留 B 合併 ➡", command=lambda: merge("B")).pack(side="left", padx=5)
+        tk.Button(self.root, text="🔙 返回資料頁", command=self.build_data_page).pack(pady=10)
+
+    def build_validation_page(self, db_name):
+        self.clear_window()
+        tk.Label(self.root, text=f"✔ {db_name} 資料驗證", font=("Arial", 14)).pack(pady=10)
+        violations = self.data_manager.validate_database(db_name)
+        rules = "、".join(f"{field}（{'、'.join(k for k in spec if k != 'name')}）"
+                         for field, spec in self.data_manager.constraints(db_name).items())
+        tk.Label(self.root, text=f"規則：{rules}", fg="gray").pack()
+        tk.Label(self.root, text=f"共 {violations['UUID'].nunique()} 筆資料、{len(violations)} 項不符合"
+                 if not violations.empty else "全部資料皆符合規則").pack(pady=5)
+
+        columns = ["資料", "欄位", "規則", "值"]
+        tree = ttk.Treeview(self.root, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=180 if col == "資料" else 120)
+        tree.pack(fill="both", expand=True, padx=10, pady=5)
+        for i, row in violations.iterrows():
+            tree.insert("", "end", iid=str(i), values=[self.record_summary(db_name, row["UUID"]), row["欄位"], row["規則"], row["值"]])
+
+        def open_selected(event):
+            selection = tree.selection()
+            if selection:
+                self.open_record(violations.at[int(selection[0]), "UUID"])
+
+        tree.bind("<Double-1>", open_selected)
+        tk.Button(self.root, text="🔙 返回資料頁", command=self.build_data_page).pack(pady=10)
+
     def refresh_grid(self):
-        
+        if not hasattr(self, "grid_frame") or not self.grid_frame.winfo_exists():
+            return
+
         for widget in self.grid_frame.winfo_children():
             widget.destroy()
 
-        df = self.data_manager.data[self.current_database]
+        df = self.data_manager.preview(self.current_database)
+        rows = self.view_rows()
+        page_count = max(1, -(-len(rows) // ITEMS_PER_PAGE))
+        self.current_page = min(max(self.current_page, 0), page_count - 1)
         start = self.current_page * ITEMS_PER_PAGE
         end = start + ITEMS_PER_PAGE
-        
-        for display_index, idx in enumerate(df.index[start:end]):
+        querying = getattr(self, "current_query", None) is not None
+
+        if hasattr(self, "pager_frame") and self.pager_frame.winfo_exists():
+            for widget in self.pager_frame.winfo_children():
+                widget.destroy()
+            prev_button = tk.Button(self.pager_frame, text="◀", command=lambda: self.change_page(-1))
+            prev_button.pack(side="left", padx=5)
+            tk.Label(self.pager_frame, text=f"第 {self.current_page + 1} / {page_count} 頁（共 {len(rows)} 筆）").pack(side="left")
+            next_button = tk.Button(self.pager_frame, text="▶", command=lambda: self.change_page(1))
+            next_button.pack(side="left", padx=5)
+            if self.current_page == 0:
+                prev_button.config(state="disabled")
+            if self.current_page >= page_count - 1:
+                next_button.config(state="disabled")
+
+        for display_index, idx in enumerate(rows[start:end]):
             
             row = df.loc[idx]
             uuid_str = str(row.get("UUID", ""))
@@ -253,10 +5204,17 @@ class App:
             label_text = f"{self.current_database} #{idx + 1}\n" + "\n".join(summary_lines)
             tk.Label(frame, text=label_text, justify="left", bg="#ffffcc" if highlight else None).pack()
             if self.data_edit_mode.get():
-                tk.Button(frame, text="🗑 刪除", command=lambda i=idx: self.delete_entry(i)).pack()
-                if display_index > 0:
+                buttons = tk.Frame(frame, bg="#ffffcc" if highlight else None)
+                buttons.pack()
+                tk.Button(buttons, text="🗑 刪除", command=lambda i=idx: self.delete_entry(i)).pack(side="left")
+                tk.Button(buttons, text="🗄 封存", command=lambda u=uuid_str: self.archive_entries([u])).pack(side="left")
+                selected = tk.BooleanVar(value=uuid_str in self.selected_uuids)
+                tk.Checkbutton(buttons, text="選取", variable=selected, bg="#ffffcc" if highlight else None,
+                               command=lambda u=uuid_str, v=selected: self.toggle_selected(u, v.get())).pack(side="left")
+                # 查詢結果的順序不是資料本身的順序，不提供上下移動
+                if idx > 0 and not querying:
                     tk.Button(frame, text="↑", command=lambda i=idx: self.move_entry(i, -1)).pack()
-                if display_index < len(df) - 1:
+                if idx < len(df) - 1 and not querying:
                     tk.Button(frame, text="↓", command=lambda i=idx: self.move_entry(i, 1)).pack()
             else:
                 tk.Button(frame, text="查看詳情", command=lambda i=idx: self.open_detail(i)).pack()
@@ -271,6 +5229,7 @@ class App:
         tk.Button(top_frame, text="✏️ 編輯" if not self.edit_mode.get() else "✅ 完成", command=self.toggle_edit_mode).pack(side="left", padx=5)
         if self.edit_mode.get():
             tk.Button(top_frame, text="➕ 新增資料庫", command=self.create_new_database).pack(side="left", padx=5)
+            tk.Button(top_frame, text="🧹 清理未使用附件", command=self.clean_attachments).pack(side="left", padx=5)
 
         self.db_frame = tk.Frame(self.root)
         self.db_frame.pack(pady=10)
@@ -279,6 +5238,16 @@ class App:
 
         tk.Button(self.root, text="🔙 返回首頁", command=self.build_home_page).pack(pady=5)
 
+    def clean_attachments(self):
+        if not messagebox.askyesno("清理附件", "將刪除 links/ 中沒有任何資料引用的檔案（一天內新增的除外），確定要繼續？"):
+            return
+        try:
+            removed, freed = self.data_manager.collect_attachment_garbage()
+        except Exception as e:
+            messagebox.showerror("清理失敗", str(e))
+            return
+        messagebox.showinfo("清理完成", f"已刪除 {len(removed)} 個檔案，釋放 {freed / 1024 / 1024:.1f} MB")
+
     def toggle_edit_mode(self):
         self.edit_mode.set(not self.edit_mode.get())
         self.open_db_select_page()
@@ -322,6 +5291,7 @@ class App:
         if 0 <= new_index < len(names):
             names[index], names[new_index] = names[new_index], names[index]
             self.database_config = dict(names)
+            self.data_manager.config = self.database_config
             self.save_config()
             self.render_db_list()
 
@@ -378,20 +5348,22 @@ class App:
 
             default_columns = ["標題1"]
             df = pd.DataFrame(columns=default_columns)
-            df.to_excel(save_path, index=False)
 
-            # 註冊到 config
-            self.database_config[name] = save_path
-            self.save_config()
+            with self.data_manager.transaction():
+                self.data_manager.write_excel(save_path, df)
 
-            # 寫入 templates 與 groups
-            self.data_manager.templates[name] = default_columns
-            self.data_manager.groups[name] = {"組別1": ["標題1"]}
-            self.data_manager.save_templates(name)
-            self.data_manager.save_groups(name)
+                # 註冊到 config
+                self.database_config[name] = save_path
+                self.save_config()
+
+                # 寫入 templates 與 groups
+                self.data_manager.templates[name] = default_columns
+                self.data_manager.groups[name] = {"組別1": ["標題1"]}
+                self.data_manager.save_templates(name)
+                self.data_manager.save_groups(name)
 
             # 初始化記憶中的 data
-            self.data_manager.data[name] = df
+            self.data_manager.load_database(name)
 
             new_win.destroy()
             self.open_db_select_page()
@@ -402,27 +5374,215 @@ class App:
         messagebox.showinfo("尚未實作", "匯出頁面尚未完成，之後會加入欄位選擇與儲存功能。")
 
     def should_highlight(self, uuid_str):
-        period_path = f"period/{uuid_str}_period_1.xlsx"
-        if not os.path.exists(period_path):
-            return False
-        try:
-            df = pd.read_excel(period_path)
-            today = datetime.today()
-            for _, row in df.iterrows():
-                next_exec_str = str(row.get("下次執行日期", ""))
-                remind_months = str(row.get("執行前__月提醒", ""))
-                if not next_exec_str or not remind_months:
-                    continue
-                try:
-                    next_date = datetime.strptime(next_exec_str, "%Y-%m-%d")
-                    remind_delta = timedelta(days=int(remind_months) * 30)
-                    if today >= next_date - remind_delta:
-                        return True
-                except:
+        return self.data_manager.is_due(uuid_str)
+
+    def record_summary(self, db_name, uuid_str):
+        index = self.data_manager.index_of(db_name, uuid_str)
+        if index is None:
+            return uuid_str
+        row = self.data_manager.data[db_name].loc[index]
+        fields = [c for c in self.summary_fields.get(db_name, []) if c in row.index]
+        return " ".join(str(row[c]) for c in fields) or uuid_str
+
+    def record_choices(self, db_name):
+        # 摘要文字 -> UUID，供關聯欄位挑選
+        df = self.data_manager.data[db_name]
+        if "UUID" not in df.columns:
+            return {}
+        fields = [c for c in self.summary_fields.get(db_name, []) if c in df.columns]
+        labels = df[fields].astype(str).agg(" ".join, axis=1) if fields else df["UUID"].astype(str)
+        choices = {}
+        for label, uuid_value in zip(labels, df["UUID"].astype(str)):
+            choices[label if label not in choices else f"{label} ({uuid_value[:8]})"] = uuid_value
+        return choices
+
+    def open_record(self, uuid_str):
+        # 依 UUID 跨資料庫開啟詳細資料
+        db_name, index = self.data_manager.find_uuid(str(uuid_str))
+        if db_name is None:
+            archived_db, _ = self.data_manager.archived_row(str(uuid_str))
+            if archived_db is not None:
+                self.open_archived_record(archived_db, str(uuid_str))
+                return
+            messagebox.showwarning("找不到資料", f"找不到 UUID 為 {uuid_str} 的資料")
+            return
+        if db_name != self.current_database:
+            self.open_database(db_name)
+        self.open_detail(index)
+
+    def build_history_page(self, db_name):
+        self.clear_window()
+        snapshots = self.data_manager.snapshots
+        tk.Label(self.root, text=f"📜 {db_name} 版本紀錄", font=("Arial", 14)).pack(pady=10)
+
+        control = tk.Frame(self.root)
+        control.pack(pady=5)
+        date_var = tk.StringVar(value=datetime.today().strftime("%Y-%m-%d"))
+        tk.Label(control, text="時間點：").pack(side="left")
+        tk.Entry(control, textvariable=date_var, width=20).pack(side="left")
+
+        versions_tree = ttk.Treeview(self.root, columns=["版本", "時間", "種類", "列數"], show="headings", height=8)
+        for col, width in (("版本", 60), ("時間", 160), ("種類", 80), ("列數", 80)):
+            versions_tree.heading(col, text=col)
+            versions_tree.column(col, width=width, anchor="center")
+        versions_tree.pack(fill="x", padx=10)
+        for seq, stamp, kind, path in reversed(snapshots.versions(db_name)):
+            try:
+                count = snapshots.row_count(path)
+            except (OSError, ValueError) as e:
+                print("讀取版本紀錄失敗：", path, e)
+                continue
+            versions_tree.insert("", "end", iid=str(seq), values=[seq, stamp.strftime("%Y-%m-%d %H:%M:%S"),
+                                                                  "完整" if kind == "full" else "差異", count])
+
+        diff_tree = ttk.Treeview(self.root, columns=["資料", "欄位", "舊值", "新值"], show="headings")
+        for col in ("資料", "欄位", "舊值", "新值"):
+            diff_tree.heading(col, text=col)
+            diff_tree.column(col, width=160)
+        diff_tree.pack(fill="both", expand=True, padx=10, pady=5)
+
+        def selected_seqs():
+            return sorted(int(i) for i in versions_tree.selection())
+
+        def jump_to_date():
+            try:
+                when = datetime.strptime(date_var.get().strip(), "%Y-%m-%d") + timedelta(days=1) - timedelta(seconds=1)
+            except ValueError:
+                messagebox.showwarning("格式錯誤", "請輸入 YYYY-MM-DD")
+                return
+            seq = snapshots.seq_at(db_name, when)
+            if seq is None:
+                messagebox.showinfo("沒有紀錄", "該時間點之前沒有版本紀錄")
+                return
+            versions_tree.selection_set(str(seq))
+            versions_tree.see(str(seq))
+
+        def show_diff():
+            seqs = selected_seqs()
+            versions = snapshots.versions(db_name)
+            if not seqs or not versions:
+                messagebox.showwarning("未選取", "請選取一個（與最新版比較）或兩個版本")
+                return
+            old_seq, new_seq = (seqs[0], seqs[-1]) if len(seqs) > 1 else (seqs[0], versions[-1][0])
+            try:
+                added, removed, changed = snapshots.diff(db_name, old_seq, new_seq,
+                                                         within=lambda df: self.data_manager.in_scope(db_name, df))
+            except (KeyError, OSError, ValueError) as e:
+                messagebox.showerror("比較失敗", str(e))
+                return
+            diff_tree.delete(*diff_tree.get_children())
+            for uuid_str in added:
+                diff_tree.insert("", "end", values=[self.record_summary(db_name, uuid_str), "（新增）", "", ""])
+            for uuid_str in removed:
+                diff_tree.insert("", "end", values=[uuid_str, "（刪除）", "", ""])
+            for uuid_str, cols in changed.items():
+                for col, (old, new) in cols.items():
+                    diff_tree.insert("", "end", values=[self.record_summary(db_name, uuid_str), col, old, new])
+            status.config(text=f"第 {old_seq} 版 → 第 {new_seq} 版：新增 {len(added)}、刪除 {len(removed)}、修改 {len(changed)} 筆")
+
+        def export_version():
+            seqs = selected_seqs()
+            if not seqs:
+                messagebox.showwarning("未選取", "請先選取版本")
+                return
+            save_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel 檔案", "*.xlsx")],
+                                                     initialfile=f"{db_name}_第{seqs[-1]}版.xlsx")
+            if save_path:
+                df = snapshots.frame_at(db_name, seqs[-1])
+                serialize_link_cells(df.drop(columns=[VERSION_COLUMN], errors="ignore")).to_excel(save_path, index=False)
+                messagebox.showinfo("匯出成功", f"已匯出至：\n{save_path}")
+
+        def restore_version():
+            seqs = selected_seqs()
+            if len(seqs) != 1:
+                messagebox.showwarning("未選取", "請選取一個要還原的版本")
+                return
+            if not messagebox.askyesno("確認還原", f"確定要把 {db_name} 整個還原到第 {seqs[0]} 版嗎？\n還原後會存成新的版本，可再復原。"):
+                return
+            def restore():
+                self.data_manager.restore_snapshot(db_name, seqs[0])
+                self.data_manager.save_data(db_name)
+            if self.run_save(db_name, restore):
+                messagebox.showinfo("已還原", f"已還原到第 {seqs[0]} 版")
+                self.build_history_page(db_name)
+
+        tk.Button(control, text="跳到該時間點", command=jump_to_date).pack(side="left", padx=5)
+        tk.Button(control, text="比較", command=show_diff).pack(side="left", padx=5)
+        tk.Button(control, text="匯出此版本", command=export_version).pack(side="left", padx=5)
+        tk.Button(control, text="還原到此版本", command=restore_version).pack(side="left", padx=5)
+        tk.Button(control, text="🔙 返回", command=lambda: self.open_database(db_name)).pack(side="left", padx=5)
+        status = tk.Label(self.root, text="選取一個版本與最新版比較，或按住 Ctrl 選取兩個版本", fg="gray")
+        status.pack(pady=5)
+
+    def open_record_history(self, db_name, uuid_str):
+        snapshots = self.data_manager.snapshots
+        top = tk.Toplevel(self.root)
+        top.title(f"📜 {self.record_summary(db_name, uuid_str)} 歷史紀錄")
+        top.geometry("700x450")
+        versions = {seq: stamp for seq, stamp, _, _ in snapshots.versions(db_name)}
+        seqs = snapshots.touched(db_name, uuid_str)
+        latest = max(versions) if versions else None
+        # 第一個完整快照之前就存在的資料，以該快照作為最早的版本
+        first_full = next((seq for seq, _, kind, _ in snapshots.versions(db_name) if kind == "full"), None)
+        if first_full is not None and first_full not in seqs:
+            seqs = [first_full] + seqs
+
+        listbox = tk.Listbox(top, height=8)
+        listbox.pack(fill="x", padx=10, pady=5)
+        for seq in seqs:
+            listbox.insert("end", f"第 {seq} 版　{versions[seq].strftime('%Y-%m-%d %H:%M:%S')}")
+
+        tree = ttk.Treeview(top, columns=["欄位", "該版本", "目前"], show="headings")
+        for col in ("欄位", "該版本", "目前"):
+            tree.heading(col, text=col)
+            tree.column(col, width=200)
+        tree.tag_configure("changed", background="#fff2cc")
+        tree.pack(fill="both", expand=True, padx=10, pady=5)
+
+        def selected_seq():
+            selection = listbox.curselection()
+            return seqs[selection[0]] if selection else None
+
+        def show(event=None):
+            seq = selected_seq()
+            if seq is None:
+                return
+            old = snapshots.record_at(db_name, uuid_str, seq)
+            index = self.data_manager.index_of(db_name, uuid_str)
+            now = self.data_manager.data[db_name].loc[index] if index is not None else None
+            tree.delete(*tree.get_children())
+            if old is None:
+                tree.insert("", "end", values=["（此版本中已刪除）", "", ""])
+                return
+            for col in old.index:
+                if col in ("UUID", VERSION_COLUMN):
                     continue
-        except:
-            return False
-        return False
+                old_text = "" if pd.isna(old[col]) else str(old[col])
+                now_val = now.get(col) if now is not None else None
+                now_text = "" if now_val is None or pd.isna(now_val) else str(now_val)
+                tree.insert("", "end", values=[col, old_text, now_text], tags=("changed",) if old_text != now_text else ())
+
+        def restore():
+            seq = selected_seq()
+            if seq is None or not messagebox.askyesno("確認還原", f"確定要把此筆資料還原到第 {seq} 版嗎？", parent=top):
+                return
+            def action():
+                self.data_manager.restore_snapshot(db_name, seq, [uuid_str])
+                self.data_manager.save_data(db_name)
+            if self.run_save(db_name, action):
+                top.destroy()
+                self.refresh_grid()
+                index = self.data_manager.index_of(db_name, uuid_str)
+                if index is not None and db_name == self.current_database:
+                    self.open_detail(index)
+
+        listbox.bind("<<ListboxSelect>>", show)
+        buttons = tk.Frame(top)
+        buttons.pack(pady=5)
+        tk.Button(buttons, text="還原此版本", command=restore).pack(side="left", padx=5)
+        tk.Button(buttons, text="關閉", command=top.destroy).pack(side="left", padx=5)
+        if latest is None:
+            tk.Label(top, text="尚無版本紀錄，下次儲存後開始記錄", fg="gray").pack()
 
     def open_detail(self, index):
         
@@ -439,12 +5599,7 @@ class App:
         df = self.data_manager.data[self.current_database]
         row = df.loc[index]
 
-        
-        if 'UUID' not in df.columns:
-            df['UUID'] = None
-        if not pd.notnull(df.at[index, 'UUID']):
-            df.at[index, 'UUID'] = str(uuid.uuid4())
-        uuid_str = df.at[index, 'UUID']
+        uuid_str = self.data_manager.ensure_uuid(self.current_database, index)
 
         self.period_data = []
         self.period_path = os.path.join("period", f"{uuid_str}_period_1.xlsx")
@@ -472,112 +5627,179 @@ class App:
         scrollable_frame = tk.Frame(canvas)
         scrollable_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
         canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
         container.pack(fill="both", expand=True)
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
         canvas.bind_all("<MouseWheel>", lambda event: canvas.yview_scroll(int(-1 * (event.delta / 120)), "units"))
 
+        # 🖼 縮圖只在捲到可見範圍時才產生與解碼
+        thumb_slots = []  # (Label, 檔案路徑)
+        thumb_check = []
+
+        def load_visible_thumbnails():
+            thumb_check.clear()
+            if not top.winfo_exists():
+                return
+            view_top = canvas.winfo_rooty()
+            view_bottom = view_top + canvas.winfo_height()
+            for slot in list(thumb_slots):
+                label, path = slot
+                if not label.winfo_exists():
+                    thumb_slots.remove(slot)
+                    continue
+                y = label.winfo_rooty()
+                if not label.winfo_ismapped() or y + THUMB_SIZE[1] < view_top or y > view_bottom:
+                    continue
+                thumb_slots.remove(slot)
+                self.show_thumbnail(label, self.thumbnails.request(path))
+
+        def on_scroll(*args):
+            scrollbar.set(*args)
+            if thumb_slots and not thumb_check:
+                thumb_check.append(top.after_idle(load_visible_thumbnails))
+
+        canvas.configure(yscrollcommand=on_scroll)
+
         editable_groups = []
 
         def save_changes():
-            new_fields = []
-            new_groups = {}
-            for group in editable_groups:
-                group_name = group["title_var"].get().strip()
-                if not group_name:
-                    continue
-                new_groups[group_name] = []
-                for field_obj in group["fields"]:
-                    key = field_obj["key_var"].get().strip()
-                    val = field_obj["val_var"].get().strip()
-                    if key:
-                        new_fields.append(key)
-                        new_groups[group_name].append(key)
-                        if field_obj.get("type") == "external_link":
-                            label = field_obj.get("label_var", tk.StringVar()).get().strip()
-                            df.at[index, key] = json.dumps({"label": label, "path": val})
-                        elif field_obj.get("type") == "internal_link":
-                            label = field_obj.get("label_var", tk.StringVar()).get().strip()
-                            df.at[index, key] = json.dumps({"label": label, "uuid": val})
-                        else:
-                            col_dtype = df[key].dtype if key in df.columns else object
-                            try:
-                                if pd.api.types.is_numeric_dtype(col_dtype):
-                                    df.at[index, key] = str(val) if val else None
-                                elif pd.api.types.is_bool_dtype(col_dtype):
-                                    df.at[index, key] = val.lower() in ["true", "1", "yes"]
-                                else:
-                                    df.at[index, key] = str(val)
-                            except ValueError:
-                                df.at[index, key] = str(val)  # fallback
-            # 儲存週期表格
-            try:
-                if hasattr(self, "period_data") and self.period_data:
-                    
-                    rows = []
-                    for row_vars in self.period_data:
-                        row = [v.get() for v in row_vars]
-                        try:
-                            if row[1] and row[3]:  # 有填寫「下次間隔」與「此次執行日期」
-                                months = int(row[1])
-                                exec_date = datetime.strptime(row[3], "%Y-%m-%d")
-                                next_date = exec_date + timedelta(days=months * 30)
-                                row[4] = next_date.strftime("%Y-%m-%d")
+            # 資料、模板、分組、週期表與異動紀錄視為同一筆交易，全部成功才套用
+            db_name = self.current_database
+            with self.data_manager.transaction() as journal:
+                # 輪詢可能已換掉 DataFrame 或調整列序，儲存時以 UUID 重新定位
+                df = self.data_manager.data[self.current_database]
+                row_index = self.data_manager.index_of(self.current_database, uuid_str)
+                if row_index is None:
+                    raise KeyError(f"找不到 UUID 為 {uuid_str} 的資料，可能已被其他使用者刪除")
+                row_before = df.loc[row_index].copy()
+                dirty_before = set(self.data_manager.dirty[db_name])
+                templates_before = copy.deepcopy(self.data_manager.templates.get(db_name))
+                groups_before = copy.deepcopy(self.data_manager.groups.get(db_name))
+
+                def restore():
+                    # 衝突或不符規則而未寫入時，記憶體回到編輯前，畫面與之後的儲存不會帶著這次的修改
+                    frame = self.data_manager.data[db_name]
+                    index = self.data_manager.index_of(db_name, uuid_str)
+                    if index is not None:
+                        for col in row_before.index.intersection(frame.columns):
+                            frame.at[index, col] = row_before[col]
+                    self.data_manager.dirty[db_name] = dirty_before
+                    self.data_manager.templates[db_name] = templates_before
+                    self.data_manager.groups[db_name] = groups_before
+                    self.data_manager.load_field_types(db_name)
+                    self.data_manager.touch(db_name)
+                journal.after_rollback.append(restore)
+                self.data_manager.mark_dirty(self.current_database, row_index)
+                # 🧱 改名與新增欄位以 migration 處理，舊欄位的資料跟著改名，不留下孤兒欄位
+                template_fields = set(self.data_manager.template_fields(self.current_database))
+                for group in editable_groups:
+                    for field_obj in group["fields"]:
+                        old, key = field_obj.get("orig_key"), field_obj["key_var"].get().strip()
+                        if not key or key == old:
+                            continue
+                        if old and (old in df.columns or old in template_fields):
+                            if key in df.columns or key in template_fields:
+                                raise KeyError(f"欄位「{key}」已存在，無法把「{old}」改成這個名稱")
+                            self.data_manager.rename_column(self.current_database, old, key, save=False)
+                            # 交易提交後才視為新名稱；失敗重試時會重新記錄這次改名
+                            journal.after_commit.append(lambda f=field_obj, k=key: f.__setitem__("orig_key", k))
+                        elif key not in df.columns and key not in template_fields:
+                            self.data_manager.add_column(self.current_database, key, group["title_var"].get().strip() or None, save=False)
+                            template_fields.add(key)
+                df = self.data_manager.data[self.current_database]
+                row_index = self.data_manager.index_of(self.current_database, uuid_str)
+                old_groups = {f: g for g, members in self.data_manager.groups.get(self.current_database, {}).items() for f in members}
+                new_fields = []
+                new_groups = {}
+                for group in editable_groups:
+                    group_name = group["title_var"].get().strip()
+                    if not group_name:
+                        continue
+                    new_groups[group_name] = []
+                    for field_obj in group["fields"]:
+                        key = field_obj["key_var"].get().strip()
+                        val = field_obj["val_var"].get().strip()
+                        if key:
+                            new_fields.append(key)
+                            new_groups[group_name].append(key)
+                            if field_obj.get("type") in ("external_link", "internal_link"):
+                                label = field_obj.get("label_var", tk.StringVar()).get().strip()
+                                link_type = ExternalLink if field_obj["type"] == "external_link" else InternalLink
+                                if key in df.columns and not pd.api.types.is_object_dtype(df[key]):
+                                    df[key] = df[key].astype(object)
+                                df.at[row_index, key] = link_type(label, val)
                             else:
-                                row[4] = ""
-                        except Exception:
-                            row[4] = ""
-                        rows.append(row)
+                                col_dtype = df[key].dtype if key in df.columns else object
+                                try:
+                                    if pd.api.types.is_numeric_dtype(col_dtype):
+                                        df.at[row_index, key] = str(val) if val else None
+                                    elif pd.api.types.is_bool_dtype(col_dtype):
+                                        df.at[row_index, key] = val.lower() in ["true", "1", "yes"]
+                                    else:
+                                        df.at[row_index, key] = str(val)
+                                except ValueError:
+                                    df.at[row_index, key] = str(val)  # fallback
+                # 儲存週期表格
+                try:
+                    if hasattr(self, "period_data") and self.period_data:
+                    
+                        rows = [[v.get() for v in row_vars] for row_vars in self.period_data]
+                        df_period = pd.DataFrame(rows, columns=PERIOD_COLUMNS)
+                        # 有填寫「下次間隔」與「此次執行日期」才計算，否則留空
+                        next_dates = add_months(df_period["此次執行日期"].replace("", None), df_period["下次間隔__月"])
+                        df_period["下次執行日期"] = next_dates.dt.strftime("%Y-%m-%d").fillna("").to_numpy()
+                        os.makedirs(os.path.dirname(self.period_path), exist_ok=True)
+                        self.data_manager.write_excel(self.period_path, df_period)
+                except Exception as e:
+                    print("儲存週期表格失敗:", e)
 
                     df_period = pd.DataFrame(rows, columns=["標題", "下次間隔__月", "執行前__月提醒", "此次執行日期", "下次執行日期"])
                     os.makedirs(os.path.dirname(self.period_path), exist_ok=True)
-                    df_period.to_excel(self.period_path, index=False)
-            except Exception as e:
-                print("儲存週期表格失敗:", e)
-
-                df_period = pd.DataFrame(rows, columns=["標題", "下次間隔__月", "執行前__月提醒", "此次執行日期", "下次執行日期"])
-                os.makedirs(os.path.dirname(self.period_path), exist_ok=True)
-                df_period.to_excel(self.period_path, index=False)
+                    self.data_manager.write_excel(self.period_path, df_period)
 
-            # 📝 儲存異動紀錄
-            try:
-                changes_path = os.path.join("data", f"changes_{self.current_database}.xlsx")
-                os.makedirs("data", exist_ok=True)
+                # 📝 儲存異動紀錄
+                try:
+                    changes_path = os.path.join("data", f"changes_{self.current_database}.xlsx")
+                    os.makedirs("data", exist_ok=True)
 
-                # 載入或初始化
-                if os.path.exists(changes_path):
-                    df_changes = pd.read_excel(changes_path)
-                else:
-                    df_changes = pd.DataFrame(columns=["標題", "異動日期", "異動前", "異動後", "uuid"])
-
-                # 使用者輸入
-                title = self.change_title_var.get().strip()
-                after = self.change_after_var.get().strip()
-                if title and after:
-                    prev_rows = df_changes[df_changes["uuid"] == uuid_str]
-                    prev_after = prev_rows["異動後"].iloc[-1] if not prev_rows.empty else "無"
-                    now = datetime.today().strftime("%Y-%m-%d")
-
-                    new_row = {
-                        "標題": title,
-                        "異動日期": now,
-                        "異動前": prev_after,
-                        "異動後": after,
-                        "uuid": uuid_str
-                    }
-                    df_changes.loc[len(df_changes)] = new_row
-                    df_changes.to_excel(changes_path, index=False)
-            except Exception as e:
-                print("異動紀錄儲存失敗：", e)
+                    # 載入或初始化
+                    if os.path.exists(changes_path):
+                        df_changes = pd.read_excel(changes_path)
+                    else:
+                        df_changes = pd.DataFrame(columns=["標題", "異動日期", "異動前", "異動後", "uuid"])
+
+                    # 使用者輸入
+                    title = self.change_title_var.get().strip()
+                    after = self.change_after_var.get().strip()
+                    if title and after:
+                        prev_rows = df_changes[df_changes["uuid"] == uuid_str]
+                        prev_after = prev_rows["異動後"].iloc[-1] if not prev_rows.empty else "無"
+                        now = datetime.today().strftime("%Y-%m-%d")
+
+                        new_row = {
+                            "標題": title,
+                            "異動日期": now,
+                            "異動前": prev_after,
+                            "異動後": after,
+                            "uuid": uuid_str
+                        }
+                        df_changes.loc[len(df_changes)] = new_row
+                        self.data_manager.write_excel(changes_path, df_changes)
+                except Exception as e:
+                    print("異動紀錄儲存失敗：", e)
                         
 
-            self.data_manager.templates[self.current_database] = list(dict.fromkeys(new_fields))
-            self.data_manager.groups[self.current_database] = new_groups
-            self.data_manager.save_templates(self.current_database)
-            self.data_manager.save_groups(self.current_database)
-            self.data_manager.save_data(self.current_database)
+                for group_name, members in new_groups.items():
+                    for position, key in enumerate(members):
+                        if key in old_groups and old_groups[key] != group_name:
+                            self.data_manager.move_field(self.current_database, key, group_name, position)
+                self.data_manager.set_template_fields(self.current_database, new_fields)
+                self.data_manager.groups[self.current_database] = new_groups
+                self.data_manager.save_templates(self.current_database)
+                self.data_manager.save_groups(self.current_database)
+                self.data_manager.save_data(self.current_database)
+                self.data_manager.update_links(self.current_database, uuid_str)
 
         def render_detail():
             df = self.data_manager.data[self.current_database]
@@ -592,9 +5814,15 @@ class App:
             for widget in scrollable_frame.winfo_children():
                 widget.destroy()
 
-            row = df.loc[index]
+            thumb_slots.clear()
+            row_index = self.data_manager.index_of(self.current_database, uuid_str)
+            if row_index is None:
+                tk.Label(scrollable_frame, text="此筆資料已被刪除", fg="red").pack(padx=10, pady=10)
+                return
+            row = df.loc[row_index]
 
             if not is_editing.get():
+                ref_fields = self.data_manager.ref_fields(self.current_database)
                 groups = self.data_manager.groups.get(self.current_database, {})
                 for group_name, fields in groups.items():
                     group_frame = tk.LabelFrame(scrollable_frame, text=group_name, padx=5, pady=5)
@@ -622,40 +5850,40 @@ class App:
                         row_frame.pack(fill="x", pady=2)
                         tk.Label(row_frame, text=field, width=20, anchor="w").pack(side="left")
                         val = row.get(field, "")
-                        try:
-                            val_obj = json.loads(val)
-                            if isinstance(val_obj, dict):
-                                if "label" in val_obj and "path" in val_obj:
-                                    def open_file(path=val_obj["path"]):
-                                        import os, platform, subprocess
-                                        if platform.system() == "Windows":
-                                            os.startfile(path)
-                                        elif platform.system() == "Darwin":
-                                            subprocess.call(["open", path])
-                                        else:
-                                            subprocess.call(["xdg-open", path])
-                                    tk.Button(row_frame, text=val_obj["label"], fg="blue", cursor="hand2", command=open_file).pack(side="left", padx=5)
-                                elif "label" in val_obj and "uuid" in val_obj:
-                                    def open_internal(uuid=val_obj["uuid"]):
-                                        target_df = self.data_manager.data[self.current_database]
-                                        if "UUID" not in target_df.columns:
-                                            messagebox.showwarning("錯誤", "尚未建立 UUID 欄位")
-                                            return
-                                        target_rows = target_df[target_df["UUID"] == uuid]
-                                        if not target_rows.empty:
-                                            target_index = target_rows.index[0]
-                                            self.open_detail(target_index)
-                                        else:
-                                            messagebox.showwarning("找不到資料", f"找不到 UUID 為 {uuid} 的資料")
-                                    tk.Button(row_frame, text=val_obj["label"], fg="blue", cursor="hand2", command=open_internal).pack(side="left", padx=5)
-                                else:
-                                    raise ValueError
-                            else:
-                                raise ValueError
-                        except Exception:
-                            tk.Label(row_frame, text=str(val), anchor="w", width=40).pack(side="left", padx=5)
-                        
-                
+                        if isinstance(val, ExternalLink):
+                            link_path = _link_path(val.path)
+                            def open_file(path=link_path):
+                                try:
+                                    open_path(path)
+                                except Exception as e:
+                                    messagebox.showerror("無法開啟", f"{path}\n{e}")
+                            tk.Button(row_frame, text=val.label, fg="blue", cursor="hand2", command=open_file).pack(side="left", padx=5)
+                            if self.thumbnails.can_preview(link_path):
+                                thumb = tk.Label(row_frame, text="🖼", width=4, cursor="hand2")
+                                thumb.pack(side="left", padx=5)
+                                thumb.bind("<Button-1>", lambda e, f=open_file: f())
+                                thumb_slots.append((thumb, link_path))
+                        elif isinstance(val, InternalLink):
+                            tk.Button(row_frame, text=val.label, fg="blue", cursor="hand2",
+                                      command=lambda u=val.uuid: self.open_record(u)).pack(side="left", padx=5)
+                        elif field in ref_fields and isinstance(val, str) and val.strip():
+                            tk.Button(row_frame, text=self.record_summary(ref_fields[field], val.strip()), fg="blue", cursor="hand2",
+                                      command=lambda u=val.strip(): self.open_record(u)).pack(side="left", padx=5)
+                        else:
+                            tk.Label(row_frame, text="" if pd.isna(val) else str(val), anchor="w", width=40).pack(side="left", padx=5)
+
+                # 🔗 被其他資料參照（由關聯索引查詢，不掃描儲存格）
+                backlinks = self.data_manager.backlinks(uuid_str)
+                if backlinks:
+                    back_frame = tk.LabelFrame(scrollable_frame, text=f"🔗 被參照（{len(backlinks)}）", padx=5, pady=5)
+                    back_frame.pack(fill="x", padx=10, pady=5)
+                    for src_db, src_uuid, field in backlinks:
+                        row_frame = tk.Frame(back_frame)
+                        row_frame.pack(fill="x", pady=1)
+                        tk.Label(row_frame, text=f"{src_db}．{field}", width=20, anchor="w").pack(side="left")
+                        tk.Button(row_frame, text=self.record_summary(src_db, src_uuid), fg="blue", cursor="hand2",
+                                  command=lambda u=src_uuid: self.open_record(u)).pack(side="left", padx=5)
+
                 def create_new_table(callback=None):
                     table_folder = "tables"
                     os.makedirs(table_folder, exist_ok=True)
@@ -667,9 +5895,11 @@ class App:
                     df = pd.DataFrame([["欄位1", "欄位2"], ["內容1", "內容2"]])
                     title_df = pd.DataFrame({"title": [f"新表格{new_id}"]})
 
-                    with pd.ExcelWriter(new_path, engine="openpyxl") as writer:
-                        df.to_excel(writer, index=False, header=False, sheet_name="data")
-                        title_df.to_excel(writer, index=False, sheet_name="metadata")
+                    def write_table(p):
+                        with pd.ExcelWriter(p, engine="openpyxl") as writer:
+                            df.to_excel(writer, index=False, header=False, sheet_name="data")
+                            title_df.to_excel(writer, index=False, sheet_name="metadata")
+                    self.data_manager.write_file(new_path, write_table)
 
                     if callback:
                         callback()
@@ -685,10 +5915,11 @@ class App:
                             df = pd.DataFrame(data[1:], columns=data[0])
                             title_df = pd.DataFrame({"title": [title_var.get()]})
 
-                            os.makedirs(os.path.dirname(table_path), exist_ok=True)
-                            with pd.ExcelWriter(table_path, engine="openpyxl", mode="w") as writer:
-                                df.to_excel(writer, index=False, sheet_name="data")
-                                title_df.to_excel(writer, index=False, sheet_name="metadata")
+                            def write_table(p):
+                                with pd.ExcelWriter(p, engine="openpyxl", mode="w") as writer:
+                                    df.to_excel(writer, index=False, sheet_name="data")
+                                    title_df.to_excel(writer, index=False, sheet_name="metadata")
+                            self.data_manager.write_file(table_path, write_table)
                             messagebox.showinfo("成功", "表格已儲存")
                         except Exception as e:
                             messagebox.showerror("錯誤", f"儲存失敗：{e}")
@@ -786,70 +6017,50 @@ class App:
                 def refresh_tables():
                     for widget in tables_container.winfo_children():
                         widget.destroy()
-                    table_folder = "tables"
-                    os.makedirs(table_folder, exist_ok=True)
-                    for f in sorted(os.listdir("tables")):
-                        if f.startswith(f"{uuid_str}_table_") and f.endswith(".xlsx"):
-                            table_path = os.path.join("tables", f)
-                            try:
-                                meta = pd.read_excel(table_path, sheet_name="metadata")
-                                title = meta.at[0, "title"] if "title" in meta.columns else f
-                            except Exception:
-                                title = f
-
-                            frame = tk.LabelFrame(tables_container, text=title)
-                            frame.pack(fill="x", padx=10, pady=5)
-
-                            btn_row = tk.Frame(frame)
-                            btn_row.pack(anchor="w", padx=5, pady=5)
-
-                            is_expanded = tk.BooleanVar(value=False)
-                            content_frame = tk.Frame(frame)
-                            content_frame.pack(fill="x")
-
-                            def toggle_expand(p=table_path, cf=content_frame, v=is_expanded):
-                                if v.get():  # 如果已展開 ➜ 摺疊
-                                    for widget in cf.winfo_children():
-                                        widget.destroy()
-                                    v.set(False)
-                                else:  # 尚未展開 ➜ 展開
-                                    try:
-                                        df = pd.read_excel(p, sheet_name="data", header=None)
-                                        for r_idx, row in df.iterrows():
-                                            for c_idx, cell in enumerate(row):
-                                                tk.Label(cf, text=str(cell), width=15, anchor="w", relief="groove").grid(row=r_idx, column=c_idx, sticky="nsew", padx=1, pady=1)
-                                        v.set(True)
-                                    except Exception as e:
-                                        tk.Label(cf, text=f"讀取失敗: {e}", fg="red").pack()
-                                        v.set(True)
-
-                            def delete_table(path=table_path):
-                                if messagebox.askyesno("刪除表格", "確定要刪除此表格？此操作不可復原。"):
-                                    try:
-                                        os.remove(path)
-                                        refresh_tables()
-                                    except Exception as e:
-                                        messagebox.showerror("刪除失敗", f"無法刪除表格：{e}")
-
-                            tk.Button(btn_row, text="展開/摺疊", command=toggle_expand).pack(side="left", padx=2)
-                            tk.Button(btn_row, text="✏️ 編輯", command=lambda p=table_path, fr=frame: open_table_editor(p, fr, refresh_tables)).pack(side="left", padx=2)
-                            tk.Button(btn_row, text="🗑 刪除", command=delete_table).pack(side="left", padx=2)
+                    os.makedirs(TABLES_FOLDER, exist_ok=True)
+                    for table_path, title, table_data in self.data_manager.details.get(self.current_database, uuid_str)["tables"]:
+                        frame = tk.LabelFrame(tables_container, text=title)
+                        frame.pack(fill="x", padx=10, pady=5)
+
+                        btn_row = tk.Frame(frame)
+                        btn_row.pack(anchor="w", padx=5, pady=5)
+
+                        is_expanded = tk.BooleanVar(value=False)
+                        content_frame = tk.Frame(frame)
+                        content_frame.pack(fill="x")
+
+                        def toggle_expand(df=table_data, cf=content_frame, v=is_expanded):
+                            if v.get():  # 如果已展開 ➜ 摺疊
+                                for widget in cf.winfo_children():
+                                    widget.destroy()
+                                v.set(False)
+                            elif isinstance(df, Exception):
+                                tk.Label(cf, text=f"讀取失敗: {df}", fg="red").pack()
+                                v.set(True)
+                            else:  # 尚未展開 ➜ 展開（內容來自詳細頁快取）
+                                for r_idx, row in df.iterrows():
+                                    for c_idx, cell in enumerate(row):
+                                        tk.Label(cf, text=str(cell), width=15, anchor="w", relief="groove").grid(row=r_idx, column=c_idx, sticky="nsew", padx=1, pady=1)
+                                v.set(True)
+
+                        def delete_table(path=table_path):
+                            if messagebox.askyesno("刪除表格", "確定要刪除此表格？此操作不可復原。"):
+                                try:
+                                    os.remove(path)
+                                    refresh_tables()
+                                except Exception as e:
+                                    messagebox.showerror("刪除失敗", f"無法刪除表格：{e}")
+
+                        tk.Button(btn_row, text="展開/摺疊", command=toggle_expand).pack(side="left", padx=2)
+                        tk.Button(btn_row, text="✏️ 編輯", command=lambda p=table_path, fr=frame: open_table_editor(p, fr, refresh_tables)).pack(side="left", padx=2)
+                        tk.Button(btn_row, text="🗑 刪除", command=delete_table).pack(side="left", padx=2)
 
                 # 📅 週期表格顯示（只讀模式）
                 tk.Label(scrollable_frame, text="📅 週期表格", font=("Arial", 12, "bold")).pack(anchor="w", padx=10, pady=5)
 
-                period_folder = "period"
-                os.makedirs(period_folder, exist_ok=True)
-                period_files = sorted(f for f in os.listdir(period_folder) if f.startswith(f"{uuid_str}_period_") and f.endswith(".xlsx"))
-
-                for f in period_files:
-                    period_path = os.path.join(period_folder, f)
-                    try:
-                        df = pd.read_excel(period_path)
-                    except Exception as e:
-                        df = pd.DataFrame([["讀取失敗", str(e)]])
-                    
-                    if df.empty:
+                detail = self.data_manager.details.get(self.current_database, uuid_str)
+                for period_path, df in detail["periods"]:
+                    if df is None or df.empty:
                         continue
 
                     box = tk.LabelFrame(scrollable_frame, padx=5, pady=5)
@@ -872,15 +6083,7 @@ class App:
                 # 📝 異動紀錄顯示（只讀模式）
                 tk.Label(scrollable_frame, text="📝 異動紀錄", font=("Arial", 12, "bold")).pack(anchor="w", padx=10, pady=5)
 
-                changes_path = os.path.join("data", f"changes_{self.current_database}.xlsx")
-                if os.path.exists(changes_path):
-                    try:
-                        df_changes = pd.read_excel(changes_path)
-                        df_changes = df_changes[df_changes["uuid"] == uuid_str]
-                    except Exception as e:
-                        df_changes = pd.DataFrame([{"標題": "讀取失敗", "異動日期": str(e), "異動前": "", "異動後": ""}])
-                else:
-                    df_changes = pd.DataFrame()
+                df_changes = detail["changes"]
 
                 if not df_changes.empty:
                     frame = tk.Frame(scrollable_frame)
@@ -916,9 +6119,10 @@ class App:
                 return
 
             def save_and_reload():
-                save_changes()
+                if not self.run_save(self.current_database, save_changes):
+                    return
                 top.destroy()
-                self.open_detail(index)
+                reopen()
 
             def add_group():
                 group_data = {"title_var": tk.StringVar(value="新組別"), "fields": []}
@@ -938,6 +6142,7 @@ class App:
             def make_delete_callback(local_fields, f, rf):
                 return lambda: (rf.destroy(), local_fields.remove(f))
 
+            ref_fields = self.data_manager.ref_fields(self.current_database)
             if not editable_groups:
                 groups = self.data_manager.groups.get(self.current_database, {})
                 for group_name, field_list in groups.items():
@@ -945,32 +6150,32 @@ class App:
                     for f in field_list:
                         key_var = tk.StringVar(value=f)
                         val_raw = row.get(f, "")
-                        try:
-                            val_obj = json.loads(val_raw)
-                            if isinstance(val_obj, dict) and "label" in val_obj and "path" in val_obj:
-                                label_var = tk.StringVar(value=val_obj["label"])
-                                val_var = tk.StringVar(value=val_obj["path"])
-                                field_data = {
-                                    "key_var": key_var,
-                                    "val_var": val_var,
-                                    "label_var": label_var,
-                                    "type": "external_link"
-                                }
-                            elif isinstance(val_obj, dict) and "label" in val_obj and "uuid" in val_obj:
-                                label_var = tk.StringVar(value=val_obj["label"])
-                                val_var = tk.StringVar(value=val_obj["uuid"])
-                                field_data = {
-                                    "key_var": key_var,
-                                    "val_var": val_var,
-                                    "label_var": label_var,
-                                    "type": "internal_link"
-                                }
-                            else:
-                                raise ValueError
-                        except Exception:
+                        if isinstance(val_raw, ExternalLink):
+                            field_data = {
+                                "key_var": key_var,
+                                "val_var": tk.StringVar(value=val_raw.path),
+                                "label_var": tk.StringVar(value=val_raw.label),
+                                "type": "external_link"
+                            }
+                        elif isinstance(val_raw, InternalLink):
+                            field_data = {
+                                "key_var": key_var,
+                                "val_var": tk.StringVar(value=val_raw.uuid),
+                                "label_var": tk.StringVar(value=val_raw.label),
+                                "type": "internal_link"
+                            }
+                        elif f in ref_fields:
+                            field_data = {
+                                "key_var": key_var,
+                                "val_var": tk.StringVar(value="" if pd.isna(val_raw) else str(val_raw)),
+                                "label_var": tk.StringVar(),
+                                "type": "internal_link"
+                            }
+                        else:
                             val_var = tk.StringVar(value=str(val_raw))
                             field_data = {"key_var": key_var, "val_var": val_var}
-                        
+                        field_data["orig_key"] = f
+
                         # ✅ 加入每個欄位到當前 group 中
                         group_data["fields"].append(field_data)
                     editable_groups.append(group_data)
@@ -1012,10 +6217,16 @@ class App:
                         tk.Entry(row_frame, textvariable=field_obj["label_var"], width=20).pack(side="left", padx=5)
                         tk.Entry(row_frame, textvariable=field_obj["val_var"], width=30).pack(side="left", padx=5)
 
-                        def browse_file(var=field_obj["val_var"]):
+                        def browse_file(var=field_obj["val_var"], label_var=field_obj["label_var"]):
                             file_path = filedialog.askopenfilename()
                             if file_path:
-                                var.set(file_path)
+                                try:
+                                    var.set(self.data_manager.attachments.add(file_path))
+                                except Exception as e:
+                                    messagebox.showerror("複製失敗", f"無法複製檔案：{e}")
+                                    return
+                                if not label_var.get().strip():
+                                    label_var.set(os.path.basename(file_path))
 
                         tk.Button(row_frame, text="選擇檔案", command=browse_file).pack(side="left")
 
@@ -1032,6 +6243,15 @@ class App:
 
                         tk.Button(row_frame, text="貼上 UUID", command=paste_uuid).pack(side="left")
 
+                        target_db = ref_fields.get(field_obj["key_var"].get().strip())
+                        if target_db in self.data_manager.data:
+                            # 關聯欄位可直接從目標資料庫挑選紀錄
+                            choices = self.record_choices(target_db)
+                            picker = ttk.Combobox(row_frame, values=list(choices), width=20, state="readonly")
+                            picker.pack(side="left", padx=5)
+                            picker.bind("<<ComboboxSelected>>", lambda e, p=picker, c=choices, v=field_obj["val_var"], l=field_obj["label_var"]:
+                                        (v.set(c[p.get()]), l.set(p.get())))
+
                     else:
                         # 嘗試從 dataframe 抓取所有該欄位曾用過的值
                         key = field_obj["key_var"].get().strip()
@@ -1066,14 +6286,13 @@ class App:
                         
                         file_path = filedialog.askopenfilename()
                         if file_path:
-                            filename = os.path.basename(file_path)
-                            unique_name = f"{uuid.uuid4().hex}_{filename}"
-                            dest_path = os.path.join(LINKS_FOLDER, unique_name)
                             try:
-                                shutil.copy2(file_path, dest_path)
-                                path_var.set(dest_path)
+                                path_var.set(self.data_manager.attachments.add(file_path))
                             except Exception as e:
                                 messagebox.showerror("複製失敗", f"無法複製檔案：{e}")
+                                return
+                            if not label_var.get().strip():
+                                label_var.set(os.path.basename(file_path))
 
                     tk.Button(row_frame, text="選擇檔案", command=browse_file).pack(side="left")
                     
@@ -1167,7 +6386,7 @@ class App:
             # 讀取既有 period 表格內容
             if os.path.exists(period_path):
                 try:
-                    df_period = pd.read_excel(period_path)
+                    df_period = self.data_manager.load_period(period_path)
                     for r_idx, row in df_period.iterrows():
                         row_vars = [tk.StringVar(value=str(row.get(col, ""))) for col in ["標題", "下次間隔__月", "執行前__月提醒", "此次執行日期", "下次執行日期"]]
                         period_data.append(row_vars)
@@ -1201,19 +6420,15 @@ class App:
                     next_exec_label.grid(row=r_idx+1, column=4)
 
                     # 計算結果（嘗試將欄位自動更新）
-                    def update_next_exec():
-                        try:
-                            months = int(row_vars[1].get())
-                            exec_date = datetime.strptime(row_vars[3].get(), "%Y-%m-%d")
-                            next_date = exec_date + timedelta(days=months * 30)
-                            next_exec_label.config(text=next_date.strftime("%Y-%m-%d"))
-                            row_vars[4].set(next_date.strftime("%Y-%m-%d"))  # 同步更新值
-                        except:
-                            next_exec_label.config(text="")
+                    def update_next_exec(row_vars=row_vars, next_exec_label=next_exec_label):
+                        next_date = next_execution_date(row_vars[3].get(), row_vars[1].get())
+                        next_exec_label.config(text=next_date)
+                        if next_date:
+                            row_vars[4].set(next_date)  # 同步更新值
 
                     # 綁定內容變動時自動更新
-                    row_vars[1].trace_add("write", lambda *args: update_next_exec())
-                    row_vars[3].trace_add("write", lambda *args: update_next_exec())
+                    row_vars[1].trace_add("write", lambda *args, f=update_next_exec: f())
+                    row_vars[3].trace_add("write", lambda *args, f=update_next_exec: f())
 
                     # 初始更新
                     update_next_exec()
@@ -1238,11 +6453,42 @@ class App:
             edit_button.pack_forget()
             render_detail()
 
+        def reopen():
+            new_index = self.data_manager.index_of(self.current_database, uuid_str)
+            if new_index is not None:
+                self.open_detail(new_index)
+
+        def neighbours():
+            # 目前頁面／查詢結果中的位置，回傳 (列索引序列, 位置)；不在其中時位置為 -1
+            rows = self.view_rows()
+            current = self.data_manager.index_of(self.current_database, uuid_str)
+            return rows, (rows.get_indexer([current])[0] if current is not None else -1)
+
+        def step(direction):
+            if is_editing.get() and not messagebox.askyesno("尚未儲存", "尚未儲存變更，確定要離開嗎？", parent=top):
+                return
+            rows, pos = neighbours()
+            if pos >= 0 and 0 <= pos + direction < len(rows):
+                self.open_detail(rows[pos + direction])
+
+        def prefetch_neighbours():
+            rows, pos = neighbours()
+            if pos < 0:
+                return
+            around = rows[max(pos - 1, 0):pos + DETAIL_PREFETCH + 1]
+            uuids = self.data_manager.preview(self.current_database).loc[around, "UUID"].astype(str)
+            self.data_manager.details.prefetch(self.current_database, [u for u in uuids if u != uuid_str])
+
         def save_and_exit_edit():
             if is_editing.get():
-                save_changes()
+                try:
+                    if not self.run_save(self.current_database, save_changes):
+                        return
+                except KeyError as e:
+                    messagebox.showerror("儲存失敗", str(e.args[0]))
+                    return
                 top.destroy()
-                self.open_detail(index)
+                reopen()
                 self.refresh_grid()
 
         
@@ -1250,11 +6496,28 @@ class App:
         top.protocol("WM_DELETE_WINDOW", on_close)
         save_button = tk.Button(button_frame, text="保存變更並退出編輯", command=save_and_exit_edit)
         edit_button = tk.Button(button_frame, text="編輯模式切換", command=toggle_edit)
+        tk.Button(button_frame, text="◀ 上一筆", command=lambda: step(-1)).pack(side="left", padx=5)
+        tk.Button(button_frame, text="下一筆 ▶", command=lambda: step(1)).pack(side="left", padx=5)
+        tk.Button(button_frame, text="📜 歷史", command=lambda: self.open_record_history(self.current_database, uuid_str)).pack(side="left", padx=5)
         tk.Button(button_frame, text="關閉", command=on_close).pack(side="left", padx=5)
 
+        self.detail_refresh = (uuid_str, render_detail, is_editing)
         render_detail()
+        prefetch_neighbours()
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = App(root)
-    root.mainloop()
+    multiprocessing.freeze_support()  # 打包成 exe 後，批次輸出的子程序需要
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", action="store_true", help="同時啟動本機 HTTP/JSON API")
+    parser.add_argument("--headless", action="store_true", help="不開視窗，只啟動 API")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--work-orders", action="store_true", help="不開視窗，產生到期的定期工單後結束")
+    args = parser.parse_args()
+    if args.work_orders:
+        run_work_orders()
+    elif args.headless:
+        serve_headless(args.port)
+    else:
+        root = tk.Tk()
+        app = App(root, api_port=args.port if args.serve else None)
+        root.mainloop()